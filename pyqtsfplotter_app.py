@@ -5,11 +5,23 @@
 #   guiClass_Instance_Of_It
 #   objectsAndFunctions
 
+import time
+# Startup steps as (name, time.perf_counter()), printed with --profile-startup.
+startupTimes = [('start', time.perf_counter())]
+
+def markStartup(name):
+    startupTimes.append((name, time.perf_counter()))
+
+def printStartupProfile():
+    print('Startup profile (ms):')
+    for (name0, t0), (name1, t1) in zip(startupTimes[:-1], startupTimes[1:]):
+        print('  {0:>8.1f}  {1:>8.1f}  {2}'.format((t1 - t0) * 1000, (t1 - startupTimes[0][1]) * 1000, name1))
+
 import sys
 from PyQt5 import QtCore, QtGui, QtWidgets
+markStartup('import PyQt5')
 import numpy
-from matplotlib.backends import backend_qt5agg as mpl_qt5
-from matplotlib import figure as mpl_figure
+markStartup('import numpy')
 
 import os
 if os.name == 'nt':
@@ -21,7 +33,11 @@ if os.name == 'nt':
 from pyqtsfplotter_gui import Ui_MainWindow
 #
 from pyqtsfplotter_models import DataFileObject, DataInSingleFileListModel, \
-    DataFilesListModel, PlotListModel
+    DataFilesListModel, DataFilesImporter, PlotListModel, SvdService, GlobalFitter
+from pyqtsfplotter_cache import ParseCache
+import pyqtsfplotter_core
+import pyqtsfplotter_session
+markStartup('import GUI and models')
 
 def aboutMessage():
     QtWidgets.QMessageBox.information(None, 'About PyQt Stopped-Flow Plotter', \
@@ -45,13 +61,15 @@ class QMainWindow_Modified(QtWidgets.QMainWindow):
         super().__init__()
         self.setAcceptDrops(True)
         
-        
+    # Called to save the session before quitting. Returns False if not saved.
+    saveSession = None
     def closeEvent(self, event):
         reallyQuit = QtWidgets.QMessageBox.warning(self, 'Exit Program', \
-            'All unsaved data will be lost! \nDo you really want to quit?', \
-            QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.No, \
-            QtWidgets.QMessageBox.No)
-        if reallyQuit == QtWidgets.QMessageBox.Yes:
+            'All unsaved data will be lost! \nSave the session before quitting?', \
+            QtWidgets.QMessageBox.Save | QtWidgets.QMessageBox.Discard | QtWidgets.QMessageBox.Cancel, \
+            QtWidgets.QMessageBox.Cancel)
+        if reallyQuit == QtWidgets.QMessageBox.Discard \
+                or (reallyQuit == QtWidgets.QMessageBox.Save and self.saveSession and self.saveSession()):
             event.accept()
         else:
             event.ignore()
@@ -61,6 +79,15 @@ class QMainWindow_Modified(QtWidgets.QMainWindow):
         super().resizeEvent(event)
         self.windowSizeChanged.emit()
         
+    # Emitted once, after the window is painted for the first time.
+    firstPainted = QtCore.pyqtSignal()
+    __painted = False
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if not self.__painted:
+            self.__painted = True
+            self.firstPainted.emit()
+        
     filesDropped = QtCore.pyqtSignal(list)
     def dragEnterEvent(self, event):
         if event.mimeData().hasUrls():
@@ -71,14 +98,6 @@ class QMainWindow_Modified(QtWidgets.QMainWindow):
     def dropEvent(self, event):
         self.filesDropped.emit(event.mimeData().urls())
         
-        
-class MPLToolbar_Modified(mpl_qt5.NavigationToolbar2QT):
-    toolitems = [item for item in mpl_qt5.NavigationToolbar2QT.toolitems \
-        if item[0] != 'Save']
-    
-    def __init__(self, canvas, parent, coordinates=True):        
-        super().__init__(canvas, parent, coordinates)
-        # Removes the save tool button.
               
 # Adds matplotlib widget, and sets up event handlers for the UI.
 class App_MainWindow(Ui_MainWindow):               
@@ -95,6 +114,124 @@ class App_MainWindow(Ui_MainWindow):
         self.pushButton_Import_Raw_Data.clicked.connect(self.importRawFiles)
         self.toolButton_Remove_File.clicked.connect(self.removeFileFromList)
         
+        # Selects a data block in multi-block ProDataCSV files. Hidden for single-block files.
+        self.comboBox_Select_Block = QtWidgets.QComboBox(self.tab_Raw_Data)
+        self.comboBox_Select_Block.setToolTip('Data block shown from this file.')
+        self.comboBox_Select_Block.setSizeAdjustPolicy(QtWidgets.QComboBox.AdjustToContents)
+        self.comboBox_Select_Block.hide()
+        self.horizontalLayout_10.insertWidget(1, self.comboBox_Select_Block)
+        self.comboBox_Select_Block.activated.connect(self.blockSelected)
+        
+        # SVD factors are cached per selection; large ones are computed in a background thread.
+        self.svdService = SvdService()
+        self.svdService.finished.connect(self.svdFinished)
+        self.svdService.failed.connect(self.svdFailed)
+        self.__svdPending = None
+        
+        # Replaces the data of the current file by its reconstruction from the first n SVD components.
+        self.toolButton_Denoise = QtWidgets.QToolButton(self.tab_Raw_Data)
+        self.toolButton_Denoise.setText('Denoise')
+        self.toolButton_Denoise.setCheckable(True)
+        self.toolButton_Denoise.setToolTip('Use the reconstruction of this file from its first n SVD components ' \
+            + 'instead of the raw data, for all traces added from it.')
+        self.horizontalLayout_4.insertWidget(self.horizontalLayout_4.indexOf(self.checkBox_eigvalue) + 1, \
+            self.toolButton_Denoise)
+        self.toolButton_Denoise.clicked.connect(self.denoiseFile)
+        self.__denoisePending = None
+        
+        # Global fit of the selected time traces to exponentials with shared rate constants.
+        self.spinBox_Fit = QtWidgets.QSpinBox(self.tab_Raw_Data)
+        self.spinBox_Fit.setRange(1, 6)
+        self.spinBox_Fit.setValue(2)
+        self.spinBox_Fit.setSuffix(' exp')
+        self.spinBox_Fit.setToolTip('Number of exponential decays of the global fit.')
+        self.checkBox_Fit_SVD = QtWidgets.QCheckBox('on SVD', self.tab_Raw_Data)
+        self.checkBox_Fit_SVD.setToolTip('Fit only the first n SVD components of the selected traces, ' \
+            + 'which is faster for many traces.')
+        self.toolButton_Fit = QtWidgets.QToolButton(self.tab_Raw_Data)
+        self.toolButton_Fit.setText('Global Fit')
+        self.toolButton_Fit.setToolTip('Fit selected time traces to exponentials with shared rate constants. ' \
+            + 'Sends decay-associated spectra, fits and residuals to plot.')
+        for k, widget in enumerate((self.toolButton_Fit, self.spinBox_Fit, self.checkBox_Fit_SVD)):
+            self.horizontalLayout_4.insertWidget( \
+                self.horizontalLayout_4.indexOf(self.toolButton_Denoise) + 1 + k, widget)
+        self.toolButton_Fit.clicked.connect(self.globalFitSelected)
+        self.globalFitter = GlobalFitter()
+        self.globalFitter.finished.connect(self.globalFitFinished)
+        self.globalFitter.failed.connect(self.globalFitFailed)
+        self.__fitPending = None
+        
+        # Adds the current file averaged over bins of timepoints and wavelengths as a new file.
+        self.toolButton_Rebin = QtWidgets.QToolButton(self.tab_Raw_Data)
+        self.toolButton_Rebin.setText('Rebin')
+        self.toolButton_Rebin.setToolTip('Add this file averaged over bins of timepoints and wavelengths ' \
+            + 'as a new file, with fewer points to plot, decompose and export.')
+        self.spinBox_Time_Bins = QtWidgets.QSpinBox(self.tab_Raw_Data)
+        self.spinBox_Time_Bins.setRange(0, 100000)
+        self.spinBox_Time_Bins.setValue(100)
+        self.spinBox_Time_Bins.setSuffix(' t bins')
+        self.spinBox_Time_Bins.setSpecialValueText('all t')
+        self.spinBox_Time_Bins.setToolTip('Number of time bins; empty log bins are left out.')
+        self.comboBox_Time_Bins = QtWidgets.QComboBox(self.tab_Raw_Data)
+        self.comboBox_Time_Bins.addItems(['log spaced', 'equal count'])
+        self.comboBox_Time_Bins.setToolTip('Time bins equally spaced on a log scale, ' \
+            + 'or of equal numbers of timepoints.')
+        self.spinBox_Wavelength_Bins = QtWidgets.QSpinBox(self.tab_Raw_Data)
+        self.spinBox_Wavelength_Bins.setRange(0, 100000)
+        self.spinBox_Wavelength_Bins.setSuffix(' w bins')
+        self.spinBox_Wavelength_Bins.setSpecialValueText('all w')
+        self.spinBox_Wavelength_Bins.setToolTip('Number of wavelength bins, of equal numbers of wavelengths.')
+        rebinLayout = QtWidgets.QHBoxLayout()
+        for widget in (self.toolButton_Rebin, self.spinBox_Time_Bins, self.comboBox_Time_Bins, \
+                self.spinBox_Wavelength_Bins):
+            rebinLayout.addWidget(widget)
+        rebinLayout.addStretch()
+        self.verticalLayout_2.addLayout(rebinLayout)
+        self.toolButton_Rebin.clicked.connect(self.rebinFile)
+        
+        # Files are parsed in background threads, with progress shown next to the import button.
+        self.fileImporter = DataFilesImporter()
+        self.fileImporter.fileImported.connect(self.fileImported)
+        self.fileImporter.progressChanged.connect(self.importProgressChanged)
+        self.fileImporter.finished.connect(self.importFinished)
+        self.progressBar_Import = QtWidgets.QProgressBar(self.centralwidget)
+        self.progressBar_Import.setFormat('%v / %m')
+        self.progressBar_Import.hide()
+        self.toolButton_Cancel_Import = QtWidgets.QToolButton(self.centralwidget)
+        self.toolButton_Cancel_Import.setText('Cancel')
+        self.toolButton_Cancel_Import.setToolTip('Stop importing files. Files already imported are kept.')
+        self.toolButton_Cancel_Import.hide()
+        self.toolButton_Cancel_Import.clicked.connect(self.fileImporter.cancel)
+        self.horizontalLayout_9.addWidget(self.progressBar_Import)
+        self.horizontalLayout_9.addWidget(self.toolButton_Cancel_Import)
+        self.__selectNextImported = False
+        self.importReport = None
+        
+        # Parsed files are cached on disk, keyed by path, size, mtime and content.
+        DataFileObject.parseCache = ParseCache()
+        self.toolButton_Clear_Cache = QtWidgets.QToolButton(self.centralwidget)
+        self.toolButton_Clear_Cache.setText('Clear Cache')
+        self.toolButton_Clear_Cache.setToolTip('Delete parsed data cached in ' \
+            + DataFileObject.parseCache.cacheDir)
+        self.toolButton_Clear_Cache.clicked.connect(self.clearParseCache)
+        self.horizontalLayout_9.insertWidget(2, self.toolButton_Clear_Cache)
+        
+        # The whole workspace is saved to and restored from one session file.
+        self.toolButton_Save_Session = QtWidgets.QToolButton(self.centralwidget)
+        self.toolButton_Save_Session.setText('Save Session ...')
+        self.toolButton_Save_Session.setToolTip('Save all files, plotted traces and plot settings in one file.')
+        self.toolButton_Save_Session.clicked.connect(self.saveSession)
+        self.toolButton_Open_Session = QtWidgets.QToolButton(self.centralwidget)
+        self.toolButton_Open_Session.setText('Open Session ...')
+        self.toolButton_Open_Session.setToolTip('Replace all files and plotted traces by a saved session.')
+        self.toolButton_Open_Session.clicked.connect(lambda: self.openSession())
+        self.horizontalLayout_9.insertWidget(3, self.toolButton_Save_Session)
+        self.horizontalLayout_9.insertWidget(4, self.toolButton_Open_Session)
+        MainWindow.saveSession = self.saveSession
+        self.__savedSessionName = ''
+        # Session file whose arrays are memory-mapped by the open session, if any.
+        self.__openedSessionName = ''
+        
         # Lets user pick time traces or spectra from raw data files.
         self.__axisType = True
         self.toolButton_Toggle_Axis.clicked.connect(self.toggleAxis)
@@ -132,36 +269,8 @@ class App_MainWindow(Ui_MainWindow):
         self.toolButton_Scatter.clicked.connect(self.scatterPlotSelected)
         self.toolButton_Hide.clicked.connect(self.hidePlotSelected)
         self.pushButton_Export_Traces.clicked.connect(self.saveSelectedTracesToTxt)
-        MainWindow.windowSizeChanged.connect(self.resizedWindowArea)
         MainWindow.filesDropped.connect(self.importDroppedFiles)
         
-        # Embeds matplotlib plots.        
-        self.figures = [mpl_figure.Figure(), mpl_figure.Figure()]
-        self.canvases = [mpl_qt5.FigureCanvasQTAgg(fig) for fig in self.figures]
-        self.toolbars = [MPLToolbar_Modified(self.canvases[0], self.stackedWidget_Traces_Plot), \
-            MPLToolbar_Modified(self.canvases[1], self.stackedWidget_Spectra_Plot)]
-        self.toolbars[0].locLabel.setFont( \
-            QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont))
-        self.toolbars[0].locLabel.setAlignment( \
-            QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
-        self.toolbars[1].locLabel.setFont( \
-            QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont))
-        self.toolbars[1].locLabel.setAlignment( \
-            QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
-        self.verticalLayout_4.addWidget(self.canvases[0])
-        self.verticalLayout_4.addWidget(self.toolbars[0])
-        self.verticalLayout_5.addWidget(self.canvases[1])
-        self.verticalLayout_5.addWidget(self.toolbars[1])
-        self.plotListModels = [PlotListModel(fig) for fig in self.figures]
-        self.tableView_Traces.setModel(self.plotListModels[0])
-        self.tableView_Spectra.setModel(self.plotListModels[1])
-
-        self.figures[0].axes[0].set_xlabel('Time (s)', fontsize = PlotListModel.fontSize)
-        self.figures[0].axes[0].tick_params(labelsize=PlotListModel.fontSize)
-        self.figures[1].axes[0].set_xlabel('Wavelength (nm)', fontsize = PlotListModel.fontSize)
-        self.figures[1].axes[0].tick_params(labelsize=PlotListModel.fontSize)
-        self.tabWidget.currentChanged.connect(self.tabSwitch)
-
         # Specials
         self.toolButton_Reset.clicked.connect(self.resetCurrentCanvas)
         self.pushButton_Exec.clicked.connect(self.execPlotCommand)
@@ -174,6 +283,88 @@ class App_MainWindow(Ui_MainWindow):
         self.toolButton_Ref_To.clicked.connect(self.refSelectedTo)
         self.toolButton_Internal_Ref.clicked.connect(self.internalRef)
         self.toolButton_Mean_Std_Dev.clicked.connect(self.addMeanStdDev)
+        
+        # Traces with different x-axis points are resampled onto a common grid for Mean & Std. Dev.,
+        # Difference and export, rather than ignored.
+        self.comboBox_X_Grid = QtWidgets.QComboBox(self.widget_left)
+        self.comboBox_X_Grid.addItems(['Same x only', 'Union of x', 'Intersection of x', 'Linear grid', \
+            'Log grid'])
+        self.comboBox_X_Grid.setToolTip('How selected traces with different x-axis points are combined: ' \
+            + 'ignored, or interpolated onto all their points, the points they all have, ' \
+            + 'or equally or logarithmically spaced points over the range they share.')
+        self.spinBox_Grid_Points = QtWidgets.QSpinBox(self.widget_left)
+        self.spinBox_Grid_Points.setRange(2, 100000)
+        self.spinBox_Grid_Points.setValue(1000)
+        self.spinBox_Grid_Points.setSuffix(' pts')
+        self.spinBox_Grid_Points.setToolTip('Number of points of linear and log grids.')
+        self.spinBox_Grid_Points.setEnabled(False)
+        self.comboBox_X_Grid.currentIndexChanged.connect( \
+            lambda k: self.spinBox_Grid_Points.setEnabled(self.gridKinds[k] in ('linear', 'log')))
+        gridLayout = QtWidgets.QHBoxLayout()
+        gridLayout.addWidget(QtWidgets.QLabel('Different x:', self.widget_left))
+        gridLayout.addWidget(self.comboBox_X_Grid)
+        gridLayout.addWidget(self.spinBox_Grid_Points)
+        gridLayout.addStretch()
+        for k in range(self.verticalLayout.count()):
+            if self.verticalLayout.itemAt(k).layout() is self.horizontalLayout_7:
+                self.verticalLayout.insertLayout(k + 1, gridLayout)
+                break
+        markStartup('set up window')
+        
+        # Matplotlib is loaded and plots are set up once the window has been painted.
+        self.__mainWindow = MainWindow
+        self.figures = []
+        MainWindow.firstPainted.connect(self.windowPainted)
+        
+    def windowPainted(self):
+        markStartup('first paint')
+        QtCore.QTimer.singleShot(0, self.setupPlots)
+        
+    # Embeds matplotlib plots. Canvases are built by plotCanvas(), the spectra one when its tab is opened.
+    def setupPlots(self):
+        if self.figures:
+            return
+        from matplotlib import figure as mpl_figure
+        markStartup('import matplotlib')
+        self.figures = [mpl_figure.Figure(), mpl_figure.Figure()]
+        self.canvases = [None, None]
+        self.toolbars = [None, None]
+        self.plotListModels = [PlotListModel(fig) for fig in self.figures]
+        self.tableView_Traces.setModel(self.plotListModels[0])
+        self.tableView_Spectra.setModel(self.plotListModels[1])
+
+        self.figures[0].axes[0].set_xlabel('Time (s)', fontsize = PlotListModel.fontSize)
+        self.figures[0].axes[0].tick_params(labelsize=PlotListModel.fontSize)
+        self.figures[1].axes[0].set_xlabel('Wavelength (nm)', fontsize = PlotListModel.fontSize)
+        self.figures[1].axes[0].tick_params(labelsize=PlotListModel.fontSize)
+        self.tabWidget.currentChanged.connect(self.tabSwitch)
+        self.__resizeTimer = QtCore.QTimer(self.__mainWindow)
+        self.__resizeTimer.setSingleShot(True)
+        self.__resizeTimer.setInterval(150)
+        self.__resizeTimer.timeout.connect(self.resizeFinished)
+        self.__mainWindow.windowSizeChanged.connect(self.resizedWindowArea)
+        self.plotCanvas(self.tabWidget.currentIndex())
+        markStartup('set up plots')
+        
+    # Returns the canvas of plot j, building it and its toolbar on first use.
+    def plotCanvas(self, j):
+        if self.canvases[j] is None:
+            import pyqtsfplotter_canvas
+            markStartup('import matplotlib Qt backend')
+            self.canvases[j] = pyqtsfplotter_canvas.FigureCanvas(self.figures[j])
+            self.toolbars[j] = pyqtsfplotter_canvas.MPLToolbar_Modified(self.canvases[j], \
+                self.stackedWidget_Traces_Plot if j == 0 else self.stackedWidget_Spectra_Plot)
+            self.toolbars[j].locLabel.setFont( \
+                QtGui.QFontDatabase.systemFont(QtGui.QFontDatabase.FixedFont))
+            self.toolbars[j].locLabel.setAlignment( \
+                QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
+            pLayout = self.verticalLayout_4 if j == 0 else self.verticalLayout_5
+            pLayout.addWidget(self.canvases[j])
+            pLayout.addWidget(self.toolbars[j])
+            # Lines added while there was no canvas are laid out now.
+            self.plotListModels[j].refreshLayout()
+            markStartup('build canvas ' + str(j))
+        return self.canvases[j]
 
     # Event handling function
     def execPlotCommand(self):
@@ -194,7 +385,9 @@ class App_MainWindow(Ui_MainWindow):
                 self.autoResizePlotRange()
     
     def resetCurrentCanvas(self):
-        j = self.tabWidget.currentIndex()
+        self.resetCanvas(self.tabWidget.currentIndex())
+    
+    def resetCanvas(self, j):
         # Not yet determined if this will cause memory leak.
         self.figures[j].axes[0].cla()
         self.figures[j].axes[0].remove()
@@ -213,7 +406,8 @@ class App_MainWindow(Ui_MainWindow):
             self.figures[1].axes[0].set_xlabel('Wavelength (nm)', fontsize = PlotListModel.fontSize)
             self.figures[1].axes[0].tick_params(labelsize=PlotListModel.fontSize)        
         newModel.redrawAll()
-        self.comboBox_Ref_To.setModel(self.plotListModels[j])
+        self.comboBox_Ref_To.setModel(self.plotListModels[self.tabWidget.currentIndex()])
+        self.previewRawTrace()
             
     def setPlotGrid(self, state):
         self.plotListModels[self.stackedWidget_right.currentIndex()].setGrid( \
@@ -262,8 +456,12 @@ class App_MainWindow(Ui_MainWindow):
             self.doubleSpinBox_yMin.setValue(y0)
             self.doubleSpinBox_yMax.setValue(y1)
         
+    # Lays out the plot once resizing pauses, rather than on every resize event.
     def resizedWindowArea(self):
-        self.figures[self.stackedWidget_right.currentIndex()].tight_layout()
+        self.__resizeTimer.start()
+        
+    def resizeFinished(self):
+        self.plotListModels[self.stackedWidget_right.currentIndex()].refreshLayout()
         
     def resetRangeSpinBoxes(self):
         x0, x1, y0, y1 = ( \
@@ -275,6 +473,7 @@ class App_MainWindow(Ui_MainWindow):
         self.doubleSpinBox_yMax.setValue(y1)
         
     def tabSwitch(self, j):
+        self.plotCanvas(j)
         self.stackedWidget_right.setCurrentIndex(j)
         self.figures[j].axes[0].set_yscale( \
             'log' if self.checkBox_LogY.isChecked() else 'linear')
@@ -367,10 +566,10 @@ class App_MainWindow(Ui_MainWindow):
             pTableView = self.tableView_Spectra
         else:
             return
-        if pTableView.selectedIndexes():
-            values = [QtCore.Qt.Checked] * len(pTableView.selectedIndexes())
-            pTableView.model().setData( \
-                pTableView.selectedIndexes(), values, role = QtCore.Qt.CheckStateRole)
+        indices = pTableView.selectedIndexes()
+        if indices:
+            values = [QtCore.Qt.Checked] * len(indices)
+            pTableView.model().setData(indices, values, role = QtCore.Qt.CheckStateRole)
             
     def scatterPlotSelected(self):
         if self.tabWidget.currentIndex() == 0:
@@ -379,10 +578,10 @@ class App_MainWindow(Ui_MainWindow):
             pTableView = self.tableView_Spectra
         else:
             return
-        if pTableView.selectedIndexes():
-            values = [QtCore.Qt.PartiallyChecked] * len(pTableView.selectedIndexes())
-            pTableView.model().setData( \
-                pTableView.selectedIndexes(), values, role = QtCore.Qt.CheckStateRole)
+        indices = pTableView.selectedIndexes()
+        if indices:
+            values = [QtCore.Qt.PartiallyChecked] * len(indices)
+            pTableView.model().setData(indices, values, role = QtCore.Qt.CheckStateRole)
             
     def hidePlotSelected(self):
         if self.tabWidget.currentIndex() == 0:
@@ -391,11 +590,35 @@ class App_MainWindow(Ui_MainWindow):
             pTableView = self.tableView_Spectra
         else:
             return
-        if pTableView.selectedIndexes():
-            values = [QtCore.Qt.Unchecked] * len(pTableView.selectedIndexes())
-            pTableView.model().setData( \
-                pTableView.selectedIndexes(), values, role = QtCore.Qt.CheckStateRole) 
+        indices = pTableView.selectedIndexes()
+        if indices:
+            values = [QtCore.Qt.Unchecked] * len(indices)
+            pTableView.model().setData(indices, values, role = QtCore.Qt.CheckStateRole)
                 
+    # Selected rows of plot list j as a TraceSet, for the operations in pyqtsfplotter_core.
+    def selectedTraces(self, j, indices):
+        return self.plotListModels[j].traces([index1.row() for index1 in indices if index1.column() == 0])
+    
+    def appendTraces(self, j, traces):
+        self.plotListModels[j].appendRow(traces.names, traces.xs, traces.ys, derived = traces.derived)
+        self.autoResizePlotRange()
+    
+    # Kind of common grid of each item of comboBox_X_Grid (see pyqtsfplotter_core.commonGrid).
+    gridKinds = (None, ) + pyqtsfplotter_core.gridKinds
+    
+    # traces on one common grid, if they have different x-axis points and a grid is chosen; otherwise
+    # as they are. None if they can't be, after telling why.
+    def onCommonGrid(self, traces):
+        kind = self.gridKinds[self.comboBox_X_Grid.currentIndex()]
+        if kind is None or len(traces.groups()) < 2:
+            return traces
+        grid, issue = pyqtsfplotter_core.commonGrid(traces.xs, kind, self.spinBox_Grid_Points.value())
+        if issue:
+            QtWidgets.QMessageBox.warning(self.centralwidget, 'Different X-Axis Points', issue.message, \
+                QtWidgets.QMessageBox.Ok, QtWidgets.QMessageBox.Ok)
+            return None
+        return traces.resampled(grid)
+    
     def addMeanStdDev(self):
         j = self.tabWidget.currentIndex()
         if j == 0:
@@ -404,27 +627,14 @@ class App_MainWindow(Ui_MainWindow):
             pTableView = self.tableView_Spectra
         else:
             return
-        indices = pTableView.selectedIndexes()
-        n = len(indices)
-        if n > 1:
-            x0, y0 = self.plotListModels[j].data(indices[0], role = QtCore.Qt.UserRole)
-            name0 = self.plotListModels[j].data(indices[0], role = QtCore.Qt.DisplayRole)
-            y = [y0]
-            count = 0
-            for i in range (1, n):
-                x1, y1 = self.plotListModels[j].data(indices[i], role = QtCore.Qt.UserRole)
-                #name1 = self.plotListModels[j].data(indices[i], role = QtCore.Qt.DisplayRole)
-                if numpy.array_equal(x0, x1):
-                    y.append(y1)
-            n0 = n - count;
-            if n0 > 1:
-                y_mean = numpy.mean(y, axis = 0)
-                y_stddev = numpy.std(y, axis = 0, ddof = 1)                
-                self.hidePlotSelected()
-                self.selectNoneTraces()
-                self.plotListModels[j].appendRow([name0 + ' (Mean)', name0 + ' (StdDev.)'], \
-                    [x0] * 2, [y_mean, y_stddev])
-                self.autoResizePlotRange()
+        traces = self.onCommonGrid(self.selectedTraces(j, pTableView.selectedIndexes()))
+        if traces is None:
+            return
+        results = pyqtsfplotter_core.meanStdDev(traces)
+        if len(results):
+            self.hidePlotSelected()
+            self.selectNoneTraces()
+            self.appendTraces(j, results)
     
     def internalRef(self):
         x_ref = self.doubleSpinBox_Internal_Ref.value()
@@ -435,24 +645,12 @@ class App_MainWindow(Ui_MainWindow):
             pTableView = self.tableView_Spectra
         else:
             return
-        indices = pTableView.selectedIndexes()
-        n = len(indices)
-        if n > 0:
-            x = []
-            y = []
-            names = []
-            for i in range (n):
-                (x1, y1) = self.plotListModels[j].data(indices[i], role = QtCore.Qt.UserRole)
-                name1 = self.plotListModels[j].data(indices[i], role = QtCore.Qt.DisplayRole)
-                subscript = numpy.absolute(x1 - x_ref).argmin()
-                y_ref = y1[subscript]
-                x.append(x1)
-                y.append(y1 - y_ref)
-                names.append(name1 + ' (-Ref)')
+        traces = self.selectedTraces(j, pTableView.selectedIndexes())
+        if len(traces):
+            results = pyqtsfplotter_core.subtractValueAt(traces, x_ref)
             self.hidePlotSelected()
             self.selectNoneTraces()
-            self.plotListModels[j].appendRow(names, x, y)
-            self.autoResizePlotRange() 
+            self.appendTraces(j, results)
                         
     def refSelectedTo(self):
         number = self.doubleSpinBox_By.value()
@@ -464,21 +662,20 @@ class App_MainWindow(Ui_MainWindow):
         else:
             return
         index0 = self.plotListModels[j].index(self.comboBox_Ref_To.currentIndex(), 0);
-        indices = pTableView.selectedIndexes()
-        n = len(indices)
-        if n > 0:
+        traces = self.selectedTraces(j, pTableView.selectedIndexes())
+        if len(traces):
             x0, y0 = self.plotListModels[j].data(index0, role = QtCore.Qt.UserRole)
-            y = []
-            names = []
-            count = 0
-            for i in range(n):
-                (x1, y1) = self.plotListModels[j].data(indices[i], role = QtCore.Qt.UserRole)
-                name1 = self.plotListModels[j].data(indices[i], role = QtCore.Qt.DisplayRole)
-                if numpy.array_equal(x0, x1):
-                    y.append(y1 - y0)
-                    names.append(name1 + ' (Diff)')
-                else:
-                    count += 1
+            ref = self.plotListModels[j].traces([index0.row()])
+            # The reference is resampled with the selected traces, as the last one.
+            traces.append(ref.names[0], x0, y0, ref.derived[0])
+            traces = self.onCommonGrid(traces)
+            if traces is None:
+                return
+            ref = pyqtsfplotter_core.TraceSet([traces.names.pop()], [traces.xs.pop()], [traces.ys.pop()], \
+                [traces.derived.pop()])
+            x0, y0 = ref.xs[0], ref.ys[0]
+            results = pyqtsfplotter_core.subtractTrace(traces, x0, y0, ref.names[0], ref.source(0))
+            count = results.skipped(pyqtsfplotter_core.X_MISMATCH)
             if count > 0:
                 msgBox = QtWidgets.QMessageBox.question(self.centralwidget, 'Different Time Data', \
                     'Found ' + str(count) + ' selected time traces with different time points. They will be ignored when modifying data.', \
@@ -489,8 +686,7 @@ class App_MainWindow(Ui_MainWindow):
                     return
             self.hidePlotSelected()
             self.selectNoneTraces()
-            self.plotListModels[j].appendRow(names, [x0] * (n - count), y)
-            self.autoResizePlotRange()        
+            self.appendTraces(j, results)
 
     def addSelectedBy(self):
         number = self.doubleSpinBox_By.value()
@@ -503,22 +699,12 @@ class App_MainWindow(Ui_MainWindow):
             pTableView = self.tableView_Spectra
         else:
             return
-        indices = pTableView.selectedIndexes()
-        n = len(indices)
-        if n > 0:
-            x = []
-            y = []
-            names = []
-            for i in range(n):
-                x1, y1 = self.plotListModels[j].data(indices[i], role = QtCore.Qt.UserRole)
-                name1 = self.plotListModels[j].data(indices[i], role = QtCore.Qt.DisplayRole)
-                x.append(x1)
-                y.append(y1 + number)
-                names.append(name1 + ' (' + '+' if number > 0 else '-' + str(abs(number)) + ')')
+        traces = self.selectedTraces(j, pTableView.selectedIndexes())
+        if len(traces):
+            results = pyqtsfplotter_core.addNumber(traces, number)
             self.hidePlotSelected()
             self.selectNoneTraces()
-            self.plotListModels[j].appendRow(names, x, y)
-            self.autoResizePlotRange()
+            self.appendTraces(j, results)
             
     def mulSelectedBy(self):
         number = self.doubleSpinBox_By.value()
@@ -531,79 +717,211 @@ class App_MainWindow(Ui_MainWindow):
             pTableView = self.tableView_Spectra
         else:
             return
-        indices = pTableView.selectedIndexes()
-        n = len(indices)
-        if n > 0:
-            x = []
-            y = []
-            names = []
-            for i in range(n):
-                x1, y1 = self.plotListModels[j].data(indices[i], role = QtCore.Qt.UserRole)
-                name1 = self.plotListModels[j].data(indices[i], role = QtCore.Qt.DisplayRole)
-                x.append(x1)
-                y.append(y1 * number)
-                names.append(name1 + ' (x' + str(number) + ')')
+        traces = self.selectedTraces(j, pTableView.selectedIndexes())
+        if len(traces):
+            results = pyqtsfplotter_core.multiplyBy(traces, number)
             self.hidePlotSelected()
             self.selectNoneTraces()
-            self.plotListModels[j].appendRow(names, x, y)
-            self.autoResizePlotRange()
+            self.appendTraces(j, results)
  
     def addSVDResultsToPlot(self):
         matrix = []
+        rows = []
         rowXData = []
         columnXData = []
         j = 0 if self.__axisType else 1
         for index in self.listView_Raw_Traces.selectedIndexes(): 
             dataX, dataY = (self.listView_Raw_Traces.model().data(index, role = QtCore.Qt.UserRole))
             rowXData.append(self.listView_Raw_Traces.model().data(index, role = QtCore.Qt.DisplayRole))
+            rows.append(index.row())
             matrix.append(dataY)
             columnXData = dataX
         if matrix and self.spinBox_SVD.value() > 0:
-            matrix = numpy.array(matrix)
-            if matrix.shape[0] < self.spinBox_SVD.value() or matrix.shape[1] < self.spinBox_SVD.value():
-                self.spinBox_SVD.setValue(min(matrix.shape))
-            U, s, V = numpy.linalg.svd(numpy.array(matrix))
-            rowYData = U[:, 0:self.spinBox_SVD.value()].transpose()
-            columnYData = V[0:self.spinBox_SVD.value(), :]
-            names = ['SVD' + str(self.comboBox_Select_File.currentIndex()) + ' : eig=' + str(s[k]) \
-                for k in range(self.spinBox_SVD.value())]
-            if self.checkBox_eigvalue.isChecked():
-                rowYData = numpy.dot(numpy.diag(s[0:self.spinBox_SVD.value()]), rowYData)
-                columnYData = numpy.dot(numpy.diag(s[0:self.spinBox_SVD.value()]), columnYData)
-            self.plotListModels[1 - j].appendRow(names, [rowXData] * self.spinBox_SVD.value(), rowYData)
-            self.tabWidget.setCurrentIndex(1 - j)
-            self.autoResizePlotRange()
-            self.plotListModels[j].appendRow(names, [columnXData] * self.spinBox_SVD.value(), columnYData)
-            self.tabWidget.setCurrentIndex(j)
+            if len(matrix) < self.spinBox_SVD.value() or len(columnXData) < self.spinBox_SVD.value():
+                self.spinBox_SVD.setValue(min(len(matrix), len(columnXData)))
+            fileObj = self.fListModel.data(self.fListModel.index( \
+                self.comboBox_Select_File.currentIndex(), 0), role = QtCore.Qt.UserRole)
+            key = (id(fileObj), fileObj.fName, fileObj.currentBlock(), fileObj.denoisedRank(), \
+                self.__axisType, tuple(rows))
+            label = self.fileLabel(self.comboBox_Select_File.currentIndex())[4:]
+            factors = self.svdService.factors(key, self.spinBox_SVD.value())
+            if factors is None:
+                try:
+                    factors = self.svdService.decompose(key, numpy.array(matrix), self.spinBox_SVD.value())
+                except numpy.linalg.LinAlgError as error:
+                    self.svdFailed(key, str(error))
+                    return
+            if factors is None:
+                # Plotted by svdFinished() when the background decomposition is done.
+                self.__svdPending = (key, label, j, rowXData, columnXData)
+                self.toolButton_SVD.setEnabled(False)
+            else:
+                self.plotSVDResults(factors, label, j, rowXData, columnXData)
+    
+    def svdFinished(self, key, factors):
+        if self.__svdPending and self.__svdPending[0] == key:
+            pending, self.__svdPending = self.__svdPending, None
+            self.toolButton_SVD.setEnabled(True)
+            self.plotSVDResults(factors, *pending[1:])
+        if self.__denoisePending and self.__denoisePending[0] == key:
+            pending, self.__denoisePending = self.__denoisePending, None
+            self.toolButton_Denoise.setEnabled(True)
+            self.setDenoised(pending[1], pending[2], factors)
+    
+    def svdFailed(self, key, error):
+        if self.__svdPending and self.__svdPending[0] == key:
+            self.__svdPending = None
+            self.toolButton_SVD.setEnabled(True)
+        if self.__denoisePending and self.__denoisePending[0] == key:
+            self.__denoisePending = None
+            self.toolButton_Denoise.setEnabled(True)
+            self.toolButton_Denoise.setChecked(False)
+        QtWidgets.QMessageBox.warning(self.centralwidget, 'SVD Failed', \
+            'Cannot decompose the selected traces: ' + error, \
+            QtWidgets.QMessageBox.Ok, QtWidgets.QMessageBox.Ok)
+    
+    # Fits the selected time traces in the background; globalFitFinished() plots the results.
+    def globalFitSelected(self):
+        if not self.__axisType:
+            QtWidgets.QMessageBox.warning(self.centralwidget, 'Global Fit', \
+                'Global fitting needs time traces. Switch the selection axis to wavelengths.', \
+                QtWidgets.QMessageBox.Ok, QtWidgets.QMessageBox.Ok)
+            return
+        ys = []
+        rowXData = []
+        names = []
+        t = None
+        for index in self.listView_Raw_Traces.selectedIndexes():
+            t, dataY = self.listView_Raw_Traces.model().data(index, role = QtCore.Qt.UserRole)
+            rowXData.append(self.listView_Raw_Traces.model().data(index, role = QtCore.Qt.DisplayRole))
+            names.append(self.fileLabel(self.comboBox_Select_File.currentIndex()) + ': ' \
+                + str(rowXData[-1]) + ' nm')
+            ys.append(dataY)
+        if not ys or self.__fitPending:
+            return
+        svdRank = self.spinBox_SVD.value() if self.checkBox_Fit_SVD.isChecked() else 0
+        self.__fitPending = (object(), self.fileLabel(self.comboBox_Select_File.currentIndex()), \
+            t, rowXData, names)
+        self.toolButton_Fit.setEnabled(False)
+        self.globalFitter.start(self.__fitPending[0], t, numpy.array(ys), self.spinBox_Fit.value(), svdRank)
+    
+    def globalFitFinished(self, key, fit):
+        if self.__fitPending and self.__fitPending[0] == key:
+            pending, self.__fitPending = self.__fitPending, None
+            self.toolButton_Fit.setEnabled(True)
+            self.plotGlobalFit(fit, *pending[1:])
+    
+    def globalFitFailed(self, key, error):
+        if self.__fitPending and self.__fitPending[0] == key:
+            self.__fitPending = None
+            self.toolButton_Fit.setEnabled(True)
+        QtWidgets.QMessageBox.warning(self.centralwidget, 'Global Fit Failed', \
+            'Cannot fit the selected traces: ' + error, \
+            QtWidgets.QMessageBox.Ok, QtWidgets.QMessageBox.Ok)
+    
+    # Decay-associated spectra go to the spectra plot, fits and residuals to the time traces plot.
+    def plotGlobalFit(self, fit, label, t, rowXData, names):
+        dasNames = [label + ' DAS: k=' + '{0:.4g}'.format(rate) + '\u00b1' + '{0:.2g}'.format(error) + ' /s' \
+            for rate, error in zip(fit.rates, fit.rateErrors)]
+        if fit.amplitudes.shape[1] > len(fit.rates):
+            dasNames.append(label + ' DAS: offset')
+        self.plotListModels[1].appendRow(dasNames, [rowXData] * len(dasNames), fit.amplitudes.T)
+        self.tabWidget.setCurrentIndex(1)
+        self.autoResizePlotRange()
+        self.plotListModels[0].appendRow([name + ' fit' for name in names] \
+            + [name + ' residual' for name in names], [t] * (2 * len(names)), \
+            list(fit.fits) + list(fit.residuals))
+        self.tabWidget.setCurrentIndex(0)
+        self.autoResizePlotRange()
+    
+    # Denoises the current block of the current file with spinBox_SVD components, or restores its raw
+    # data when unchecked. The whole raw matrix is decomposed, in the background if it is large.
+    def denoiseFile(self, checked):
+        j = self.comboBox_Select_File.currentIndex()
+        fileObj = self.fListModel.data(self.fListModel.index(j, 0), role = QtCore.Qt.UserRole)
+        if not fileObj:
+            self.toolButton_Denoise.setChecked(False)
+            return
+        if not checked:
+            self.setDenoised(j, 0)
+            return
+        rank = self.spinBox_SVD.value()
+        key = (id(fileObj), fileObj.fName, fileObj.currentBlock(), 'denoise')
+        factors = self.svdService.factors(key, rank)
+        if factors is None:
+            try:
+                factors = self.svdService.decompose(key, fileObj.rawZ, rank)
+            except numpy.linalg.LinAlgError as error:
+                self.svdFailed(key, str(error))
+                self.toolButton_Denoise.setChecked(False)
+                return
+        if factors is None:
+            self.__denoisePending = (key, j, rank)
+            self.toolButton_Denoise.setEnabled(False)
+        else:
+            self.setDenoised(j, rank, factors)
+    
+    # Adds the current block of the current file, averaged over the bins set next to the Rebin button,
+    # as a new file, and selects it.
+    def rebinFile(self):
+        fileObj = self.fListModel.data(self.fListModel.index(self.comboBox_Select_File.currentIndex(), 0), \
+            role = QtCore.Qt.UserRole)
+        if not fileObj:
+            return
+        file1, issue = fileObj.rebin(self.spinBox_Time_Bins.value(), self.spinBox_Wavelength_Bins.value(), \
+            ('log', 'count')[self.comboBox_Time_Bins.currentIndex()])
+        if issue:
+            QtWidgets.QMessageBox.warning(self.centralwidget, 'Rebin Failed', issue.message, \
+                QtWidgets.QMessageBox.Ok, QtWidgets.QMessageBox.Ok)
+        elif self.fListModel.appendFileObject(file1):
+            self.comboBox_Select_File.setCurrentIndex(self.fListModel.rowCount() - 1)
+    
+    def setDenoised(self, j, rank, factors = None):
+        self.fListModel.setDenoised(j, rank, factors)
+        if j == self.comboBox_Select_File.currentIndex():
+            self.previewRawTrace()
+    
+    # Plots the first spinBox_SVD components of cached SVD factors, scaled as checkBox_eigvalue says.
+    def plotSVDResults(self, factors, label, j, rowXData, columnXData):
+        rank = min(self.spinBox_SVD.value(), len(factors[1]))
+        s, rowYData, columnYData = pyqtsfplotter_core.svdSlice(factors, rank, \
+            self.checkBox_eigvalue.isChecked())
+        names = ['SVD' + label + ' : eig=' + str(s[k]) for k in range(rank)]
+        self.plotListModels[1 - j].appendRow(names, [rowXData] * rank, rowYData)
+        self.tabWidget.setCurrentIndex(1 - j)
+        self.autoResizePlotRange()
+        self.plotListModels[j].appendRow(names, [columnXData] * rank, columnYData)
+        self.tabWidget.setCurrentIndex(j)
             
     def rangeSelectLog(self):
-        pModel = self.listView_Raw_Traces.model()
         xStart = self.doubleSpinBox_Range_From.value()
         xEnd = self.doubleSpinBox_Range_To.value()
         nSteps = self.spinBox_Range_Steps.value()
         if xStart > 0 and xEnd > 0 and nSteps > 1:
-            x = [xStart * numpy.exp(i * numpy.log(xEnd/xStart) / (nSteps - 1)) \
-                for i in range(nSteps)]
-            indices = [pModel.index(i, 0) for i in range(pModel.rowCount())]
-            x0 = numpy.array([pModel.data(index1, role = QtCore.Qt.DisplayRole) for index1 in indices])
-            for x1 in x:
-                subscript = numpy.absolute(x0 - x1).argmin()
-                self.listView_Raw_Traces.selectionModel().select( \
-                    indices[subscript], QtCore.QItemSelectionModel.Select)
+            self.selectNearestRawTraces(xStart * numpy.exp(numpy.arange(nSteps) \
+                * numpy.log(xEnd / xStart) / (nSteps - 1)))
     
     def rangeSelectLinear(self):
-        pModel = self.listView_Raw_Traces.model()
         xStart = self.doubleSpinBox_Range_From.value()
         xEnd = self.doubleSpinBox_Range_To.value()
         nSteps = self.spinBox_Range_Steps.value()
         if xStart > 0 and xEnd > 0 and nSteps > 1:
-            x = [xStart + i * (xEnd - xStart) / (nSteps - 1) for i in range(nSteps)]
-            indices = [pModel.index(i, 0) for i in range(pModel.rowCount())]
-            x0 = numpy.array([pModel.data(index1, role = QtCore.Qt.DisplayRole) for index1 in indices])
-            for x1 in x:
-                subscript = numpy.absolute(x0 - x1).argmin()
-                self.listView_Raw_Traces.selectionModel().select( \
-                    indices[subscript], QtCore.QItemSelectionModel.Select)
+            self.selectNearestRawTraces(xStart + numpy.arange(nSteps) * (xEnd - xStart) / (nSteps - 1))
+    
+    # Adds the raw traces nearest to each of values to the selection, as one selection of row ranges.
+    def selectNearestRawTraces(self, values):
+        pModel = self.listView_Raw_Traces.model()
+        x0, issue = pyqtsfplotter_core.numericAxis(pModel.axis())
+        if issue or not len(x0):
+            return
+        order = numpy.argsort(x0, kind = 'stable')
+        rows = numpy.unique(pyqtsfplotter_core.nearestPoints(x0[order], order, values)[0])
+        # Runs of consecutive rows.
+        breaks = numpy.flatnonzero(numpy.diff(rows) != 1)
+        selection = QtCore.QItemSelection()
+        for first, last in zip(rows[numpy.append(0, breaks + 1)], rows[numpy.append(breaks, len(rows) - 1)]):
+            selection.select(pModel.index(int(first), 0), pModel.index(int(last), 0))
+        self.listView_Raw_Traces.selectionModel().select(selection, QtCore.QItemSelectionModel.Select)
                 
     # Add traces selected traces in listView_Raw_Traces to plot.
     def addSelectedToPlot(self):
@@ -613,7 +931,7 @@ class App_MainWindow(Ui_MainWindow):
         j = 0 if self.__axisType else 1
         for index in self.listView_Raw_Traces.selectedIndexes():
             dataX, dataY = (self.listView_Raw_Traces.model().data(index, role = QtCore.Qt.UserRole))
-            name1 = 'File' + str(self.comboBox_Select_File.currentIndex()) + ': ' \
+            name1 = self.fileLabel(self.comboBox_Select_File.currentIndex()) + ': ' \
                 + str(self.listView_Raw_Traces.model().data(index, role = QtCore.Qt.DisplayRole)) \
                 + (' nm' if self.__axisType else ' s')
             dataXs.append(dataX)
@@ -625,49 +943,112 @@ class App_MainWindow(Ui_MainWindow):
         self.autoResizePlotRange()
         self.comboBox_Ref_To.setModel(self.plotListModels[j])
 
-    # Same as above,
-    # but also searches in every open file for selected wavelengths/timepoints and add them to plot.    
+    # Adds the selected traces, and the traces at the same wavelengths or timepoints of all other files,
+    # looked up within DataFileObject.axisTolerance with one query per file.
     def addFromAllFilesToPlot(self):
         dataXs = []
         dataYs = []
         names = []
         j = 0 if self.__axisType else 1
-        for index0 in self.listView_Raw_Traces.selectedIndexes():
-            dataX0, dataY0 = (self.listView_Raw_Traces.model().data(index0, role = QtCore.Qt.UserRole))
-            name0 = 'File' + str(self.comboBox_Select_File.currentIndex()) + ': ' \
-                + str(self.listView_Raw_Traces.model().data(index0, role = QtCore.Qt.DisplayRole)) \
-                + (' nm' if self.__axisType else ' s')
+        unit = ' nm' if self.__axisType else ' s'
+        current = self.comboBox_Select_File.currentIndex()
+        pModel = self.listView_Raw_Traces.model()
+        indices = self.listView_Raw_Traces.selectedIndexes()
+        values = [pModel.data(index0, role = QtCore.Qt.DisplayRole) for index0 in indices]
+        matches = []
+        missing = []
+        for k in range(self.fListModel.rowCount()):
+            if k != current:
+                pFileObj = self.fListModel.data(self.fListModel.index(k, 0), role = QtCore.Qt.UserRole)
+                found = pFileObj.lookupTraces(values, self.__axisType)
+                matches.append((self.fileLabel(k), pFileObj, pFileObj.axis(self.__axisType), found))
+                if numpy.any(found < 0):
+                    missing.append(self.fileLabel(k) + ' (' + str(int(numpy.sum(found < 0))) + ')')
+        label0 = self.fileLabel(current)
+        for m, index0 in enumerate(indices):
+            dataX0, dataY0 = pModel.data(index0, role = QtCore.Qt.UserRole)
             dataXs.append(dataX0)
             dataYs.append(dataY0)
-            names.append(name0)
-            for k in range(self.fListModel.rowCount()):
-                if k != self.comboBox_Select_File.currentIndex():
-                    pFileObj = self.fListModel.data(self.fListModel.index(k, 0), role = QtCore.Qt.UserRole)
-                    pAxis = pFileObj.w if self.__axisType else pFileObj.t
-                    for i in range(len(pAxis)):
-                        if pAxis[i] == self.listView_Raw_Traces.model().data(index0, role = QtCore.Qt.DisplayRole):
-                            dataX1 = pFileObj.t if self.__axisType else pFileObj.w
-                            dataY1 = pFileObj.z[i] if self.__axisType else [z1[i] for z1 in pFileObj.z]
-                            name1 = 'File' + str(k) + ': ' + str(pAxis[i]) + (' nm' if self.__axisType else ' s')
-                            dataXs.append(dataX1)
-                            dataYs.append(dataY1)
-                            names.append(name1)
+            names.append(label0 + ': ' + str(values[m]) + unit)
+            for label1, pFileObj, pAxis, found in matches:
+                if found[m] >= 0:
+                    dataX1, dataY1 = pFileObj.trace(found[m], self.__axisType)
+                    dataXs.append(dataX1)
+                    dataYs.append(dataY1)
+                    names.append(label1 + ': ' + str(pAxis[found[m]]) + unit)
         self.plotListModels[j].appendRow(names, dataXs, dataYs)
         self.tabWidget.setCurrentIndex(j)
         self.tabSwitch(j)
         self.autoResizePlotRange()
         self.comboBox_Ref_To.setModel(self.plotListModels[j])
+        if missing:
+            QtWidgets.QMessageBox.warning(self.centralwidget, 'No Matching Traces', \
+                'Some selected ' + ('wavelengths' if self.__axisType else 'timepoints') \
+                + ' were not found in these files (number missing in brackets):\n' + ', '.join(missing), \
+                QtWidgets.QMessageBox.Ok, QtWidgets.QMessageBox.Ok)
         
     def removeFileFromList(self):
         self.fListModel.removeRows(self.comboBox_Select_File.currentIndex(), 1)
+        self.svdService.clear()
+        # Rows of later files change, so a pending denoising can't be applied any more.
+        if self.__denoisePending:
+            self.__denoisePending = None
+            self.toolButton_Denoise.setEnabled(True)
         
     def fileSelected(self, j):
         fileObj = self.fListModel.data(self.fListModel.index(j, 0), \
                     role = QtCore.Qt.UserRole)
         if fileObj:
-            self.listView_Raw_Traces.setModel(fileObj.genModel(self.__axisType))
+            self.comboBox_Select_Block.clear()
+            self.comboBox_Select_Block.addItems([block[0] for block in fileObj.blocks])
+            self.comboBox_Select_Block.setCurrentIndex(fileObj.currentBlock())
+            self.comboBox_Select_Block.setVisible(len(fileObj.blocks) > 1)
+            self.listView_Raw_Traces.setModel(self.fListModel.genModel(j, self.__axisType))
+            self.listView_Raw_Traces.selectionModel().currentChanged.connect(self.previewRawTrace)
+            self.toolButton_Denoise.setChecked(fileObj.denoisedRank() > 0)
         else:
+            self.comboBox_Select_Block.clear()
+            self.comboBox_Select_Block.hide()
             self.listView_Raw_Traces.setModel(None)
+            self.toolButton_Denoise.setChecked(False)
+        self.previewRawTrace()
+    
+    # Previews the current trace of listView_Raw_Traces in the plot it would be added to.
+    def previewRawTrace(self, current = None, previous = None):
+        if not self.figures:
+            return
+        if current is None:
+            current = self.listView_Raw_Traces.currentIndex()
+        j = 0 if self.__axisType else 1
+        self.plotListModels[1 - j].setPreview(None, None)
+        if current.isValid() and self.listView_Raw_Traces.model():
+            dataX, dataY = self.listView_Raw_Traces.model().data(current, role = QtCore.Qt.UserRole)
+            # Spectra of KinTek files have column names as x, and are not previewed.
+            dataX, issue = pyqtsfplotter_core.numericAxis(dataX)
+            if not issue:
+                self.plotListModels[j].setPreview(dataX, dataY)
+                return
+        self.plotListModels[j].setPreview(None, None)
+    
+    # Shows another data block of the current file, parsing it on first use.
+    def blockSelected(self, k):
+        j = self.comboBox_Select_File.currentIndex()
+        if not self.fListModel.setCurrentBlock(j, k):
+            fileObj = self.fListModel.data(self.fListModel.index(j, 0), role = QtCore.Qt.UserRole)
+            QtWidgets.QMessageBox.warning(self.centralwidget, 'Invalid Raw Data Block', \
+                fileObj.errorString, QtWidgets.QMessageBox.Ok, QtWidgets.QMessageBox.Ok)
+        self.fileSelected(j)
+        
+    # Short file label used in trace names. Names the block for all but the first block of a file,
+    # and the rank of denoised data as ~rank.
+    def fileLabel(self, k):
+        fileObj = self.fListModel.data(self.fListModel.index(k, 0), role = QtCore.Qt.UserRole)
+        label = 'File' + str(k)
+        if fileObj and fileObj.currentBlock() > 0:
+            label += '.' + fileObj.blockName()
+        if fileObj and fileObj.denoisedRank():
+            label += '~' + str(fileObj.denoisedRank())
+        return label
             
     # Changes axis in listView_Raw_Traces.
     def toggleAxis(self):
@@ -686,23 +1067,19 @@ class App_MainWindow(Ui_MainWindow):
                 self.doubleSpinBox_Range_To.setSuffix(' s')
             self.listView_Raw_Traces.scrollToTop()
             self.listView_Raw_Traces.clearSelection()
+            self.previewRawTrace()
         
     __currentPath=''
     # Imports a text file for raw data.    
     def importRawFiles(self):
         openTextFiles = QtWidgets.QFileDialog.getOpenFileNames(self.centralwidget, \
             'Import From .txt Or .csv Files', self.__currentPath, \
-            'All Supported Formats (*.txt *.csv);;KinTek File (*.txt);;ProDataCSV File (*.csv)', \
-            'All Supported Formats (*.txt *.csv)', \
+            'All Supported Formats (*.txt *.csv *.npy *.npz *.sfb);;KinTek File (*.txt);;ProDataCSV File (*.csv);;' \
+                + ';;'.join(self.exportFilters[1:]), \
+            'All Supported Formats (*.txt *.csv *.npy *.npz *.sfb)', \
             QtWidgets.QFileDialog.Options() | QtWidgets.QFileDialog.DontUseNativeDialog)
         if openTextFiles[0]:
-            openedAtLeastOneFile = False
-            lastIndex = self.comboBox_Select_File.model().rowCount()
-            for fileName in openTextFiles[0]:
-                openedAtLeastOneFile |= self.fListModel.appendRow(fileName)
-            if openedAtLeastOneFile:
-                self.comboBox_Select_File.setCurrentIndex(lastIndex)
-                self.__currentPath = os.path.dirname(openTextFiles[0][0])
+            self.startImport(openTextFiles[0])
                 
     def importDroppedFiles(self, droppedFileUrls):
         if os.name == 'posix':
@@ -712,32 +1089,184 @@ class App_MainWindow(Ui_MainWindow):
         else:
             droppedFiles = [x.toString() for x in droppedFileUrls]
         print('Files dropped:', droppedFiles)
-        if droppedFiles:
-            openedAtLeastOneFile = False
-            lastIndex = self.comboBox_Select_File.model().rowCount()
-            for fileName in droppedFiles:
-                openedAtLeastOneFile |= self.fListModel.appendRow(fileName)
-            if openedAtLeastOneFile:
-                self.comboBox_Select_File.setCurrentIndex(lastIndex)
-                self.__currentPath = os.path.dirname(droppedFiles[0])
+        # A dropped session file replaces the workspace; other files are imported into it.
+        sessions = [x for x in droppedFiles if os.path.splitext(x)[1] == pyqtsfplotter_session.sessionExtension]
+        if sessions:
+            self.openSession(sessions[0])
+        # Dropped directories are searched recursively for .txt and .csv files.
+        self.startImport(DataFilesImporter.expandPaths([x for x in droppedFiles if x not in sessions]))
+    
+    def startImport(self, fileNames):
+        if fileNames:
+            self.__currentPath = os.path.dirname(fileNames[0])
+            if not self.fileImporter.isRunning():
+                self.__selectNextImported = True
+            self.fileImporter.start(fileNames)
+    
+    # Adds each file to the combo box as soon as it is parsed, and shows the first one.
+    def fileImported(self, fileObj):
+        lastIndex = self.fListModel.rowCount()
+        if self.fListModel.appendFileObject(fileObj) and self.__selectNextImported:
+            self.__selectNextImported = False
+            self.comboBox_Select_File.setCurrentIndex(lastIndex)
+    
+    def importProgressChanged(self, done, total):
+        self.progressBar_Import.setMaximum(total)
+        self.progressBar_Import.setValue(done)
+        self.progressBar_Import.setVisible(done < total)
+        self.toolButton_Cancel_Import.setVisible(done < total)
+    
+    def clearParseCache(self):
+        cacheSize = DataFileObject.parseCache.size()
+        DataFileObject.parseCache.clear()
+        QtWidgets.QMessageBox.information(self.centralwidget, 'Clear Cache', \
+            'Deleted {0:.1f} MB of cached data.'.format(cacheSize / 1024 ** 2), \
+            QtWidgets.QMessageBox.Ok, QtWidgets.QMessageBox.Ok)
+        
+    # Widgets whose values are saved in sessions, in the order they are restored.
+    sessionWidgets = ['spinBox_Font_Size', 'doubleSpinBox_Line_Width', 'doubleSpinBox_Marker_Size', \
+        'spinBox_Markevery', 'checkBox_Grid', 'checkBox_Legend', 'checkBox_LogX', 'checkBox_LogY', \
+        'spinBox_SVD', 'checkBox_eigvalue', 'spinBox_Fit', 'checkBox_Fit_SVD', 'doubleSpinBox_Range_From', \
+        'doubleSpinBox_Range_To', 'spinBox_Range_Steps', 'doubleSpinBox_By', 'doubleSpinBox_Internal_Ref', \
+        'horizontalSlider_DPI', 'comboBox_X_Grid', 'spinBox_Grid_Points', 'spinBox_Time_Bins', \
+        'comboBox_Time_Bins', 'spinBox_Wavelength_Bins']
+    
+    # Saves files, plotted traces and settings to a session file (see pyqtsfplotter_session).
+    # Returns True if saved.
+    def saveSession(self):
+        if self.fileImporter.isRunning():
+            QtWidgets.QMessageBox.warning(self.centralwidget, 'Save Session', \
+                'Files are still being imported. Save the session when they are done.', \
+                QtWidgets.QMessageBox.Ok, QtWidgets.QMessageBox.Ok)
+            return False
+        saveSessionFile = QtWidgets.QFileDialog.getSaveFileName(self.centralwidget, \
+            'Save Session As', self.__savedSessionName or self.__currentPath + '/session' \
+                + pyqtsfplotter_session.sessionExtension, \
+            'Session File (*' + pyqtsfplotter_session.sessionExtension + ')', \
+            'Session File (*' + pyqtsfplotter_session.sessionExtension + ')', \
+            QtWidgets.QFileDialog.Options() | QtWidgets.QFileDialog.DontUseNativeDialog)
+        if not saveSessionFile[0]:
+            return False
+        fileName = saveSessionFile[0]
+        if os.path.splitext(fileName)[1] != pyqtsfplotter_session.sessionExtension:
+            fileName += pyqtsfplotter_session.sessionExtension
+        if pyqtsfplotter_session.mappedFile(fileName, self.__openedSessionName):
+            QtWidgets.QMessageBox.warning(self.centralwidget, 'Save Session', \
+                'The data of this session is read from ' + fileName + ' while it is open, so that file ' \
+                + 'can\'t be overwritten. Save the session under another name.', \
+                QtWidgets.QMessageBox.Ok, QtWidgets.QMessageBox.Ok)
+            return False
+        self.setupPlots()
+        session = pyqtsfplotter_session.SessionWriter()
+        state = {'files': [session.dataFile(self.fListModel.data(self.fListModel.index(k, 0), \
+                role = QtCore.Qt.UserRole)) for k in range(self.fListModel.rowCount())], \
+            'plots': [model.sessionState(session) for model in self.plotListModels], \
+            'widgets': {name: self.__widgetValue(getattr(self, name)) for name in self.sessionWidgets}, \
+            'currentFile': self.comboBox_Select_File.currentIndex(), 'axisType': self.__axisType, \
+            'currentTab': self.tabWidget.currentIndex()}
+        issue = session.write(fileName, state)
+        if issue:
+            QtWidgets.QMessageBox.warning(self.centralwidget, 'Save Session Failed', issue.message, \
+                QtWidgets.QMessageBox.Ok, QtWidgets.QMessageBox.Ok)
+            return False
+        self.__savedSessionName = fileName
+        self.__currentPath = os.path.dirname(fileName)
+        return True
+    
+    # Replaces all files and plotted traces by those of a session file, asking for one if not given.
+    # Arrays are memory-mapped from the session file rather than read.
+    def openSession(self, fileName = None):
+        if not fileName:
+            fileName = QtWidgets.QFileDialog.getOpenFileName(self.centralwidget, 'Open Session', \
+                self.__currentPath, 'Session File (*' + pyqtsfplotter_session.sessionExtension + ')', \
+                'Session File (*' + pyqtsfplotter_session.sessionExtension + ')', \
+                QtWidgets.QFileDialog.Options() | QtWidgets.QFileDialog.DontUseNativeDialog)[0]
+            if not fileName:
+                return
+        session, issue = pyqtsfplotter_session.readSession(fileName)
+        if issue:
+            QtWidgets.QMessageBox.warning(self.centralwidget, 'Open Session Failed', issue.message, \
+                QtWidgets.QMessageBox.Ok, QtWidgets.QMessageBox.Ok)
+            return
+        self.fileImporter.cancel()
+        self.setupPlots()
+        state = session.state
+        self.fListModel.removeRows(0, self.fListModel.rowCount())
+        self.svdService.clear()
+        self.__denoisePending = None
+        self.toolButton_Denoise.setEnabled(True)
+        for j in range(len(self.plotListModels)):
+            self.resetCanvas(j)
+        for name in self.sessionWidgets:
+            if name in state['widgets']:
+                self.__setWidgetValue(getattr(self, name), state['widgets'][name])
+        for entry in state['files']:
+            self.fListModel.appendFileObject(session.dataFile(entry))
+        for model, plotState in zip(self.plotListModels, state['plots']):
+            model.restoreSession(plotState, session)
+        if state['axisType'] != self.__axisType:
+            self.toggleAxis()
+        self.comboBox_Select_File.setCurrentIndex(state['currentFile'])
+        if self.tabWidget.currentIndex() != state['currentTab']:
+            self.tabWidget.setCurrentIndex(state['currentTab'])
+        else:
+            self.tabSwitch(state['currentTab'])
+        self.__savedSessionName = self.__openedSessionName = fileName
+        self.__currentPath = os.path.dirname(fileName)
+    
+    @staticmethod
+    def __widgetValue(widget):
+        if isinstance(widget, QtWidgets.QComboBox):
+            return widget.currentIndex()
+        return widget.isChecked() if isinstance(widget, QtWidgets.QCheckBox) else widget.value()
+    
+    @staticmethod
+    def __setWidgetValue(widget, value):
+        if isinstance(widget, QtWidgets.QComboBox):
+            widget.setCurrentIndex(value)
+        elif isinstance(widget, QtWidgets.QCheckBox):
+            widget.setChecked(value)
+        else:
+            widget.setValue(value)
+    
+    # Lists all skipped files in one non-modal report.
+    def importFinished(self, imported, skipped):
+        if skipped:
+            self.importReport = QtWidgets.QMessageBox(QtWidgets.QMessageBox.Warning, \
+                'Import Summary', 'Imported ' + str(imported) + ' file(s). Skipped ' \
+                + str(len(skipped)) + ' file(s). See details.', \
+                QtWidgets.QMessageBox.Ok, self.centralwidget)
+            self.importReport.setDetailedText('\n'.join(fileName + ': ' + error \
+                for fileName, error in skipped))
+            self.importReport.setWindowModality(QtCore.Qt.NonModal)
+            self.importReport.show()
         
     
-    # Saves time traces to .txt file, compatible with above function.
+    # Saves time traces to .txt or binary files, compatible with above function.
+    # Binary files are written and read back without formatting or parsing any numbers.
     __savedTxtCount = 1
+    exportFilters = ['KinTek File (*.txt)', 'NumPy Matrix (*.npy)', 'NumPy Archive (*.npz)', \
+        'Binary Float32 File (*.sfb)']
     def saveSelectedTracesToTxt(self):
         j = self.tabWidget.currentIndex()
         pTableView = self.tableView_Traces if j == 0 else self.tableView_Spectra
         indices = pTableView.selectedIndexes()
         n = len(indices)
         if n > 0:
-            x0, y0 = self.plotListModels[j].data(indices[0], role = QtCore.Qt.UserRole)
-            y = [y0]
-            # Needs to remove spaces in names.
-            names = [self.plotListModels[j].data(indices[0], role = QtCore.Qt.DisplayRole).replace(' ', '')]
-            count = 0
-            for i in range(1, n):
+            traces = pyqtsfplotter_core.TraceSet()
+            for i in range(n):
                 (x1, y1) = self.plotListModels[j].data(indices[i], role = QtCore.Qt.UserRole)
+                # Needs to remove spaces in names.
                 name1 = self.plotListModels[j].data(indices[i], role = QtCore.Qt.DisplayRole).replace(' ', '')
+                traces.append(name1, x1, y1)
+            traces = self.onCommonGrid(traces)
+            if traces is None:
+                return
+            x0 = traces.xs[0]
+            y = [traces.ys[0]]
+            names = [traces.names[0]]
+            count = 0
+            for name1, x1, y1 in zip(traces.names[1:], traces.xs[1:], traces.ys[1:]):
                 if numpy.array_equal(x0, x1):
                     y.append(y1)
                     names.append(name1)
@@ -752,38 +1281,30 @@ class App_MainWindow(Ui_MainWindow):
                 else:
                     return
             saveTxtFile = QtWidgets.QFileDialog.getSaveFileName(self.centralwidget, \
-                'Save Data As Text File', self.__currentPath + '/data' + str(self.__savedTxtCount) + '.txt', \
-                'KinTek File (*.txt)', 'KinTek File (*.txt)', \
+                'Save Data As File', self.__currentPath + '/data' + str(self.__savedTxtCount) + '.txt', \
+                ';;'.join(self.exportFilters), self.exportFilters[0], \
                 QtWidgets.QFileDialog.Options() | QtWidgets.QFileDialog.DontUseNativeDialog)
             if saveTxtFile[0]:
-                with open(saveTxtFile[0], 'w') as file1:
-                    file1.write('Time')
-                    if j == 0:
-                        for name1 in names:
-                            file1.write('\t{0}'.format(name1))
-                        file1.write('\n')                    
-                        for k in range(len(x0)):
-                            file1.write('{0}'.format(x0[k]))
-                            for l in range(len(y)):
-                                file1.write('\t{0}'.format(y[l][k]))
-                            file1.write('\n')
+                fileName = saveTxtFile[0]
+                # Takes the extension from the chosen filter if none is typed.
+                if os.path.splitext(fileName)[1] not in ('.txt',) + pyqtsfplotter_core.binaryExtensions:
+                    fileName += saveTxtFile[1][saveTxtFile[1].index('(*') + 2 : -1]
+                if j == 1:
+                    # Spectra are saved in order of their names, if those are numbers.
+                    try:
+                        names1 = numpy.array([float(x) for x in names])
+                    except ValueError:
+                        seq1 = list(range(len(names)))
                     else:
-                        try:
-                            names1 = numpy.array([float(x) for x in names])
-                        except ValueError: 
-                            seq1=list(range(len(names)))
-                        else:
-                            seq1=names1.argsort()
-                        for x1 in x0:
-                            file1.write('\t{0}'.format(x1))
-                        file1.write('\n')
-                        for k in range(len(y)):
-                            file1.write('{0}'.format(names[seq1[k]]))
-                            for l in range(len(x0)):
-                                file1.write('\t{0}'.format(y[seq1[k]][l]))
-                            file1.write('\n')                        
-                    file1.close()
-                    self.__currentPath = os.path.dirname(saveTxtFile[0])
+                        seq1 = names1.argsort()
+                    names = [names[k] for k in seq1]
+                    y = [y[k] for k in seq1]
+                issue = pyqtsfplotter_core.exportTraces(fileName, x0, names, y, byColumn = j == 0)
+                if issue:
+                    QtWidgets.QMessageBox.warning(self.centralwidget, 'Save Failed', issue.message, \
+                        QtWidgets.QMessageBox.Ok, QtWidgets.QMessageBox.Ok)
+                else:
+                    self.__currentPath = os.path.dirname(fileName)
                     self.__savedTxtCount += 1
                 
     # Exports figure area as image files.
@@ -798,15 +1319,29 @@ class App_MainWindow(Ui_MainWindow):
             QtWidgets.QFileDialog.Options() | QtWidgets.QFileDialog.DontUseNativeDialog)
         if saveFigFile[0]:
             self.__savedFigureCount += 1
+            # Saves all points, not just those drawn on screen.
+            pModel = self.plotListModels[self.stackedWidget_right.currentIndex()]
+            decimationOn = pModel.getDecimation()
+            pModel.setDecimation(False)
+            pModel.render()
             self.figures[self.stackedWidget_right.currentIndex()].savefig(saveFigFile[0], \
                 dpi = self.horizontalSlider_DPI.value())
+            pModel.setDecimation(decimationOn)
             self.__currentPath = os.path.dirname(saveFigFile[0])
  
 # Main function.    
 if __name__ == "__main__":
+    # Headless batch mode; see pyqtsfplotter_batch.py for the job description.
+    if '--batch' in sys.argv:
+        import pyqtsfplotter_batch
+        sys.exit(pyqtsfplotter_batch.main(sys.argv[1:]))
     app = QtWidgets.QApplication(sys.argv)
+    markStartup('create QApplication')
     mainWindow = QMainWindow_Modified()
     ui = App_MainWindow()
     ui.setupApp(mainWindow)
     mainWindow.show()
+    # Prints how long each startup step took, once plots are set up.
+    if '--profile-startup' in sys.argv:
+        mainWindow.firstPainted.connect(lambda: QtCore.QTimer.singleShot(0, printStartupProfile))
     sys.exit(app.exec_())
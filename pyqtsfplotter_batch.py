@@ -0,0 +1,213 @@
+#!/usr/bin/python3
+# Headless batch processing of raw data files, without any window.
+# Run as:
+#   python pyqtsfplotter_app.py --batch job.json
+# or
+#   python pyqtsfplotter_batch.py job.json
+#
+# The job description is a JSON object:
+#   {
+#     "files": ["exampleData/*.csv", "run1/shot02.txt"],   paths or glob patterns, ** is recursive
+#     "wavelengths": [350, 470],     time traces to extract, at the nearest wavelengths (or KinTek column names)
+#     "timepoints": [0.01, 0.1, 1],  spectra to extract, at the nearest timepoints
+#     "svdRank": 3,                  number of SVD components of the whole data matrix; 0 for none
+#     "denoiseRank": 0,              extracts traces and spectra from the reconstruction of the data from
+#                                    this many SVD components (see DataFileObject.denoise); 0 for raw data
+#     "formats": ["txt", "npz", "png"],  txt (KinTek layout, as saved by the GUI), npz, and figure formats
+#     "output": "batch_output",      output directory
+#     "processes": 0,                number of worker processes; 0 for one per CPU
+#     "cache": true                  use the parse cache of the GUI
+#   }
+# Files are processed in parallel, one file per worker process at a time.
+
+import argparse
+import concurrent.futures
+import glob
+import json
+import os
+import sys
+from os import path
+
+import numpy
+
+import pyqtsfplotter_core
+from pyqtsfplotter_core import DataFileObject
+
+figureFormats = ('png', 'jpg', 'tif', 'svg', 'eps', 'pdf')
+
+defaultJob = {
+    'files': [],
+    'wavelengths': [],
+    'timepoints': [],
+    'svdRank': 0,
+    'denoiseRank': 0,
+    'formats': ['txt'],
+    'output': 'batch_output',
+    'processes': 0,
+    'cache': True,
+}
+
+def loadJob(jobFile):
+    with open(jobFile, 'r') as f1:
+        job = dict(defaultJob)
+        job.update(json.load(f1))
+    # Relative paths in the job are relative to the job file.
+    baseDir = path.dirname(path.abspath(jobFile))
+    job['files'] = [x if path.isabs(x) else path.join(baseDir, x) for x in job['files']]
+    if not path.isabs(job['output']):
+        job['output'] = path.join(baseDir, job['output'])
+    return job
+
+def expandFiles(patterns):
+    fileNames = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive = True))
+        fileNames.extend(x for x in matches if path.isfile(x) and x not in fileNames \
+            and path.splitext(x)[1].lower() in pyqtsfplotter_core.supportedExtensions)
+    return fileNames
+
+# Gives each file an output name prefix, unique even if base names repeat across directories.
+def outputPrefixes(fileNames, outputDir):
+    prefixes = []
+    used = set()
+    for fileName in fileNames:
+        base = path.splitext(path.basename(fileName))[0]
+        prefix = base
+        k = 1
+        while prefix in used:
+            prefix = base + '_' + str(k)
+            k += 1
+        used.add(prefix)
+        prefixes.append(path.join(outputDir, prefix))
+    return prefixes
+
+# Indices of the axis points nearest to each target. Label axes (KinTek column names) match by name.
+def nearestIndices(axis, targets):
+    indices = []
+    if axis.dtype == object:
+        labels = [str(x) for x in axis]
+        for target in targets:
+            if str(target) in labels:
+                indices.append(labels.index(str(target)))
+    elif len(axis):
+        for target in targets:
+            if isinstance(target, (int, float)):
+                indices.append(int(numpy.absolute(axis - target).argmin()))
+    return indices
+
+def saveFigure(fileNames, x, names, ys, xLabel, logX):
+    # Agg canvas only, so that no GUI backend is needed.
+    from matplotlib import figure as mpl_figure
+    from matplotlib.backends import backend_agg as mpl_agg
+    figure1 = mpl_figure.Figure(figsize = (8, 6))
+    mpl_agg.FigureCanvasAgg(figure1)
+    axes1 = figure1.add_subplot(111)
+    for name, y in zip(names, ys):
+        axes1.plot(x, y, label = str(name))
+    if logX:
+        axes1.set_xscale('log')
+    axes1.set_xlabel(xLabel)
+    if names:
+        axes1.legend()
+    figure1.tight_layout()
+    for fileName in fileNames:
+        figure1.savefig(fileName, dpi = 300)
+
+# Processes one file in a worker process. Returns (fileName, list of written files, error string).
+def processFile(fileName, prefix, job):
+    if job['cache']:
+        from pyqtsfplotter_cache import ParseCache
+        DataFileObject.parseCache = ParseCache()
+    written = []
+    try:
+        file1, issue = pyqtsfplotter_core.openDataFile(fileName)
+        if issue:
+            return fileName, written, issue.message
+        if int(job['denoiseRank']) > 0:
+            file1.denoise(int(job['denoiseRank']))
+        z, w, t = file1.z, file1.w, file1.t
+        formats = [x.lower() for x in job['formats']]
+        figures = [x for x in formats if x in figureFormats]
+        results = {}
+        # Time traces at selected wavelengths.
+        rows = nearestIndices(w, job['wavelengths'])
+        if rows:
+            names = [str(w[i]) for i in rows]
+            results['traces'] = (t, names, z[rows], 'Time (s)', True, True)
+        # Spectra at selected timepoints.
+        columns = nearestIndices(t, job['timepoints'])
+        if columns and w.dtype != object:
+            names = [str(t[j]) for j in columns]
+            results['spectra'] = (w, names, z[:, columns].T, 'Wavelength (nm)', False, False)
+        # SVD of the whole data matrix.
+        rank = min(int(job['svdRank']), min(z.shape))
+        if rank > 0:
+            s, spectraY, tracesY = pyqtsfplotter_core.svdComponents(file1.rawZ, rank)
+            names = ['SVD' + str(k) + ':eig=' + str(s[k]) for k in range(rank)]
+            results['svd_traces'] = (t, names, tracesY, 'Time (s)', True, True)
+            if w.dtype != object:
+                results['svd_spectra'] = (w, names, spectraY, 'Wavelength (nm)', False, False)
+        for key, (x, names, ys, xLabel, logX, byColumn) in results.items():
+            if 'txt' in formats:
+                issue = pyqtsfplotter_core.exportTraces(prefix + '_' + key + '.txt', x, names, ys, byColumn)
+                if issue:
+                    return fileName, written, issue.message
+                written.append(prefix + '_' + key + '.txt')
+            if figures:
+                figureFiles = [prefix + '_' + key + '.' + x for x in figures]
+                saveFigure(figureFiles, x, names, ys, xLabel, logX)
+                written.extend(figureFiles)
+        if 'npz' in formats:
+            arrays = {}
+            for key, (x, names, ys, xLabel, logX, byColumn) in results.items():
+                arrays[key + '_x'] = numpy.asarray(x, dtype = str if x.dtype == object else None)
+                arrays[key + '_names'] = numpy.array(names)
+                arrays[key] = numpy.asarray(ys)
+            numpy.savez(prefix + '.npz', **arrays)
+            written.append(prefix + '.npz')
+    except (OSError, ValueError, numpy.linalg.LinAlgError) as error:
+        return fileName, written, str(error)
+    return fileName, written, ''
+
+def runBatch(job, log = print):
+    fileNames = expandFiles(job['files'])
+    if not fileNames:
+        log('No files match', job['files'])
+        return 1
+    os.makedirs(job['output'], exist_ok = True)
+    prefixes = outputPrefixes(fileNames, job['output'])
+    processes = int(job['processes']) or os.cpu_count() or 1
+    failed = 0
+    with concurrent.futures.ProcessPoolExecutor(max_workers = min(processes, len(fileNames))) as pool:
+        futures = [pool.submit(processFile, fileName, prefix, job) \
+            for fileName, prefix in zip(fileNames, prefixes)]
+        for k, future in enumerate(concurrent.futures.as_completed(futures)):
+            fileName, written, error = future.result()
+            if error:
+                failed += 1
+                log('[{0}/{1}] {2}: skipped, {3}'.format(k + 1, len(futures), fileName, error))
+            else:
+                log('[{0}/{1}] {2}: {3} file(s) written'.format(k + 1, len(futures), fileName, len(written)))
+    log('Done:', len(fileNames) - failed, 'processed,', failed, 'skipped. Output in', job['output'])
+    return 1 if failed else 0
+
+def main(argv):
+    parser = argparse.ArgumentParser(description = 'Batch-process stopped-flow data files without a window.')
+    parser.add_argument('--batch', dest = 'job', metavar = 'JOB', required = True, \
+        help = 'JSON job description, see pyqtsfplotter_batch.py')
+    parser.add_argument('--processes', type = int, help = 'number of worker processes, overrides the job')
+    parser.add_argument('--output', help = 'output directory, overrides the job')
+    args = parser.parse_args(argv)
+    job = loadJob(args.job)
+    if args.processes is not None:
+        job['processes'] = args.processes
+    if args.output:
+        job['output'] = path.abspath(args.output)
+    return runBatch(job)
+
+if __name__ == '__main__':
+    # Also accepts the job file without --batch when run directly.
+    argv = sys.argv[1:]
+    if argv and not argv[0].startswith('-'):
+        argv = ['--batch'] + argv
+    sys.exit(main(argv))
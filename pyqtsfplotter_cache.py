@@ -0,0 +1,170 @@
+#!/usr/bin/python3
+# On-disk cache of parsed raw data files, so that reopening a file skips text parsing.
+# Doesn't need Qt, so it can be used in scripts and worker processes too.
+#
+# Layout of the cache directory:
+#   keys/<hash of absolute path, size and mtime>   text file naming the content hash of that file
+#   data/<content hash>/index.json                 block index of the file (see DataFileObject.indexRawFile)
+#   data/<content hash>/block<k>_{z,w,t}.npy       arrays of block k, memory-mapped when loaded
+# Byte-identical files share one data directory. The modification time of index.json is the last
+# access time used for LRU eviction.
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from os import path
+
+import numpy
+
+def defaultCacheDir():
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA') or path.expanduser('~')
+        return path.join(base, 'pyqtsfplotter', 'cache')
+    base = os.environ.get('XDG_CACHE_HOME') or path.join(path.expanduser('~'), '.cache')
+    return path.join(base, 'pyqtsfplotter')
+
+class ParseCache(object):
+    # Version of the on-disk layout. Entries written by other versions are ignored.
+    version = 1
+
+    def __init__(self, cacheDir = None, maxBytes = 1024 ** 3):
+        super().__init__()
+        self.cacheDir = cacheDir or defaultCacheDir()
+        self.maxBytes = maxBytes
+        self.__lock = threading.Lock()
+
+    def __keysDir(self):
+        return path.join(self.cacheDir, 'keys')
+
+    def __dataDir(self, contentHash = ''):
+        return path.join(self.cacheDir, 'data', contentHash)
+
+    @staticmethod
+    def contentHash(fileName):
+        hash1 = hashlib.sha1()
+        with open(fileName, 'rb') as f1:
+            for chunk in iter(lambda: f1.read(1 << 20), b''):
+                hash1.update(chunk)
+        return hash1.hexdigest()
+
+    # Returns the content hash identifying a file in the cache, or None if caching is not possible.
+    # Only hashes the file content if its path, size or mtime are not known yet.
+    def lookup(self, fileName):
+        try:
+            fileName = path.abspath(fileName)
+            stat1 = os.stat(fileName)
+            fileKey = hashlib.sha1('{0}|{1}|{2}|{3}'.format(ParseCache.version, fileName, \
+                stat1.st_size, stat1.st_mtime_ns).encode(errors = 'replace')).hexdigest()
+            keyFile = path.join(self.__keysDir(), fileKey)
+            if path.isfile(keyFile):
+                with open(keyFile, 'r') as f1:
+                    contentHash = f1.read().strip()
+                if path.isfile(path.join(self.__dataDir(contentHash), 'index.json')):
+                    return contentHash
+            contentHash = self.contentHash(fileName)
+            os.makedirs(self.__keysDir(), exist_ok = True)
+            self.__writeAtomic(keyFile, contentHash.encode())
+            return contentHash
+        except OSError:
+            return None
+
+    # Returns (blocks, nTimeHint) stored for a file, or None.
+    def loadIndex(self, contentHash):
+        indexFile = path.join(self.__dataDir(contentHash), 'index.json')
+        try:
+            with open(indexFile, 'r') as f1:
+                index1 = json.load(f1)
+            os.utime(indexFile)
+        except (OSError, ValueError):
+            return None
+        if index1.get('version') != ParseCache.version:
+            return None
+        return [tuple(block) for block in index1['blocks']], index1['nTimeHint']
+
+    def saveIndex(self, contentHash, blocks, nTimeHint):
+        try:
+            os.makedirs(self.__dataDir(contentHash), exist_ok = True)
+            self.__writeAtomic(path.join(self.__dataDir(contentHash), 'index.json'), \
+                json.dumps({'version': ParseCache.version, 'blocks': blocks, \
+                    'nTimeHint': nTimeHint}).encode())
+        except OSError:
+            pass
+
+    # Returns memory-mapped, read-only (z, w, t) of a block, or None if not cached.
+    def loadBlock(self, contentHash, block):
+        prefix = path.join(self.__dataDir(contentHash), 'block' + str(block))
+        try:
+            z, w, t = [numpy.load(prefix + '_' + name + '.npy', mmap_mode = 'r') for name in 'zwt']
+        except (OSError, ValueError):
+            return None
+        # KinTek column names are stored as strings, but used as labels like in DataFileObject.
+        if w.dtype.kind == 'U':
+            w = numpy.array(w, dtype = object)
+        return z, w, t
+
+    # Path of the .npy file holding array name ('z', 'w' or 't') of a block. Creates its directory.
+    def blockFile(self, contentHash, block, name):
+        os.makedirs(self.__dataDir(contentHash), exist_ok = True)
+        return path.join(self.__dataDir(contentHash), 'block' + str(block) + '_' + name + '.npy')
+
+    # Arrays given as None are expected to be written already, e.g. via blockFile().
+    def saveBlock(self, contentHash, block, z, w, t):
+        prefix = path.join(self.__dataDir(contentHash), 'block' + str(block))
+        try:
+            os.makedirs(self.__dataDir(contentHash), exist_ok = True)
+            for name, array1 in zip('zwt', (z, w, t)):
+                if array1 is None:
+                    continue
+                if array1.dtype == object:
+                    array1 = array1.astype(str)
+                tempFile = prefix + '_' + name + '.' + str(threading.get_ident()) + '.tmp'
+                with open(tempFile, 'wb') as f1:
+                    numpy.save(f1, numpy.ascontiguousarray(array1), allow_pickle = False)
+                os.replace(tempFile, prefix + '_' + name + '.npy')
+        except OSError:
+            return
+        self.evict(contentHash)
+
+    def __writeAtomic(self, fileName, data):
+        tempFile = fileName + '.' + str(threading.get_ident()) + '.tmp'
+        with open(tempFile, 'wb') as f1:
+            f1.write(data)
+        os.replace(tempFile, fileName)
+
+    # Returns [(last access time, size in bytes, content hash)] of all entries.
+    def entries(self):
+        entries = []
+        if not path.isdir(self.__dataDir()):
+            return entries
+        for entry1 in os.scandir(self.__dataDir()):
+            try:
+                size = sum(f.stat().st_size for f in os.scandir(entry1.path))
+                accessed = os.stat(path.join(entry1.path, 'index.json')).st_mtime
+            except OSError:
+                size, accessed = 0, 0
+            entries.append((accessed, size, entry1.name))
+        return entries
+
+    def size(self):
+        return sum(entry1[1] for entry1 in self.entries())
+
+    # Removes least recently used entries until the cache fits in maxBytes, except entry keep.
+    def evict(self, keep = None):
+        with self.__lock:
+            entries = sorted(self.entries())
+            total = sum(entry1[1] for entry1 in entries)
+            for accessed, size, contentHash in entries:
+                if total <= self.maxBytes:
+                    break
+                if contentHash == keep:
+                    continue
+                # Memory-mapped files can't be deleted on Windows; those are left for later.
+                shutil.rmtree(self.__dataDir(contentHash), ignore_errors = True)
+                total -= size
+
+    def clear(self):
+        with self.__lock:
+            shutil.rmtree(self.__dataDir(), ignore_errors = True)
+            shutil.rmtree(self.__keysDir(), ignore_errors = True)
@@ -0,0 +1,15 @@
+#!/usr/bin/python3
+# Matplotlib widgets embedded in the main window.
+# Imported on first use rather than at startup, as the Qt backend of matplotlib is slow to load.
+
+from matplotlib.backends import backend_qt5agg as mpl_qt5
+
+FigureCanvas = mpl_qt5.FigureCanvasQTAgg
+
+class MPLToolbar_Modified(mpl_qt5.NavigationToolbar2QT):
+    toolitems = [item for item in mpl_qt5.NavigationToolbar2QT.toolitems \
+        if item[0] != 'Save']
+
+    def __init__(self, canvas, parent, coordinates=True):
+        super().__init__(canvas, parent, coordinates)
+        # Removes the save tool button.
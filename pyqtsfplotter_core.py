@@ -0,0 +1,1236 @@
+#!/usr/bin/python3
+# Core data library: parsing raw data files, storing datasets, extracting traces, and trace arithmetic.
+# Only needs NumPy, so it works in scripts and worker processes without a QApplication, and its objects
+# can be pickled across processes. Nothing here shows messages: problems are returned as Issue objects,
+# and the caller decides how to report them. pyqtsfplotter_models adapts these objects to Qt models.
+
+import collections
+import functools
+import hashlib
+import io
+import json
+import os
+import re
+import zipfile
+from os import path
+
+import numpy
+
+# Formats written by exportTraces(), read back without any parsing:
+#   .npy: one float64 matrix in the Wavelength,Time layout of ProDataCSV files, timepoints along the first
+#     row and wavelengths down the first column, with NaN in the corner. Labels become their indices.
+#   .npz: float64 arrays z, w and t, labels kept as strings.
+#   .sfb: a line naming the format, a JSON line describing the arrays, then z as float32, rows of
+#     wavelengths. Half the size of .npy; z is memory-mapped when read.
+binaryExtensions = ('.npy', '.npz', '.sfb')
+supportedExtensions = ('.csv', '.txt') + binaryExtensions
+
+# Kinds of issues.
+READ_ERROR = 'read error'
+WRITE_ERROR = 'write error'
+INVALID_DATA = 'invalid data'
+X_MISMATCH = 'different x-axis points'
+NON_NUMERIC_X = 'non-numeric x-axis data'
+FIT_FAILED = 'fit failed'
+
+# Something that went wrong, with enough context for the caller to report or handle it.
+#   kind: one of the kinds above.
+#   message: human-readable description.
+#   fileName, block: where it happened, if about a file.
+#   count: number of items affected, e.g. traces skipped.
+class Issue(object):
+    def __init__(self, kind, message, fileName = '', block = 0, count = 1):
+        super().__init__()
+        self.kind = kind
+        self.message = message
+        self.fileName = fileName
+        self.block = block
+        self.count = count
+    
+    def __str__(self):
+        return self.message
+    
+    def __repr__(self):
+        return 'Issue({0!r}, {1!r})'.format(self.kind, self.message)
+
+# Raw data of one file, stored as NumPy arrays:
+#   z: read-only 2D float array, z[i] is the time trace at wavelength w[i], z[:, j] the spectrum at time t[j].
+#   w, t: 1D axis arrays. KinTek files have column names instead of wavelengths, kept as an object array.
+# A ProDataCSV file may hold several property blocks (e.g. PhotodiodeArray, Count), each with its own header.
+# They are indexed in one scan when the file is opened, and each block is parsed on first access.
+# z, w and t always refer to the current block.
+# Files of at least memoryMapThreshold bytes are parsed out of core: rows are streamed to disk and z is
+# written straight into a memory-mapped .npy file in parseCache, so z is never held in memory as a whole.
+class DataFileObject(object):    
+    # A ParseCache to reuse parsed arrays across sessions, or None to always parse text.
+    parseCache = None
+    # File size in bytes from which blocks are parsed into memory-mapped files. None to disable.
+    # Needs parseCache, which holds the memory-mapped files.
+    memoryMapThreshold = 256 * 1024 ** 2
+    # Wavelengths or timepoints of different files match within this tolerance, relative to the value
+    # looked up, e.g. 470.0 and 470.00001 nm. See lookupTraces().
+    axisTolerance = 1e-6
+    
+    # blocks and parsed restore a file without reading it, e.g. from a session: the block list, and
+    # (blocks parsed, denoised blocks) as returned by parsedBlocks(). Other blocks are parsed on first access.
+    def __init__(self, fileName, blocks = None, parsed = None):
+        super().__init__()
+        self.fName = fileName
+        # Exported binary files are read as fast as cached ones, so they are not cached.
+        self.__cacheKey = DataFileObject.parseCache.lookup(fileName) \
+            if DataFileObject.parseCache and blocks is None \
+                and path.splitext(fileName)[1] not in binaryExtensions else None
+        cachedIndex = DataFileObject.parseCache.loadIndex(self.__cacheKey) \
+            if self.__cacheKey else None
+        # List of (block name, byte offset of header line, True if in Wavelength,Time layout).
+        if blocks is not None:
+            self.blocks, self.__nTimeHint = [tuple(block) for block in blocks], 0
+        elif cachedIndex:
+            self.blocks, self.__nTimeHint = cachedIndex
+        else:
+            self.blocks, self.__nTimeHint = self.indexRawFile(fileName)
+            if self.__cacheKey:
+                DataFileObject.parseCache.saveIndex(self.__cacheKey, self.blocks, self.__nTimeHint)
+        self.__blockData = dict(parsed[0]) if parsed else {}
+        self.__currentBlock = 0
+        # LowRankMatrix shown instead of z, by block; see denoise().
+        self.__lowRank = dict(parsed[1]) if parsed else {}
+        for z, w, t in self.__blockData.values():
+            z.flags.writeable = False
+        # Standard deviations of the points averaged into each point of z, by block, if it was rebinned.
+        self.stdDevs = {}
+        # Sorted axes for lookupTraces(), by (block, whatType), made on first use.
+        self.__axisIndices = {}
+        # Issue describing why the last block read contains no valid data, or None if it does.
+        self.issue = None
+        
+    @property
+    def errorString(self):
+        return self.issue.message if self.issue else ''
+    
+    # Memory-mapped blocks are left out when pickled, e.g. to send the object to another process.
+    # They are mapped again from parseCache, or parsed again, on first access.
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_DataFileObject__blockData'] = {block: data for block, data in self.__blockData.items() \
+            if not isinstance(data[0], numpy.memmap)}
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        for z, w, t in self.__blockData.values():
+            z.flags.writeable = False
+        
+    # z is the low-rank reconstruction of the raw data if the block is denoised, else rawZ.
+    @property
+    def z(self):
+        lowRank = self.__lowRank.get(self.__currentBlock)
+        return lowRank if lowRank is not None else self.rawZ
+    
+    @property
+    def rawZ(self):
+        return self.__loadBlock(self.__currentBlock)[0]
+    
+    @property
+    def w(self):
+        return self.__loadBlock(self.__currentBlock)[1]
+    
+    @property
+    def t(self):
+        return self.__loadBlock(self.__currentBlock)[2]
+    
+    def currentBlock(self):
+        return self.__currentBlock
+    
+    def setCurrentBlock(self, block):
+        if 0 <= block < len(self.blocks):
+            self.__currentBlock = block
+    
+    def blockName(self, block = None):
+        return self.blocks[self.__currentBlock if block is None else block][0]
+    
+    def isBlockLoaded(self, block):
+        return block in self.__blockData
+    
+    # Returns ({block: (raw z, w, t)} of the blocks parsed so far, {block: LowRankMatrix} of denoised blocks).
+    def parsedBlocks(self):
+        return dict(self.__blockData), dict(self.__lowRank)
+    
+    # Denoises the current block: z becomes the reconstruction of the raw data from its first rank SVD
+    # components, kept in factored form as a LowRankMatrix. factors is (U, s, Vt) of rawZ from
+    # truncatedSvd, if already computed, with at least rank components. rank 0 restores the raw data.
+    def denoise(self, rank, factors = None):
+        if rank <= 0:
+            self.__lowRank.pop(self.__currentBlock, None)
+            return
+        U, s, Vt = factors if factors is not None else truncatedSvd(self.rawZ, rank)
+        rank = min(rank, len(s))
+        # Copies, so that full economy SVD factors are not kept alive by views.
+        self.__lowRank[self.__currentBlock] = LowRankMatrix(U[:, :rank] * s[:rank], Vt[:rank].copy())
+    
+    # Standard deviations of z of the current block, if it was rebinned (see rebin()), else None.
+    def zStdDev(self):
+        return self.stdDevs.get(self.__currentBlock)
+    
+    # A new DataFileObject of the current block averaged over bins of timepoints and wavelengths, with the
+    # standard deviation of each bin in stdDevs, so that plots, SVD and export work on fewer points.
+    # A denoised block is binned as shown. timeBins, wavelengthBins: numbers of bins, 0 to keep all points.
+    # timeSpacing: 'log' for time bins equally spaced on a log scale, 'count' for time bins of equal
+    # numbers of points; wavelength bins are of equal numbers of points. Returns (file, None), or
+    # (None, Issue) if an axis to bin holds labels.
+    def rebin(self, timeBins, wavelengthBins = 0, timeSpacing = 'log'):
+        z, w, t = self.z, self.w, self.t
+        rowOrder = columnOrder = None
+        if wavelengthBins > 0:
+            w, issue = numericAxis(w)
+            if issue:
+                return None, Issue(NON_NUMERIC_X, 'Traces of ' + self.fName \
+                    + ' are named rather than at wavelengths, so they can\'t be binned.', self.fName)
+            w, rowOrder, rowStarts = binStarts(w, wavelengthBins, 'count')
+        else:
+            rowStarts = numpy.arange(len(w))
+        if timeBins > 0:
+            t, issue = numericAxis(t)
+            if issue:
+                return None, issue
+            t, columnOrder, columnStarts = binStarts(t, timeBins, timeSpacing)
+        else:
+            columnStarts = numpy.arange(len(t))
+        # Bins are runs of points of ascending axes.
+        if rowOrder is not None:
+            z = z[rowOrder]
+        if columnOrder is not None:
+            z = numpy.asarray(z)[:, columnOrder]
+        z, stdDev = binMeans(z, rowStarts, columnStarts)
+        if wavelengthBins > 0:
+            w = binMeans(w[numpy.newaxis], [0], rowStarts)[0][0]
+        if timeBins > 0:
+            t = binMeans(t[numpy.newaxis], [0], columnStarts)[0][0]
+        file1 = DataFileObject(self.fName, [self.blocks[self.__currentBlock]], ({0: (z, w, t)}, {}))
+        file1.stdDevs[0] = stdDev
+        return file1, None
+    
+    # Rank of the reconstruction shown for the current block, or 0 for raw data.
+    def denoisedRank(self):
+        lowRank = self.__lowRank.get(self.__currentBlock)
+        return lowRank.rank if lowRank is not None else 0
+    
+    def isValid(self):
+        return (True if (self.z.size and len(self.w) and len(self.t)) else False)
+    
+    # Trace extraction. whatType is True for time traces (one per wavelength), False for spectra.
+    # Traces are read-only views of z, without copying data.
+    def axis(self, whatType):
+        return self.w if whatType else self.t
+    
+    def trace(self, i, whatType):
+        return (self.t, self.z[i]) if whatType else (self.w, self.z[:, i])
+    
+    # Indices of the traces nearest to each of values, as an array, with -1 where no wavelength or
+    # timepoint is within axisTolerance (or tolerance, if given) of the value. Label axes (KinTek column
+    # names) match by name. All values are looked up at once in a sorted copy of the axis.
+    def lookupTraces(self, values, whatType, tolerance = None):
+        tolerance = DataFileObject.axisTolerance if tolerance is None else tolerance
+        axisIndex = self.__axisIndex(whatType)
+        if isinstance(axisIndex, dict):
+            return numpy.array([axisIndex.get(str(x), -1) for x in values], dtype = numpy.intp)
+        sortedAxis, order = axisIndex
+        count = len(values)
+        values, issue = numericAxis(values)
+        if issue or not len(sortedAxis):
+            return numpy.full(count, -1, dtype = numpy.intp)
+        nearest, distance = nearestPoints(sortedAxis, order, values)
+        found = (distance == 0) | (distance <= tolerance * numpy.absolute(values))
+        return numpy.where(found, nearest, -1)
+    
+    # Indices of the traces at the given wavelength or timepoint, within axisTolerance.
+    def findTraces(self, value, whatType):
+        i = self.lookupTraces([value], whatType)[0]
+        return [int(i)] if i >= 0 else []
+    
+    def __axisIndex(self, whatType):
+        key = (self.__currentBlock, bool(whatType))
+        if key not in self.__axisIndices:
+            axis = self.axis(whatType)
+            if axis.dtype == object:
+                labels = {}
+                for i, label in enumerate(axis):
+                    labels.setdefault(str(label), i)
+                self.__axisIndices[key] = labels
+            else:
+                order = numpy.argsort(axis, kind = 'stable')
+                self.__axisIndices[key] = (axis[order], order)
+        return self.__axisIndices[key]
+    
+    def isOutOfCore(self):
+        if not self.__cacheKey or DataFileObject.memoryMapThreshold is None:
+            return False
+        try:
+            return path.getsize(self.fName) >= DataFileObject.memoryMapThreshold
+        except OSError:
+            return False
+    
+    def __loadBlock(self, block):
+        if block not in self.__blockData:
+            # Cached arrays are memory-mapped rather than read.
+            cachedData = DataFileObject.parseCache.loadBlock(self.__cacheKey, block) \
+                if self.__cacheKey else None
+            if cachedData:
+                z, w, t = cachedData
+                self.issue = None
+            else:
+                zFile = DataFileObject.parseCache.blockFile(self.__cacheKey, block, 'z') \
+                    if self.isOutOfCore() else None
+                z, w, t = self.importRawFile(self.fName, block, zFile)
+                if self.__cacheKey and z.size:
+                    # z of out-of-core blocks is already in the cache.
+                    DataFileObject.parseCache.saveBlock(self.__cacheKey, block, \
+                        None if zFile else z, w, t)
+            z.flags.writeable = False
+            self.__blockData[block] = (z, w, t)
+        return self.__blockData[block]
+    
+    # Rows parsed per numpy.loadtxt() call while reading a data block.
+    blockChunkRows = 1024
+    
+    # Scans the file once for block headers, without parsing any numbers.
+    # Returns (blocks, number of timepoints from "Available Dimensions" metadata, or 0).
+    def indexRawFile(self, fileName):
+        extension = path.splitext(fileName)[1]
+        blocks = []
+        nTimeHint = 0
+        if extension == '.csv':
+            with open(fileName, mode='rb') as f1:
+                offset = 0
+                lastLine = b''
+                for line1 in f1:
+                    if b'Time,Wavelength' in line1 or b'Wavelength,Time' in line1:
+                        name = lastLine.strip().decode(errors = 'replace') or 'Block ' + str(len(blocks))
+                        blocks.append((name, offset, b'Wavelength,Time' in line1))
+                    elif not blocks and not nTimeHint:
+                        hint1 = re.match(rb'Time,\s*(\d+) time points', line1)
+                        if hint1:
+                            nTimeHint = int(hint1.group(1))
+                    if line1.strip():
+                        lastLine = line1
+                    offset += len(line1)
+        elif extension == '.txt' or extension in binaryExtensions:
+            blocks.append(('', 0, False))
+        return blocks, nTimeHint
+    
+    # If zFile is given, z is written to that .npy file and returned memory-mapped.
+    def importRawFile(self, fileName, block = 0, zFile = None):
+        extension = path.splitext(fileName)[1]
+        z = numpy.empty((0, 0))
+        t = numpy.empty(0)
+        w = numpy.empty(0)
+        validFile = True
+        # Why a binary file couldn't be read, for the issue reported.
+        readError = ''
+        if block < len(self.blocks) and extension in binaryExtensions:
+            try:
+                z, w, t = readExportedFile(fileName)
+            except (ValueError, KeyError, zipfile.BadZipFile) as error:
+                readError = ' ' + str(error)
+                validFile = False
+        elif block < len(self.blocks):
+            offset, flag_wt = self.blocks[block][1:]
+            with open(fileName, mode='rb') as f0:
+                f0.seek(offset)
+                f1 = io.TextIOWrapper(f0)
+                # Reads header line.
+                line1 = f1.readline()
+                if extension == '.csv':
+                    line1 = f1.readline()
+                    try:
+                        axis1 = numpy.array([float(x) for x in line1.split(sep=',')[1:-1]])
+                    except ValueError:
+                        validFile = False
+                    else:
+                        if flag_wt:
+                            t = axis1
+                        else:
+                            w = axis1
+                elif extension == '.txt':
+                    line1Items = line1.split()
+                    if line1Items and line1Items[0] == 'Time' and len(line1Items) > 1:
+                        w = numpy.array(line1Items[1:], dtype = object)
+                # Reads the rest of the data, if any, as one 2D block.
+                sepString = ',' if extension == '.csv' else None
+                # Copies into contiguous arrays, so that time traces are contiguous rows of z.
+                if len(w) and zFile:
+                    t, z, validBlock = self.__readNumericBlockToNpy(f1, 1 + len(w), sepString, zFile, True)
+                elif len(w):
+                    block1, validBlock = self.__readNumericBlock(f1, 1 + len(w), sepString, self.__nTimeHint)
+                    t = block1[:, 0].copy()
+                    z = numpy.ascontiguousarray(block1[:, 1:].T)
+                elif len(t) and zFile:
+                    w, z, validBlock = self.__readNumericBlockToNpy(f1, 1 + len(t), sepString, zFile, False)
+                elif len(t):
+                    block1, validBlock = self.__readNumericBlock(f1, 1 + len(t), sepString, 0)
+                    w = block1[:, 0].copy()
+                    z = numpy.ascontiguousarray(block1[:, 1:])
+                else:
+                    validBlock = True
+                validFile &= validBlock
+        blockString = ' (' + self.blocks[block][0] + ')' if block < len(self.blocks) and block > 0 else ''
+        print(fileName + blockString, ': ', z.size, '=', len(w), '*', len(t))
+        if not (len(w) > 0 and len(t) > 0 and validFile):
+            # No popup here, as files may be read outside the GUI thread. Callers report issue.
+            self.issue = Issue(INVALID_DATA, 'File ' + fileName + blockString + ' contains no valid data.' \
+                + readError, fileName, block)
+            # Leaves nothing behind, so that isValid() agrees with the message.
+            return numpy.empty((0, 0)), numpy.empty(0), numpy.empty(0)
+        self.issue = None
+        return z, w, t
+    
+    # Reads consecutive rows of nColumns numbers into a 2D array, until a blank line,
+    # end of file, or a row with a different number of columns.
+    # Returns (array, valid); valid is False if any row in the block is not numeric.
+    def __readNumericBlock(self, f1, nColumns, sepString, nRowsHint):
+        block = [numpy.empty((max(nRowsHint, DataFileObject.blockChunkRows), nColumns))]
+        def appendRows(nRows, rows):
+            if nRows + len(rows) > block[0].shape[0]:
+                block[0] = numpy.concatenate((block[0][:nRows], \
+                    numpy.empty((max(nRows, len(rows)), nColumns))))
+            block[0][nRows : nRows + len(rows)] = rows
+        nRows, validBlock = self.__readNumericChunks(f1, nColumns, sepString, appendRows)
+        return block[0][:nRows], validBlock
+    
+    # Parses a data block in chunks of blockChunkRows rows, passing each to appendRows(nRowsBefore, rows).
+    # Returns (number of rows, valid).
+    def __readNumericChunks(self, f1, nColumns, sepString, appendRows):
+        nRows = 0
+        validBlock = True
+        chunk = []
+        while True:
+            line1 = f1.readline()
+            endOfBlock = not line1.strip()
+            if not endOfBlock:
+                nItems = line1.count(sepString) + 1 if sepString else len(line1.split())
+                if nItems != nColumns:
+                    try:
+                        [float(x) for x in line1.split(sep=sepString)]
+                    except ValueError:
+                        validBlock = False
+                    endOfBlock = True
+                else:
+                    chunk.append(line1)
+            if chunk and (endOfBlock or len(chunk) >= DataFileObject.blockChunkRows):
+                try:
+                    rows = numpy.loadtxt(chunk, delimiter = sepString, ndmin = 2, comments = None)
+                except ValueError:
+                    validBlock = False
+                    rows = numpy.zeros((len(chunk), nColumns))
+                appendRows(nRows, rows)
+                nRows += len(chunk)
+                chunk = []
+            if endOfBlock:
+                break
+        return nRows, validBlock
+    
+    # Out-of-core counterpart of __readNumericBlock, with memory use bounded by blockChunkRows.
+    # Streams the data columns to a temporary file, then writes them, transposed or not, into the .npy
+    # file zFile with plain file writes. Returns (first column, z memory-mapped read-only, valid).
+    def __readNumericBlockToNpy(self, f1, nColumns, sepString, zFile, transpose):
+        nData = nColumns - 1
+        # Temporary files are unique per process and object, in case a file is opened twice at once.
+        tempPrefix = zFile + '.' + str(os.getpid()) + '-' + str(id(self))
+        axis1 = []
+        try:
+            with open(tempPrefix + '.rows.tmp', 'wb') as f2:
+                def appendRows(nRows, rows):
+                    axis1.append(rows[:, 0].copy())
+                    numpy.ascontiguousarray(rows[:, 1:]).tofile(f2)
+                nRows, validBlock = self.__readNumericChunks(f1, nColumns, sepString, appendRows)
+            axis1 = numpy.concatenate(axis1) if axis1 else numpy.empty(0)
+            shape = (nData, nRows) if transpose else (nRows, nData)
+            if not (validBlock and nRows):
+                return axis1, numpy.empty(shape), validBlock
+            # Creates the .npy header and file at full size, then fills it in chunks of rows.
+            z = numpy.lib.format.open_memmap(tempPrefix + '.tmp', mode = 'w+', \
+                dtype = numpy.float64, shape = shape)
+            del z
+            headerLength = path.getsize(tempPrefix + '.tmp') - nData * nRows * 8
+            chunkRows = DataFileObject.blockChunkRows
+            with open(tempPrefix + '.rows.tmp', 'rb') as f2, open(tempPrefix + '.tmp', 'r+b') as f3:
+                for i in range(0, nRows, chunkRows):
+                    rows = numpy.fromfile(f2, dtype = numpy.float64, \
+                        count = min(chunkRows, nRows - i) * nData).reshape(-1, nData)
+                    if transpose:
+                        for j in range(nData):
+                            f3.seek(headerLength + (j * nRows + i) * 8)
+                            numpy.ascontiguousarray(rows[:, j]).tofile(f3)
+                    else:
+                        f3.seek(headerLength + i * nData * 8)
+                        rows.tofile(f3)
+            os.replace(tempPrefix + '.tmp', zFile)
+        finally:
+            for tempFile in (tempPrefix + '.rows.tmp', tempPrefix + '.tmp'):
+                if path.exists(tempFile):
+                    os.remove(tempFile)
+        return axis1, numpy.load(zFile, mmap_mode = 'r'), validBlock
+    
+
+# Read-only matrix given as the product of factors US (m x rank) and Vt (rank x n), e.g. a low-rank
+# reconstruction of a data matrix from its SVD. Indexing like z[i], z[:, j] or z[rows] computes only
+# the rows, columns or elements asked for, so memory stays rank * (m + n) instead of m * n.
+# numpy.asarray() gives the dense matrix.
+class LowRankMatrix(object):
+    def __init__(self, US, Vt):
+        super().__init__()
+        self.US = numpy.ascontiguousarray(US, dtype = numpy.float64)
+        self.Vt = numpy.ascontiguousarray(Vt, dtype = numpy.float64)
+    
+    @property
+    def rank(self):
+        return self.US.shape[1]
+    
+    @property
+    def shape(self):
+        return (self.US.shape[0], self.Vt.shape[1])
+    
+    @property
+    def size(self):
+        return self.US.shape[0] * self.Vt.shape[1]
+    
+    @property
+    def dtype(self):
+        return self.US.dtype
+    
+    ndim = 2
+    
+    def __len__(self):
+        return self.US.shape[0]
+    
+    def __getitem__(self, key):
+        rows, columns = key if isinstance(key, tuple) else (key, slice(None))
+        result = numpy.dot(self.US[rows], self.Vt[:, columns])
+        if isinstance(result, numpy.ndarray):
+            result.flags.writeable = False
+        return result
+    
+    def __array__(self, dtype = None):
+        result = numpy.dot(self.US, self.Vt)
+        return result if dtype is None else result.astype(dtype)
+
+# Opens a raw data file and parses its first block.
+# Returns (DataFileObject, None), or (None, Issue) if the file can't be read or has no valid data.
+def openDataFile(fileName):
+    try:
+        file1 = DataFileObject(fileName)
+        if file1.isValid():
+            return file1, None
+        return None, file1.issue
+    except (OSError, UnicodeDecodeError) as error:
+        return None, Issue(READ_ERROR, str(error), fileName)
+
+# Values formatted and written per chunk when exporting, so that memory use stays bounded.
+exportChunkValues = 1 << 20
+
+# Writes traces sharing x to fileName, in the format given by its extension: .txt (KinTek layout),
+# or one of binaryExtensions. With byColumn (time traces), x is time and each trace is a wavelength;
+# otherwise (spectra), x is wavelength and each trace a timepoint. In text files traces are columns
+# or rows accordingly, like the files DataFileObject imports.
+# ys is a 2D array or a list of 1D arrays, and is read a chunk at a time, so memory-mapped data is
+# streamed to the file rather than loaded. Returns None, or an Issue if the file can't be written.
+def exportTraces(fileName, x, names, ys, byColumn = True):
+    extension = path.splitext(fileName)[1]
+    names = [str(name) for name in names]
+    # Rows i0 to i1 of the traces, or of their transpose, as a float64 array. In terms of a data file,
+    # z[i] is the time trace at wavelength w[i]; binary files store rows of z, text files rows of z.T.
+    def traceRows(i0, i1):
+        return numpy.array(ys[i0:i1], dtype = numpy.float64).reshape(-1, len(x))
+    def pointRows(k0, k1):
+        if getattr(ys, 'ndim', 1) == 2:
+            return numpy.array(ys[:, k0:k1], dtype = numpy.float64).T
+        return numpy.array([y[k0:k1] for y in ys], dtype = numpy.float64).reshape(len(names), -1).T
+    if byColumn:
+        w, t, zRows, ztRows = names, x, traceRows, pointRows
+    else:
+        w, t, zRows, ztRows = x, names, pointRows, traceRows
+    try:
+        if extension == '.txt':
+            # KinTek files are split at whitespace.
+            labels = [str(x1).replace(' ', '') for x1 in w]
+            writeChunks(fileName, 'w', 'Time' + ''.join('\t' + x1 for x1 in labels) + '\n', \
+                len(t), len(w), ztRows, \
+                lambda k0, rows: textRows([str(x1).replace(' ', '') for x1 in t[k0 : k0 + len(rows)]], rows))
+        elif extension in binaryExtensions:
+            wAxis, wLabels = exportAxis(w)
+            tAxis = exportAxis(t)[0]
+            if extension == '.npy':
+                header = npyHeader(numpy.float64, (len(wAxis) + 1, len(tAxis) + 1))
+                firstRow = numpy.concatenate(([numpy.nan], tAxis))
+                writeChunks(fileName, 'wb', header + firstRow.tobytes(), len(wAxis), len(tAxis), zRows, \
+                    lambda i0, rows: numpy.column_stack((wAxis[i0 : i0 + len(rows)], rows)).tobytes())
+            elif extension == '.npz':
+                with zipfile.ZipFile(fileName, 'w', allowZip64 = True) as archive1:
+                    for key, axis1 in (('w', wLabels if wLabels is not None else wAxis), ('t', tAxis)):
+                        with archive1.open(key + '.npy', 'w') as f1:
+                            numpy.save(f1, axis1, allow_pickle = False)
+                    with archive1.open('z.npy', 'w', force_zip64 = True) as f1:
+                        writeChunks(f1, None, npyHeader(numpy.float64, (len(wAxis), len(tAxis))), \
+                            len(wAxis), len(tAxis), zRows, lambda i0, rows: rows.tobytes())
+            else:
+                header = json.dumps({'version': 1, 'dtype': '<f4', 'shape': [len(wAxis), len(tAxis)], \
+                    'w': wLabels.tolist() if wLabels is not None else wAxis.tolist(), 't': tAxis.tolist()})
+                writeChunks(fileName, 'wb', sfbMagic + padHeader(header.encode(), len(sfbMagic)), \
+                    len(wAxis), len(tAxis), zRows, lambda i0, rows: rows.astype('<f4').tobytes())
+        else:
+            return Issue(WRITE_ERROR, 'Unknown file format ' + extension + '.', fileName)
+    except OSError as error:
+        return Issue(WRITE_ERROR, str(error), fileName)
+    return None
+
+# First line of .sfb files.
+sfbMagic = b'PYQTSFPLOTTER BINARY\n'
+
+# Writes header, then nRows rows of rowLength values, formatted by formatRows(first row, rows)
+# a chunk at a time. f1 is a file name opened with mode, or an open binary file if mode is None.
+def writeChunks(f1, mode, header, nRows, rowLength, rowsOf, formatRows):
+    chunkRows = max(exportChunkValues // max(rowLength, 1), 1)
+    file1 = open(f1, mode) if mode else f1
+    try:
+        file1.write(header)
+        for i0 in range(0, nRows, chunkRows):
+            file1.write(formatRows(i0, rowsOf(i0, min(i0 + chunkRows, nRows))))
+    finally:
+        if mode:
+            file1.close()
+
+# Tab-separated text lines, each a label followed by a row of values, in shortest round-trip notation.
+def textRows(labels, rows):
+    rowFormat = '%s' + '\t%r' * rows.shape[1] + '\n'
+    return ''.join(rowFormat % ((label,) + tuple(row)) for label, row in zip(labels, rows.tolist()))
+
+# Returns (float64 axis, None), or (indices, labels as strings) if the axis holds text.
+def exportAxis(axis1):
+    numbers, issue = numericAxis(axis1)
+    if issue:
+        return numpy.arange(len(axis1), dtype = numpy.float64), numpy.array([str(x) for x in axis1])
+    return numbers.reshape(-1), None
+
+# Pads a header line with spaces, so that the data after it is aligned to 64 bytes, like in .npy files.
+def padHeader(header, offset):
+    return header + b' ' * (-(offset + len(header) + 1) % 64) + b'\n'
+
+def npyHeader(dtype, shape):
+    f1 = io.BytesIO()
+    numpy.lib.format.write_array_header_1_0(f1, {'descr': numpy.lib.format.dtype_to_descr(numpy.dtype(dtype)), \
+        'fortran_order': False, 'shape': shape})
+    return f1.getvalue()
+
+# Reads a file written by exportTraces() in one of binaryExtensions. Returns (z, w, t) as a data block of
+# DataFileObject; z is memory-mapped except from .npz. Raises ValueError, KeyError or
+# zipfile.BadZipFile if it isn't one.
+def readExportedFile(fileName):
+    extension = path.splitext(fileName)[1]
+    if extension == '.npy':
+        matrix = numpy.load(fileName, mmap_mode = 'r')
+        if matrix.ndim != 2 or matrix.dtype.kind != 'f':
+            raise ValueError('Not a 2D matrix of numbers.')
+        return matrix[1:, 1:], numpy.array(matrix[1:, 0]), numpy.array(matrix[0, 1:])
+    if extension == '.npz':
+        with numpy.load(fileName, allow_pickle = False) as arrays:
+            z, w, t = arrays['z'], arrays['w'], arrays['t']
+        # Labels are used as in KinTek files.
+        if w.dtype.kind == 'U':
+            w = numpy.array(w, dtype = object)
+        return numpy.asarray(z, dtype = numpy.float64), w, numpy.asarray(t, dtype = numpy.float64)
+    with open(fileName, 'rb') as f1:
+        if f1.readline() != sfbMagic:
+            raise ValueError('Not a ' + extension + ' file.')
+        header = json.loads(f1.readline().decode())
+        offset = f1.tell()
+    w = numpy.array(header['w'], dtype = object if any(isinstance(x, str) for x in header['w']) \
+        else numpy.float64)
+    t = numpy.array(header['t'], dtype = numpy.float64)
+    z = numpy.memmap(fileName, dtype = header['dtype'], mode = 'r', offset = offset, \
+        shape = tuple(header['shape'])) if len(w) and len(t) else numpy.empty((0, 0))
+    return z, w, t
+
+# Linear interpolation of traces onto other x-axis points, e.g. onto a grid common to traces recorded with
+# different time or wavelength points, so that they can be combined. Interpolation weights are computed once
+# per pair of source and target points, and kept for the next traces with the same points.
+class Resampler(object):
+    # Number of pairs of x-axes whose weights are kept; the least recently used are dropped first.
+    maxEntries = 64
+    
+    def __init__(self):
+        super().__init__()
+        self.__weights = collections.OrderedDict()
+    
+    # (left, right, fraction): the points of xFrom around each point of xTo, and the weight of the right one.
+    # fraction is NaN at points of xTo outside the range of xFrom.
+    def weights(self, xFrom, xTo):
+        xFrom = numpy.asarray(xFrom, dtype = numpy.float64)
+        xTo = numpy.asarray(xTo, dtype = numpy.float64)
+        key = (axisKey(xFrom), axisKey(xTo))
+        entry = self.__weights.get(key)
+        # The axes are kept with their weights, not copied, and compared in full on a hit.
+        if entry is None or not (numpy.array_equal(entry[0], xFrom) and numpy.array_equal(entry[1], xTo)):
+            entry = self.__weights[key] = (xFrom, xTo, interpolationWeights(xFrom, xTo))
+            if len(self.__weights) > self.maxEntries:
+                self.__weights.popitem(last = False)
+        self.__weights.move_to_end(key)
+        return entry[2]
+    
+    # Trace y, or the rows of 2D array y, one trace per row, at x-axis points xTo, interpolated from points
+    # xFrom. All rows are interpolated at once.
+    def resample(self, xFrom, xTo, y):
+        left, right, fraction = self.weights(xFrom, xTo)
+        y = numpy.asarray(y, dtype = numpy.float64)
+        return y[..., left] * (1 - fraction) + y[..., right] * fraction
+
+# Small key of a float64 axis for Resampler: its length, ends, and a digest of its values, made without
+# copying them.
+def axisKey(x):
+    if not len(x):
+        return (0, )
+    return (len(x), float(x[0]), float(x[-1]), \
+        hashlib.blake2b(numpy.ascontiguousarray(x), digest_size = 16).digest())
+
+# Weights of Resampler.weights(). Non-finite points of xFrom are left out; xFrom needn't be sorted.
+# Points of xTo matching one of xFrom take its value only, even if a neighbour is NaN.
+def interpolationWeights(xFrom, xTo):
+    order = numpy.flatnonzero(numpy.isfinite(xFrom))
+    order = order[numpy.argsort(xFrom[order], kind = 'stable')]
+    sortedX = xFrom[order]
+    if len(order) == 0:
+        return numpy.zeros(len(xTo), dtype = numpy.intp), numpy.zeros(len(xTo), dtype = numpy.intp), \
+            numpy.full(len(xTo), numpy.nan)
+    # sortedX[k - 1] < x <= sortedX[k] for each point x of xTo inside the range of xFrom.
+    k = numpy.clip(numpy.searchsorted(sortedX, xTo), 1, max(len(order) - 1, 1))
+    k0 = k - 1
+    k = numpy.minimum(k, len(order) - 1)
+    width = sortedX[k] - sortedX[k0]
+    with numpy.errstate(divide = 'ignore', invalid = 'ignore'):
+        fraction = numpy.where(width > 0, (xTo - sortedX[k0]) / width, 0.0)
+    left, right = order[k0], order[k]
+    left = numpy.where(fraction == 1, right, left)
+    right = numpy.where(fraction == 0, left, right)
+    fraction = numpy.where(fraction == 1, 0.0, fraction)
+    outside = ~((xTo >= sortedX[0]) & (xTo <= sortedX[-1]))
+    fraction[outside] = numpy.nan
+    return left, right, fraction
+
+defaultResampler = Resampler()
+
+# Kinds of common grids of commonGrid().
+#   union: all points of all traces.
+#   intersection: the points every trace has, so that none is interpolated.
+#   linear, log: nPoints equally or logarithmically spaced points over the range covered by every trace.
+gridKinds = ('union', 'intersection', 'linear', 'log')
+
+# x-axis points onto which traces with x-axes xs can be resampled together.
+# Returns (grid, None), or (None, Issue) if their ranges, or for intersection their points, don't overlap.
+def commonGrid(xs, kind, nPoints = 1000):
+    arrays = []
+    for x1 in xs:
+        x1, issue = numericAxis(x1)
+        if issue:
+            return None, issue
+        arrays.append(x1[numpy.isfinite(x1)])
+    if not arrays or not all(len(x1) for x1 in arrays):
+        return None, Issue(INVALID_DATA, 'Found traces without any x-axis points.')
+    if kind == 'union':
+        return numpy.unique(numpy.concatenate(arrays)), None
+    elif kind == 'intersection':
+        grid = functools.reduce(numpy.intersect1d, arrays)
+        if not len(grid):
+            return None, Issue(X_MISMATCH, 'The traces have no x-axis points in common.')
+        return grid, None
+    lo = max(x1.min() for x1 in arrays)
+    hi = min(x1.max() for x1 in arrays)
+    if kind == 'log':
+        positives = [x1[x1 > 0] for x1 in arrays]
+        lo = max(x1.min() for x1 in positives) if all(len(x1) for x1 in positives) else numpy.inf
+    if not lo <= hi:
+        return None, Issue(X_MISMATCH, 'The x-axis ranges of the traces don\'t overlap' \
+            + (' at positive points.' if kind == 'log' else '.'))
+    if kind == 'linear':
+        return numpy.linspace(lo, hi, max(int(nPoints), 2)), None
+    elif kind == 'log':
+        return numpy.geomspace(lo, hi, max(int(nPoints), 2)), None
+    raise ValueError('Unknown grid kind: ' + str(kind))
+
+# A trace defined by an operation on parent traces, e.g. (parent - ref) x k, so that it can be
+# evaluated again from its parents instead of keeping a copy of its data, and tells where it came from.
+#   op: 'add' or 'multiply' (by value), 'subtractAt' (its own value at point value = (index, x)),
+#     'subtract' (the second parent), 'mean' or 'std' (of all parents), 'resample' (from x-axis points
+#     value[0] onto value[1], see Resampler).
+#   parents: DerivedTrace, or y arrays of traces not derived from others; names: names of the parents.
+#   cache: y data while it is kept, e.g. while the trace is shown; None to evaluate it when needed.
+class DerivedTrace(object):
+    def __init__(self, op, parents, names, value = None, cache = None):
+        super().__init__()
+        self.op = op
+        self.parents = list(parents)
+        self.names = list(names)
+        self.value = value
+        self.cache = cache
+    
+    def evaluate(self):
+        if self.cache is not None:
+            return self.cache
+        ys = [parent.evaluate() if isinstance(parent, DerivedTrace) else parent for parent in self.parents]
+        if self.op == 'add':
+            return ys[0] + self.value
+        elif self.op == 'multiply':
+            return ys[0] * self.value
+        elif self.op == 'subtractAt':
+            return ys[0] - ys[0][self.value[0]]
+        elif self.op == 'subtract':
+            return ys[0] - ys[1]
+        elif self.op == 'mean':
+            return numpy.mean(numpy.array(ys, dtype = numpy.float64), axis = 0)
+        elif self.op == 'std':
+            return numpy.std(numpy.array(ys, dtype = numpy.float64), axis = 0, ddof = 1)
+        elif self.op == 'resample':
+            return defaultResampler.resample(self.value[0], self.value[1], ys[0])
+        raise ValueError('Unknown trace operation: ' + str(self.op))
+    
+    # The expression of the trace in names of the traces it was derived from, e.g. (File0: 400 nm - 0.5) x 2.
+    def lineage(self):
+        parents = list(zip(self.parents, self.names))
+        if len(parents) > 4:
+            parents = parents[:2] + parents[-1:]
+        terms = [('(' + parent.lineage() + ')') if isinstance(parent, DerivedTrace) else str(name) \
+            for parent, name in parents]
+        if self.op == 'add':
+            return terms[0] + (' + ' if self.value >= 0 else ' - ') + str(abs(self.value))
+        elif self.op == 'multiply':
+            return terms[0] + ' x ' + str(self.value)
+        elif self.op == 'subtractAt':
+            return terms[0] + ' - its value at ' + str(self.value[1])
+        elif self.op == 'subtract':
+            return terms[0] + ' - ' + terms[1]
+        elif self.op == 'resample':
+            return terms[0] + ' on ' + str(len(self.value[1])) + ' x-axis points'
+        elif len(self.parents) > 4:
+            return self.op + '(' + ', '.join(terms[:2]) + ', ..., ' + terms[2] + '; ' \
+                + str(len(self.parents)) + ' traces)'
+        return self.op + '(' + ', '.join(terms) + ')'
+
+# Traces handled together: parallel lists of names, x arrays and y arrays,
+# plus issues met while making them, e.g. input traces that had to be skipped.
+# derived holds the DerivedTrace of each trace made by an operation, None for others.
+# Traces sharing x-axis points are processed as one 2D array (see groups()), and results of such a
+# group share one x array and are rows of one result array, so they are added to plots as a block.
+class TraceSet(object):
+    def __init__(self, names = None, xs = None, ys = None, derived = None):
+        super().__init__()
+        self.names = list(names or [])
+        self.xs = list(xs or [])
+        self.ys = list(ys or [])
+        self.derived = list(derived or [None] * len(self.names))
+        self.issues = []
+    
+    def __len__(self):
+        return len(self.names)
+    
+    def append(self, name, x, y, derived = None):
+        self.names.append(name)
+        self.xs.append(x)
+        self.ys.append(y)
+        self.derived.append(derived)
+    
+    # Appends the rows of 2D array ys as traces, all with x-axis x.
+    def extend(self, names, x, ys, derived = None):
+        self.names.extend(names)
+        self.xs.extend([x] * len(ys))
+        self.ys.extend(ys)
+        self.derived.extend(derived or [None] * len(ys))
+    
+    # What trace i is made of, as a parent of traces derived from it: its DerivedTrace, or its y array.
+    def source(self, i):
+        return self.ys[i] if self.derived[i] is None else self.derived[i]
+    
+    # DerivedTrace of result rows ys of operation op on traces indices, one parent each.
+    def derive(self, indices, op, ys, value = None):
+        return [DerivedTrace(op, [self.source(i)], [self.names[i]], value, y) for i, y in zip(indices, ys)]
+    
+    # Splits the traces into groups with the same x-axis points, in order of first appearance.
+    # Returns [(x, indices)]. The same x array object is recognized without comparing its values.
+    def groups(self):
+        groups = []
+        byId = {}
+        for i, x1 in enumerate(self.xs):
+            group = byId.get(id(x1))
+            if group is None:
+                for group1 in groups:
+                    if numpy.array_equal(group1[0], x1):
+                        group = group1
+                        break
+                else:
+                    group = (x1, [])
+                    groups.append(group)
+                byId[id(x1)] = group
+            group[1].append(i)
+        return groups
+    
+    # y arrays of the traces at indices as one 2D float array, one trace per row.
+    def stack(self, indices):
+        return numpy.array([self.ys[i] for i in indices], dtype = numpy.float64, ndmin = 2)
+    
+    # Number of input traces skipped because of issues of the given kind.
+    def skipped(self, kind):
+        return sum(issue1.count for issue1 in self.issues if issue1.kind == kind)
+    
+    # Records that count input traces were skipped for having different x-axis points.
+    def addMismatch(self, count):
+        if count:
+            self.issues.append(Issue(X_MISMATCH, 'Found ' + str(count) \
+                + ' traces with different x-axis points. They are ignored.', count = count))
+
+    # The traces on x-axis points grid. Groups with other points are interpolated onto it, each as one 2D
+    # array, with NaN outside their own range; their traces become DerivedTrace of them.
+    def resampled(self, grid, resampler = None):
+        resampler = resampler or defaultResampler
+        result = TraceSet(self.names, [grid] * len(self), self.ys, self.derived)
+        result.issues = list(self.issues)
+        for x1, indices in self.groups():
+            if not numpy.array_equal(x1, grid):
+                y = resampler.resample(x1, grid, self.stack(indices))
+                for i, y1 in zip(indices, y):
+                    result.ys[i] = y1
+                    result.derived[i] = DerivedTrace('resample', [self.source(i)], [self.names[i]], (x1, grid))
+        return result
+
+    # Indices of traces with the same x-axis points as x0.
+    def matching(self, x0):
+        for x1, indices in self.groups():
+            if numpy.array_equal(x0, x1):
+                return indices
+        return []
+
+# Trace arithmetic. Each operation takes a TraceSet and returns a new one, leaving the input as is.
+# Operations run once per group of traces sharing an x-axis, on the whole group as a 2D array.
+# Each result records how it was made from its input traces (see DerivedTrace).
+
+# Mean and sample standard deviation of all traces sharing the x-axis of the first one.
+# Returns an empty TraceSet if fewer than two traces can be combined.
+def meanStdDev(traces):
+    result = TraceSet()
+    if len(traces) > 1:
+        x0 = traces.xs[0]
+        indices = traces.matching(x0)
+        result.addMismatch(len(traces) - len(indices))
+        if len(indices) > 1:
+            y = traces.stack(indices)
+            parents = [traces.source(i) for i in indices]
+            names = [traces.names[i] for i in indices]
+            for op, suffix, y1 in (('mean', ' (Mean)', numpy.mean(y, axis = 0)), \
+                    ('std', ' (StdDev.)', numpy.std(y, axis = 0, ddof = 1))):
+                result.append(traces.names[0] + suffix, x0, y1, DerivedTrace(op, parents, names, cache = y1))
+    return result
+
+# Subtracts from each trace its own value at the x-axis point nearest to xRef.
+def subtractValueAt(traces, xRef):
+    result = TraceSet()
+    for x1, indices in traces.groups():
+        y = traces.stack(indices)
+        k = numpy.absolute(numpy.asarray(x1) - xRef).argmin()
+        y = y - y[:, k : k + 1]
+        result.extend([traces.names[i] + ' (-Ref)' for i in indices], x1, y, \
+            traces.derive(indices, 'subtractAt', y, (k, x1[k])))
+    return result
+
+# Subtracts trace (x0, y0) from each trace with the same x-axis points; others are skipped.
+# name0 and source0 (see TraceSet.source) describe the subtracted trace in the lineage of the results.
+def subtractTrace(traces, x0, y0, name0 = 'Ref', source0 = None):
+    result = TraceSet()
+    indices = traces.matching(x0)
+    if indices:
+        y0 = numpy.asarray(y0, dtype = numpy.float64)
+        y = traces.stack(indices) - y0
+        result.extend([traces.names[i] + ' (Diff)' for i in indices], x0, y, \
+            [DerivedTrace('subtract', [traces.source(i), y0 if source0 is None else source0], \
+                [traces.names[i], name0], cache = y1) for i, y1 in zip(indices, y)])
+    result.addMismatch(len(traces) - len(indices))
+    return result
+
+def addNumber(traces, number):
+    suffix = ' (' + ('+' if number > 0 else '-') + str(abs(number)) + ')'
+    result = TraceSet()
+    for x1, indices in traces.groups():
+        y = traces.stack(indices) + number
+        result.extend([traces.names[i] + suffix for i in indices], x1, y, traces.derive(indices, 'add', y, number))
+    return result
+
+def multiplyBy(traces, number):
+    suffix = ' (x' + str(number) + ')'
+    result = TraceSet()
+    for x1, indices in traces.groups():
+        y = traces.stack(indices) * number
+        result.extend([traces.names[i] + suffix for i in indices], x1, y, \
+            traces.derive(indices, 'multiply', y, number))
+    return result
+
+# Bins of an axis for DataFileObject.rebin(). Returns (sorted axis, order of its points in the axis,
+# or None if already ascending, index of the first point of each bin in the sorted axis).
+#   spacing: 'count' for nBins bins of equal numbers of points, 'log' for nBins bins equally spaced on a
+#     log scale between the first positive point and the last, leaving out empty ones; points that
+#     aren't positive, e.g. before mixing, are kept as they are.
+def binStarts(axis, nBins, spacing = 'count'):
+    order = None
+    if numpy.any(axis[1:] < axis[:-1]):
+        order = numpy.argsort(axis, kind = 'stable')
+        axis = axis[order]
+    n = len(axis)
+    if nBins >= n:
+        return axis, order, numpy.arange(n)
+    if spacing == 'count':
+        return axis, order, numpy.unique(numpy.arange(nBins) * n // nBins)
+    elif spacing == 'log':
+        first = numpy.searchsorted(axis, 0, 'right')
+        if n - first < 2 or not axis[-1] > axis[first]:
+            return axis, order, numpy.arange(n)
+        edges = numpy.geomspace(axis[first], axis[-1], nBins + 1)[1 : -1]
+        return axis, order, numpy.unique(numpy.concatenate((numpy.arange(first + 1), \
+            numpy.searchsorted(axis, edges))))
+    raise ValueError('Unknown bin spacing: ' + str(spacing))
+
+# Means and sample standard deviations (0 for single points) of matrix z over bins of rows and columns,
+# given by the index of the first row and column of each. Sums over all bins are taken at once by
+# reduceat, a chunk of whole row bins at a time, so that memory-mapped z is read once in pieces.
+def binMeans(z, rowStarts, columnStarts):
+    nRows, nColumns = z.shape
+    rowStarts = numpy.asarray(rowStarts, dtype = numpy.intp)
+    columnStarts = numpy.asarray(columnStarts, dtype = numpy.intp)
+    rowCounts = numpy.diff(numpy.append(rowStarts, nRows))
+    columnCounts = numpy.diff(numpy.append(columnStarts, nColumns))
+    means = numpy.empty((len(rowStarts), len(columnStarts)))
+    stdDevs = numpy.empty_like(means)
+    chunkRows = max(exportChunkValues // max(nColumns, 1), 1)
+    k0 = 0
+    while k0 < len(rowStarts):
+        k1 = max(numpy.searchsorted(rowStarts, rowStarts[k0] + chunkRows), k0 + 1)
+        i0, i1 = rowStarts[k0], rowStarts[k1] if k1 < len(rowStarts) else nRows
+        block = numpy.asarray(z[i0 : i1], dtype = numpy.float64)
+        starts = rowStarts[k0 : k1] - i0
+        counts = numpy.outer(rowCounts[k0 : k1], columnCounts)
+        mean = numpy.add.reduceat(numpy.add.reduceat(block, starts, axis = 0), columnStarts, axis = 1) / counts
+        # Deviations from the mean of each bin, rather than sums of squares, which lose digits.
+        block = block - numpy.repeat(numpy.repeat(mean, rowCounts[k0 : k1], axis = 0), columnCounts, axis = 1)
+        squares = numpy.add.reduceat(numpy.add.reduceat(block * block, starts, axis = 0), columnStarts, axis = 1)
+        means[k0 : k1] = mean
+        stdDevs[k0 : k1] = numpy.sqrt(squares / numpy.maximum(counts - 1, 1))
+        k0 = k1
+    return means, stdDevs
+
+# Matrices with at least this many elements are decomposed by randomized SVD when few components are needed.
+randomizedSvdSize = 1000000
+
+# Singular value decomposition of a matrix whose rows are traces, keeping at least rank components.
+# Returns (U, s, Vt) like numpy.linalg.svd(full_matrices = False), possibly with fewer components.
+# Economy SVD computes all min(shape) components; for large matrices and a small rank, randomized
+# SVD (Halko, Martinsson and Tropp, 2011) with power iterations finds the leading ones much faster.
+# A memory-mapped matrix, e.g. an out-of-core block, is only read a chunk of rows at a time by randomized
+# SVD, so it is never held in memory as a whole; economy SVD of one needs it all in memory.
+def truncatedSvd(matrix, rank, oversampling = 10, powerIterations = 4):
+    if not isinstance(matrix, numpy.memmap):
+        matrix = numpy.asarray(matrix, dtype = numpy.float64)
+    m, n = matrix.shape
+    if matrix.size < randomizedSvdSize or 4 * (rank + oversampling) > min(m, n):
+        return numpy.linalg.svd(numpy.asarray(matrix, dtype = numpy.float64), full_matrices = False)
+    chunkRows = max(exportChunkValues // n, 1) if isinstance(matrix, numpy.memmap) else m
+    # matrix.dot(X) and matrix.T.dot(Q), over chunks of rows.
+    def times(X):
+        return numpy.concatenate([numpy.asarray(matrix[i : i + chunkRows], dtype = numpy.float64).dot(X) \
+            for i in range(0, m, chunkRows)])
+    def transposeTimes(Q):
+        return sum(numpy.asarray(matrix[i : i + chunkRows], dtype = numpy.float64).T.dot(Q[i : i + chunkRows]) \
+            for i in range(0, m, chunkRows))
+    # Fixed seed, so that the same selection always gives the same components.
+    random1 = numpy.random.RandomState(0)
+    Q = numpy.linalg.qr(times(random1.standard_normal((n, rank + oversampling))))[0]
+    for k in range(powerIterations):
+        Q = numpy.linalg.qr(transposeTimes(Q))[0]
+        Q = numpy.linalg.qr(times(Q))[0]
+    U, s, Vt = numpy.linalg.svd(transposeTimes(Q).T, full_matrices = False)
+    return Q.dot(U[:, :rank]), s[:rank], Vt[:rank]
+
+# First rank components of an SVD (U, s, Vt) from truncatedSvd.
+# Returns (singular values, left vectors as rows, right vectors as rows); the vectors are
+# scaled by their singular values if scaled is True.
+def svdSlice(factors, rank, scaled = False):
+    U, s, Vt = factors
+    rowYData = U[:, 0:rank].transpose()
+    columnYData = Vt[0:rank, :]
+    if scaled:
+        rowYData = s[0:rank, numpy.newaxis] * rowYData
+        columnYData = s[0:rank, numpy.newaxis] * columnYData
+    return s, rowYData, columnYData
+
+# First rank singular vectors of a matrix whose rows are traces, as svdSlice().
+def svdComponents(matrix, rank, scaled = False):
+    return svdSlice(truncatedSvd(matrix, rank), rank, scaled)
+
+# Result of globalExpFit():
+#   rates: fitted rate constants, ascending; rateErrors: their standard errors.
+#   amplitudes: traces x components; column k is the decay-associated spectrum of rates[k], and the
+#     last column the offset if fitted with one.
+#   fits, residuals: traces x time points.
+#   rms: root mean square residual; iterations: Levenberg-Marquardt steps taken.
+class GlobalFit(object):
+    def __init__(self, rates, rateErrors, amplitudes, fits, residuals, iterations):
+        super().__init__()
+        self.rates = rates
+        self.rateErrors = rateErrors
+        self.amplitudes = amplitudes
+        self.fits = fits
+        self.residuals = residuals
+        self.rms = float(numpy.sqrt(numpy.mean(residuals ** 2))) if residuals.size else 0.0
+        self.iterations = iterations
+
+# Exponential decays exp(-rate * t) as rows, plus a row of ones for an offset.
+def expBasis(t, rates, offset = True):
+    basis = numpy.exp(-numpy.clip(numpy.outer(rates, t), -700, 700))
+    return numpy.vstack((basis, numpy.ones((1, len(t))))) if offset else basis
+
+# Global fit of traces ys (traces x time points) sharing the time axis t to
+#   y_i(t) = sum_k A_ik exp(-rates_k t) + A_i0 (if offset),
+# with rate constants shared by all traces. By variable projection, the amplitudes A are solved for
+# all traces at once by linear least squares for each trial of rates, so Levenberg-Marquardt only
+# searches the nExp log-rates. rates are initial guesses, spread over the time range if None.
+# With svdRank > 0, the first svdRank SVD components of ys are fitted instead of every trace, which
+# gives the same rates for data of that rank at a fraction of the cost.
+# Time points where any trace is not finite are left out of the fit.
+# Returns (GlobalFit, None), or (None, Issue) if the data can't be fitted.
+def globalExpFit(t, ys, nExp, rates = None, offset = True, svdRank = 0, maxIterations = 200, tolerance = 1e-10):
+    t = numpy.asarray(t, dtype = numpy.float64)
+    ys = numpy.atleast_2d(numpy.asarray(ys, dtype = numpy.float64))
+    valid = numpy.isfinite(t) & numpy.all(numpy.isfinite(ys), axis = 0)
+    nParameters = nExp + (1 if offset else 0)
+    if nExp < 1 or numpy.count_nonzero(valid) <= nParameters or ys.shape[1] != len(t):
+        return None, Issue(FIT_FAILED, 'Too few valid time points for ' + str(nExp) + ' exponentials.')
+    tFit = t[valid]
+    data = ys[:, valid]
+    if rates is None:
+        positive = numpy.absolute(tFit[tFit != 0])
+        if not len(positive):
+            return None, Issue(FIT_FAILED, 'All valid time points are 0; rate constants can\'t be guessed.')
+        rates = numpy.geomspace(3 / positive.max(), 1 / (3 * positive.min()), nExp) if nExp > 1 \
+            else numpy.array([1 / numpy.sqrt(positive.max() * positive.min())])
+    theta = numpy.log(numpy.asarray(rates, dtype = numpy.float64))
+    try:
+        if 0 < svdRank < min(data.shape):
+            U, s, Vt = truncatedSvd(data, svdRank)
+            data = s[:svdRank, numpy.newaxis] * Vt[:svdRank]
+        # Residual matrix of the best amplitudes for log-rates theta.
+        def residual(theta):
+            basis = expBasis(tFit, numpy.exp(theta), offset)
+            amplitudes = numpy.linalg.lstsq(basis.T, data.T, rcond = None)[0]
+            return data - amplitudes.T.dot(basis)
+        # Forward-difference Jacobian of residuals r at theta, one residual matrix per log-rate.
+        def jacobian(theta, r):
+            return [(residual(theta + step * numpy.eye(nExp)[k]) - r) / step for k in range(nExp)]
+        r = residual(theta)
+        cost = numpy.sum(r ** 2)
+        damping = 1e-3
+        step = 1e-6
+        # maxIterations below 1 evaluates the initial rates only.
+        iterations = 0
+        for iterations in range(1, maxIterations + 1):
+            # Reduced to J^T J and J^T r right away.
+            columns = jacobian(theta, r)
+            JtJ = numpy.array([[numpy.sum(a * b) for b in columns] for a in columns])
+            Jtr = numpy.array([numpy.sum(a * r) for a in columns])
+            improved = False
+            while damping < 1e12:
+                delta = numpy.linalg.solve(JtJ + damping * numpy.diag(numpy.diag(JtJ) + 1e-12), -Jtr)
+                r1 = residual(theta + delta)
+                cost1 = numpy.sum(r1 ** 2)
+                if cost1 < cost:
+                    improved = cost - cost1 > tolerance * cost and numpy.max(numpy.absolute(delta)) > 1e-9
+                    theta, r, cost = theta + delta, r1, cost1
+                    damping = max(damping / 3, 1e-12)
+                    break
+                damping *= 4
+            if not improved:
+                break
+        order = numpy.argsort(theta)
+        theta = theta[order]
+        rates = numpy.exp(theta)
+        basis = expBasis(tFit, rates, offset)
+        amplitudes = numpy.linalg.lstsq(basis.T, ys[:, valid].T, rcond = None)[0].T
+        # Standard errors from the curvature of the cost, for log-rates, then rates. The noise
+        # variance comes from the residuals of all traces, also when SVD components were fitted.
+        # The Jacobian is taken again at the final rates, as the last one was before the last step.
+        columns = jacobian(theta, residual(theta))
+        JtJ = numpy.array([[numpy.sum(a * b) for b in columns] for a in columns])
+        variance = numpy.sum((ys[:, valid] - amplitudes.dot(basis)) ** 2) \
+            / max(ys[:, valid].size - nExp - amplitudes.size, 1)
+        rateErrors = rates * numpy.sqrt(numpy.absolute(numpy.diag(numpy.linalg.pinv(JtJ))) * variance)
+    except (ValueError, numpy.linalg.LinAlgError) as error:
+        return None, Issue(FIT_FAILED, str(error))
+    fits = amplitudes.dot(expBasis(t, rates, offset))
+    return GlobalFit(rates, rateErrors, amplitudes, fits, ys - fits, iterations), None
+
+# Indices of the points of an axis nearest to each of values, and their distances, by one binary search
+# of all values. The axis is given sorted, as sortedAxis = axis[order], e.g. with order = argsort(axis).
+def nearestPoints(sortedAxis, order, values):
+    values = numpy.asarray(values, dtype = numpy.float64)
+    right = numpy.clip(numpy.searchsorted(sortedAxis, values), 0, len(sortedAxis) - 1)
+    left = numpy.maximum(right - 1, 0)
+    nearest = numpy.where(numpy.absolute(sortedAxis[left] - values) \
+        <= numpy.absolute(sortedAxis[right] - values), left, right)
+    return order[nearest], numpy.absolute(sortedAxis[nearest] - values)
+
+# Converts x-axis data to floats. Returns (array, None), or (None, Issue) if it holds text.
+def numericAxis(dataX):
+    try:
+        return numpy.array(dataX, dtype = numpy.float64), None
+    except (ValueError, TypeError):
+        return None, Issue(NON_NUMERIC_X, 'Texts instead of numbers found in x-axis data.')
+
+# Indices of the points worth drawing of a trace with ascending x, at a resolution of nBins equal bins
+# between x = lo and x = hi: the lowest and highest point of each bin, which draws like the full trace
+# when a bin is one pixel wide. The nearest point outside each end is kept, so lines reach the edges.
+# Points with non-finite x, e.g. non-positive x already put on a log scale, are left out.
+# y may also be 2D, one trace per row sharing x; then a list of index arrays, one per trace, is returned.
+def minMaxIndices(x, y, lo, hi, nBins):
+    x = numpy.asarray(x, dtype = numpy.float64)
+    y = numpy.asarray(y)
+    ys = y.reshape(-1, y.shape[-1])
+    valid = numpy.flatnonzero(numpy.isfinite(x))
+    i0 = max(numpy.searchsorted(x[valid], lo, 'left') - 1, 0)
+    i1 = min(numpy.searchsorted(x[valid], hi, 'right') + 1, len(valid))
+    inView = valid[i0 : i1]
+    if len(inView) <= 2 * nBins or not hi > lo:
+        return inView if y.ndim == 1 else [inView] * len(ys)
+    bins = numpy.clip(((x[inView] - lo) * (nBins / (hi - lo))).astype(numpy.intp), 0, nBins - 1)
+    # x is ascending, so each bin is one run of points; finds the first lowest and highest point of each
+    # bin of all traces at once. Bins without a finite y find no point, marked by index len(inView).
+    ys = ys[:, inView]
+    starts = numpy.flatnonzero(numpy.concatenate(([True], bins[1:] != bins[:-1])))
+    counts = numpy.diff(numpy.append(starts, len(bins)))
+    positions = numpy.arange(len(inView))
+    keep = [numpy.broadcast_to([0, len(inView) - 1], (len(ys), 2))]
+    for reduce1 in (numpy.fmin, numpy.fmax):
+        extremes = ys == numpy.repeat(reduce1.reduceat(ys, starts, axis = 1), counts, axis = 1)
+        keep.append(numpy.minimum.reduceat(numpy.where(extremes, positions, len(inView)), starts, axis = 1))
+    # Sorted indices of each trace, without duplicates and the no-point marker.
+    keep = numpy.sort(numpy.concatenate(keep, axis = 1), axis = 1)
+    unique = (keep < len(inView)) & numpy.concatenate((numpy.ones((len(ys), 1), dtype = bool), \
+        keep[:, 1:] != keep[:, :-1]), axis = 1)
+    indices = numpy.split(inView[keep[unique]], numpy.cumsum(unique.sum(axis = 1))[:-1])
+    return indices[0] if y.ndim == 1 else indices
+
+# Bounds of a trace for auto-ranging: [xMin, xMax, xMinPositive, yMin, yMax, yMinPositive], over finite
+# values only. The smallest positive values are for log axes. NaN where there is no such value.
+# y may also be 2D, one trace per row sharing x; then one row of bounds per trace is returned.
+def traceBounds(x, y):
+    y = numpy.asarray(y, dtype = numpy.float64)
+    bounds = numpy.full(y.shape[:-1] + (6,), numpy.nan)
+    for k, a in enumerate((numpy.asarray(x, dtype = numpy.float64), y)):
+        if a.shape[-1] == 0:
+            continue
+        # fmin and fmax skip NaN, so non-finite values are replaced by NaN.
+        a = numpy.where(numpy.isfinite(a), a, numpy.nan)
+        bounds[..., 3 * k] = numpy.fmin.reduce(a, axis = -1)
+        bounds[..., 3 * k + 1] = numpy.fmax.reduce(a, axis = -1)
+        bounds[..., 3 * k + 2] = numpy.fmin.reduce(numpy.where(a > 0, a, numpy.nan), axis = -1)
+    return bounds
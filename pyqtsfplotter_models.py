@@ -1,113 +1,36 @@
 #!/usr/bin/python3
 # Models and object definitions for MVC-style programming.
-# Still needs QtGui because of popup messages for warnings and errors in data.
+# Thin Qt adapters over the data objects of pyqtsfplotter_core.
+# Still needs QtWidgets because of popup messages for warnings about plotted data.
 
 import copy
+import os
 from os import path
 
 from PyQt5 import QtCore, QtGui, QtWidgets
 import numpy
-from matplotlib import cm as mpl_cm
-from matplotlib import colors as mpl_colors
-       
-class DataFileObject(object):    
-    def __init__(self, fileName):
-        super().__init__()
-        self.fName = fileName
-        self.z, self.w, self.t = self.importRawFile(fileName)
-        self.__model = None
-        
-    def importRawFile(self, fileName):
-        extension = path.splitext(fileName)[1]
-        z = []
-        t = []
-        w = []
-        flag_wt = False        
-        with open(fileName, mode='r') as f1: 
-            validFile = True
-            # Searches for and reads header line.
-            if extension == '.csv':
-                while True: # two possible formats in input file
-                    line1 = f1.readline()
-                    if 'Time,Wavelength' in line1:
-                        line1 = f1.readline()
-                        try:
-                            w = [float(x) for x in line1.split(sep=',')[1:-1]]
-                        except ValueError:
-                            validFile = False
-                        break
-                    if 'Wavelength,Time' in line1:
-                        line1 = f1.readline()
-                        try:
-                            t = [float(x) for x in line1.split(sep=',')[1:-1]]
-                        except ValueError: 
-                            validFile = False
-                        flag_wt = True
-                        break
-                    if not line1: # error: detects end of file prematurely
-                        break
-            elif extension == '.txt':
-                line1 = f1.readline()
-                line1Items = line1.split()
-                if line1Items[0] == 'Time' and len(line1Items) > 1:
-                    w = line1Items[1:]
-            # Reads the rest of the data, if any.        
-            if w:
-                sepString = ',' if extension == '.csv' else None
-                while True:
-                    line1 = f1.readline()
-                    if line1.strip():
-                        try:
-                            line1_Numbers = [float(x) for x in line1.split(sep=sepString)]
-                        except ValueError: 
-                            validFile = False
-                        if len(line1_Numbers) == 1 + len(w):
-                            t.append(line1_Numbers[0])
-                            z.append(line1_Numbers[1:])
-                        else:
-                            break
-                    else:
-                        break
-            elif t:
-                while True:
-                    line1 = f1.readline()
-                    if line1.strip():
-                        try:
-                            line1_Numbers = [float(x) for x in line1.split(sep=',')] 
-                        except ValueError: 
-                            validFile = False
-                        if len(line1_Numbers) == 1 + len(t):
-                            w.append(line1_Numbers[0])
-                            z.append(line1_Numbers[1:])
-                        else:
-                            break
-                    else:
-                        break
-            f1.close()
-            print(fileName, ': ', sum(len(x) for x in z), '=', len(w), '*', len(t))
-            if not (len(w) > 0 and len(t) > 0 and validFile):
-                QtWidgets.QMessageBox.question(None, 'Invalid Raw Data File', \
-                    'File ' + fileName + ' contains no valid data. Skipped.', \
-                    QtWidgets.QMessageBox.Ok)
-        return (z if flag_wt else list(map(list, zip(*z)))), w, t  
-     
-    # Lazy evaluation and caching for models.
-    def genModel(self, whatType):
-        if self.__model == None:
-            self.__model = DataInSingleFileListModel(self, whatType)
-        else:
-            self.__model.setType(whatType)
-        return self.__model
-        
-    def isValid(self):
-        return (True if (self.z and self.w and self.t) else False)
 
+import pyqtsfplotter_core
+from pyqtsfplotter_core import DataFileObject
+
+# Matplotlib modules, imported by the first PlotListModel rather than at startup.
+mpl_cm = None
+mpl_colors = None
+mpl_lines = None
+       
+# List of the time traces (whatType True) or spectra (False) of the current block of a DataFileObject.
 class DataInSingleFileListModel(QtCore.QAbstractListModel):
     def __init__(self, dataFileObject, whatType):
         super().__init__()
-        self.__z = copy.copy(dataFileObject.z)
-        self.__w = copy.copy(dataFileObject.w)
-        self.__t = copy.copy(dataFileObject.t)
+        # Shares the read-only z array with dataFileObject. Axes are copied, as they are editable here.
+        self.__z = dataFileObject.z
+        self.__w = dataFileObject.w.copy()
+        self.__t = dataFileObject.t.copy()
+        # Read-only views handed out as x-axis data; they follow edits to the axes.
+        self.__wView = self.__w.view()
+        self.__wView.flags.writeable = False
+        self.__tView = self.__t.view()
+        self.__tView.flags.writeable = False
         # Boolean, True if timetraces, False if spectra
         self.__whatType = whatType
         
@@ -119,6 +42,15 @@ class DataInSingleFileListModel(QtCore.QAbstractListModel):
         
     def getType(self):
         return self.__whatType
+    
+    # Wavelengths (time traces) or timepoints (spectra) of the rows, with any edits, read-only.
+    def axis(self):
+        return self.__wView if self.__whatType else self.__tView
+    
+    # Shows another matrix of the same shape, e.g. after the file was denoised. Keeps axis edits.
+    def setZ(self, z):
+        self.__z = z
+        self.dataChanged.emit(self.index(0, 0), self.index(self.rowCount() - 1, 0))
         
     def rowCount(self, parent = QtCore.QModelIndex()):
         return len(self.__w) if self.__whatType else len(self.__t)
@@ -138,15 +70,15 @@ class DataInSingleFileListModel(QtCore.QAbstractListModel):
                 # Edits everything in text areas, not spinboxes.
                 return str(self.__w[row]) if self.__whatType else str(self.__t[row])
             elif role == QtCore.Qt.UserRole:
-                # Returns a ([x0, x1, ..., xn], [y0, y1, ..., yn]) tuple.
-                return (self.__t, self.__z[row]) if self.__whatType \
-                    else (self.__w, [self.__z[j][row] for j in range(len(self.__z))])
+                # Returns a (x, y) tuple of read-only views, without copying data.
+                return (self.__tView, self.__z[row]) if self.__whatType \
+                    else (self.__wView, self.__z[:, row])
             elif role == QtCore.Qt.ToolTipRole:
                 if self.__whatType:
-                    return 'Min: ' + str(min(self.__z[row])) + ' Max: ' + str(max(self.__z[row]))
+                    return 'Min: ' + str(self.__z[row].min()) + ' Max: ' + str(self.__z[row].max())
                 else:
-                    lowest = min([self.__z[j][row] for j in range(len(self.__z))])
-                    highest = max([self.__z[j][row] for j in range(len(self.__z))])
+                    lowest = self.__z[:, row].min()
+                    highest = self.__z[:, row].max()
                     return 'Lowest: ' + str(lowest) + " Highest: " + str(highest)
         return None
     
@@ -192,6 +124,8 @@ class DataFilesListModel(QtCore.QAbstractListModel):
     def __init__(self):
         super().__init__()
         self.__files = []    
+        # One dict per file of DataInSingleFileListModel by block, made on first use.
+        self.__models = []
         
     def rowCount(self, parent = QtCore.QModelIndex()):
         return len(self.__files)
@@ -208,13 +142,22 @@ class DataFilesListModel(QtCore.QAbstractListModel):
             shortName = path.basename(self.__files[row].fName)
             if role == QtCore.Qt.DisplayRole:
                 return str(row)+ ': ' + (shortName if (len(shortName) < 34) else (shortName[0:15] + '...' + shortName[-15:])) \
-                    + ': ' + str(len(self.__files[row].w)) + ' x ' + str(len(self.__files[row].t))
+                    + ('' if self.__files[row].currentBlock() == 0 else ' (' + self.__files[row].blockName() + ')') \
+                    + ': ' + str(len(self.__files[row].w)) + ' x ' + str(len(self.__files[row].t)) \
+                    + (', rank ' + str(self.__files[row].denoisedRank()) if self.__files[row].denoisedRank() else '') \
+                    + (', binned' if self.__files[row].zStdDev() is not None else '')
             elif role == QtCore.Qt.ToolTipRole:
+                if not self.__files[row].isValid():
+                    return 'File: ' + self.__files[row].fName + '\n' \
+                        + 'Block ' + self.__files[row].blockName() + ' contains no valid data.'
                 return 'File: ' + self.__files[row].fName + '\n' \
+                    + ('Blocks: ' + ', '.join(b[0] for b in self.__files[row].blocks) + '\n' \
+                        if len(self.__files[row].blocks) > 1 else '') \
                     + str(len(self.__files[row].w)) + ' Wavelengths: ' \
                     + str(self.__files[row].w[0]) + ' ... ' +str(self.__files[row].w[-1]) + '\n' \
                     + str(len(self.__files[row].t)) + ' Timepoints: ' \
-                    + str(self.__files[row].t[0]) + ' ... ' +str(self.__files[row].t[-1])            
+                    + str(self.__files[row].t[0]) + ' ... ' +str(self.__files[row].t[-1]) \
+                    + ('\nAveraged over bins of the file.' if self.__files[row].zStdDev() is not None else '')
             elif role == QtCore.Qt.UserRole:
                 return self.__files[row]
         return None                
@@ -222,18 +165,280 @@ class DataFilesListModel(QtCore.QAbstractListModel):
     def removeRows(self, row, count, parent = QtCore.QModelIndex()):
         self.beginRemoveRows(parent, row, row + count - 1)
         del self.__files[row : row + count]
+        del self.__models[row : row + count]
         self.endRemoveRows()
         return True
     
+    # Switches the data block shown for a file. Blocks are parsed on first selection.
+    def setCurrentBlock(self, row, block):
+        if row >= 0 and row < self.rowCount():
+            self.__files[row].setCurrentBlock(block)
+            self.dataChanged.emit(self.index(row, 0), self.index(row, 0))
+            return self.__files[row].isValid()
+        return False
+    
+    # Denoises the current block of a file (see DataFileObject.denoise), or restores it if rank is 0.
+    def setDenoised(self, row, rank, factors = None):
+        if row >= 0 and row < self.rowCount():
+            file1 = self.__files[row]
+            file1.denoise(rank, factors)
+            model1 = self.__models[row].get(file1.currentBlock())
+            if model1 != None:
+                model1.setZ(file1.z)
+            self.dataChanged.emit(self.index(row, 0), self.index(row, 0))
+    
+    # Lazy evaluation and caching for models of a file, one per block.
+    def genModel(self, row, whatType):
+        file1 = self.__files[row]
+        model1 = self.__models[row].get(file1.currentBlock())
+        if model1 == None:
+            model1 = DataInSingleFileListModel(file1, whatType)
+            self.__models[row][file1.currentBlock()] = model1
+        else:
+            model1.setType(whatType)
+        return model1
+    
     def appendRow(self, fileName, parent = QtCore.QModelIndex()):        
-        file1 = DataFileObject(fileName)
+        return self.appendFileObject(DataFileObject(fileName), parent)
+    
+    # Adds an already opened file, e.g. from DataFilesImporter.
+    def appendFileObject(self, file1, parent = QtCore.QModelIndex()):
         if file1.isValid():
             self.beginInsertRows(parent, self.rowCount(), self.rowCount())
             self.__files.append(file1)
+            self.__models.append({})
             self.endInsertRows()
             return True
         return False
 
+# Opens one raw data file in a worker thread of DataFilesImporter.
+class DataFileImportTask(QtCore.QRunnable):
+    def __init__(self, fileName, importer):
+        super().__init__()
+        self.fileName = fileName
+        self.importer = importer
+        
+    def run(self):
+        if self.importer.isCancelled():
+            self.importer.reportTask(self.fileName, None, 'Import cancelled.')
+            return
+        # Parses the first block here, rather than in the GUI thread.
+        file1, issue = pyqtsfplotter_core.openDataFile(self.fileName)
+        self.importer.reportTask(self.fileName, file1, str(issue) if issue else '')
+
+# Imports raw data files on a thread pool, so that the window stays responsive.
+# Signals are delivered in the GUI thread:
+#   fileImported(DataFileObject) as soon as each valid file is parsed,
+#   progressChanged(done, total) after each file,
+#   finished(number imported, [(fileName, error), ...]) when all queued files are done.
+class DataFilesImporter(QtCore.QObject):
+    supportedExtensions = pyqtsfplotter_core.supportedExtensions
+    fileImported = QtCore.pyqtSignal(object)
+    progressChanged = QtCore.pyqtSignal(int, int)
+    finished = QtCore.pyqtSignal(int, list)
+    __taskDone = QtCore.pyqtSignal(str, object, str)
+    
+    def __init__(self, parent = None):
+        super().__init__(parent)
+        self.__pool = QtCore.QThreadPool(self)
+        self.__pool.setMaxThreadCount(max(QtCore.QThread.idealThreadCount(), 1))
+        self.__taskDone.connect(self.__collectTask)
+        self.__total = 0
+        self.__done = 0
+        self.__imported = 0
+        self.__skipped = []
+        self.__cancelled = False
+        
+    # Expands directories recursively into the supported files they contain.
+    @staticmethod
+    def expandPaths(paths):
+        fileNames = []
+        for path1 in paths:
+            if path.isdir(path1):
+                for root, dirs, files in os.walk(path1):
+                    dirs.sort()
+                    fileNames.extend(path.join(root, f) for f in sorted(files) \
+                        if path.splitext(f)[1] in DataFilesImporter.supportedExtensions)
+            else:
+                fileNames.append(path1)
+        return fileNames
+    
+    def isRunning(self):
+        return self.__done < self.__total
+    
+    def isCancelled(self):
+        return self.__cancelled
+    
+    # Queues more files; can be called while an import is running.
+    def start(self, fileNames):
+        if not self.isRunning():
+            self.__total = 0
+            self.__done = 0
+            self.__imported = 0
+            self.__skipped = []
+            self.__cancelled = False
+        self.__total += len(fileNames)
+        self.progressChanged.emit(self.__done, self.__total)
+        for fileName in fileNames:
+            self.__pool.start(DataFileImportTask(fileName, self))
+    
+    # Files not yet started are skipped; files being parsed are discarded when done.
+    def cancel(self):
+        if self.isRunning():
+            self.__cancelled = True
+    
+    # Called from worker threads.
+    def reportTask(self, fileName, file1, error):
+        self.__taskDone.emit(fileName, file1, error)
+        
+    def __collectTask(self, fileName, file1, error):
+        self.__done += 1
+        if file1 is not None and not self.__cancelled:
+            self.__imported += 1
+            self.fileImported.emit(file1)
+        else:
+            self.__skipped.append((fileName, error or 'Import cancelled.'))
+        self.progressChanged.emit(self.__done, self.__total)
+        if self.__done == self.__total:
+            self.finished.emit(self.__imported, self.__skipped)
+
+class SvdTask(QtCore.QRunnable):
+    def __init__(self, key, matrix, rank, service):
+        super().__init__()
+        self.key = key
+        self.matrix = matrix
+        self.rank = rank
+        self.service = service
+        
+    def run(self):
+        try:
+            factors, error = pyqtsfplotter_core.truncatedSvd(self.matrix, self.rank), ''
+        except (ValueError, numpy.linalg.LinAlgError) as error1:
+            factors, error = None, str(error1)
+        self.service.reportTask(self.key, factors, error)
+
+# SVD of raw trace selections, cached by a key naming file, block and selection, so that asking for
+# another rank or scaling of the same selection only slices the cached factors.
+# Matrices of backgroundSize elements or more are decomposed on a worker thread; signals are
+# delivered in the GUI thread:
+#   finished(key, (U, s, Vt)) when a decomposition started by decompose() is done,
+#   failed(key, error string) if it could not be done, e.g. for data containing NaN.
+class SvdService(QtCore.QObject):
+    backgroundSize = 250000
+    # At least this many components are kept, so that a somewhat higher rank is still a cache hit.
+    minRank = 10
+    cacheSize = 8
+    finished = QtCore.pyqtSignal(object, object)
+    failed = QtCore.pyqtSignal(object, str)
+    __taskDone = QtCore.pyqtSignal(object, object, str)
+    
+    def __init__(self, parent = None):
+        super().__init__(parent)
+        self.__pool = QtCore.QThreadPool(self)
+        self.__pool.setMaxThreadCount(1)
+        self.__taskDone.connect(self.__collectTask)
+        # Most recently used last.
+        self.__cache = []
+        self.__running = set()
+    
+    # Cached (U, s, Vt) of key with at least rank components, or None.
+    def factors(self, key, rank):
+        for k, (key1, factors1) in enumerate(self.__cache):
+            if key1 == key and len(factors1[1]) >= rank:
+                self.__cache.append(self.__cache.pop(k))
+                return factors1
+        return None
+    
+    def isRunning(self, key):
+        return key in self.__running
+    
+    # Returns (U, s, Vt) of a small matrix right away. Large matrices are decomposed on a worker
+    # thread: returns None, and the result comes with finished() or failed().
+    # Raises numpy.linalg.LinAlgError if a small matrix can't be decomposed.
+    def decompose(self, key, matrix, rank):
+        rank = max(rank, SvdService.minRank)
+        if numpy.size(matrix) < SvdService.backgroundSize:
+            factors1 = pyqtsfplotter_core.truncatedSvd(matrix, rank)
+            self.__store(key, factors1)
+            return factors1
+        if key not in self.__running:
+            self.__running.add(key)
+            self.__pool.start(SvdTask(key, matrix, rank, self))
+        return None
+    
+    def clear(self):
+        self.__cache = []
+    
+    # Called from worker threads.
+    def reportTask(self, key, factors1, error):
+        self.__taskDone.emit(key, factors1, error)
+    
+    def __collectTask(self, key, factors1, error):
+        self.__running.discard(key)
+        if factors1 is None:
+            self.failed.emit(key, error)
+        else:
+            self.__store(key, factors1)
+            self.finished.emit(key, factors1)
+    
+    def __store(self, key, factors1):
+        self.__cache = [entry1 for entry1 in self.__cache if entry1[0] != key]
+        self.__cache.append((key, factors1))
+        del self.__cache[: -SvdService.cacheSize]
+
+class GlobalFitTask(QtCore.QRunnable):
+    def __init__(self, key, t, ys, nExp, svdRank, fitter):
+        super().__init__()
+        self.key = key
+        self.t = t
+        self.ys = ys
+        self.nExp = nExp
+        self.svdRank = svdRank
+        self.fitter = fitter
+        
+    def run(self):
+        # Exceptions would end the program on this thread, so they are reported as failures too.
+        try:
+            fit, issue = pyqtsfplotter_core.globalExpFit(self.t, self.ys, self.nExp, svdRank = self.svdRank)
+            error = str(issue) if issue else ''
+        except (ValueError, FloatingPointError, numpy.linalg.LinAlgError) as error1:
+            fit, error = None, str(error1)
+        self.fitter.reportTask(self.key, fit, error)
+
+# Global exponential fits (see pyqtsfplotter_core.globalExpFit) on a worker thread.
+# Signals are delivered in the GUI thread:
+#   finished(key, GlobalFit) when a fit started by start() is done,
+#   failed(key, error string) if the data could not be fitted.
+class GlobalFitter(QtCore.QObject):
+    finished = QtCore.pyqtSignal(object, object)
+    failed = QtCore.pyqtSignal(object, str)
+    __taskDone = QtCore.pyqtSignal(object, object, str)
+    
+    def __init__(self, parent = None):
+        super().__init__(parent)
+        self.__pool = QtCore.QThreadPool(self)
+        self.__pool.setMaxThreadCount(1)
+        self.__taskDone.connect(self.__collectTask)
+        self.__running = 0
+    
+    def isRunning(self):
+        return self.__running > 0
+    
+    def start(self, key, t, ys, nExp, svdRank = 0):
+        self.__running += 1
+        self.__pool.start(GlobalFitTask(key, t, ys, nExp, svdRank, self))
+    
+    # Called from worker threads.
+    def reportTask(self, key, fit, error):
+        self.__taskDone.emit(key, fit, error)
+    
+    def __collectTask(self, key, fit, error):
+        self.__running -= 1
+        if fit is None:
+            self.failed.emit(key, error)
+        else:
+            self.finished.emit(key, fit)
+
 # A table model for a fake list view.
 class PlotListModel(QtCore.QAbstractTableModel):
     # Uses check states: Qt.Unchecked for invisible, PartiallyChecked for scatter, Checked for line plots.
@@ -242,34 +447,97 @@ class PlotListModel(QtCore.QAbstractTableModel):
     lineWidth = 2
     maxMarkers = 100
     markerRatio = 2.5
-    __palette = mpl_cm.get_cmap('Dark2')
+    __palette = None
     __currentColor = -1
     __maxColor = 8
     __xmargin = 0.02
     __ymargin = 0.02    
+    # Long traces are decimated for display: lines hold only the lowest and highest point of each
+    # pixel column of the visible x range (see pyqtsfplotter_core.minMaxIndices), and are decimated
+    # again when x limits change, e.g. by zooming or panning with the toolbar.
+    # Full-resolution data is kept in the model, and is what data() returns for export and arithmetic.
+    decimation = True
+    # With this many rows or more, rows are not drawn as one artist each, but grouped by style
+    # (color, width, line style, marker): each group is one Line2D holding the data of its visible rows,
+    # separated by NaN. Each row keeps its Line2D, outside the axes, for its data and style.
+    groupThreshold = 200
+    # Tooltips of derived rows show at most this many characters of their lineage.
+    maxLineage = 500
 
     def __nextColor(self):
         PlotListModel.__currentColor += 1
         if PlotListModel.__currentColor >= PlotListModel.__maxColor:
             PlotListModel.__currentColor = 0
-        return mpl_colors.to_hex(PlotListModel.__palette( \
-                PlotListModel.__currentColor / PlotListModel.__maxColor), keep_alpha = True)
+        return PlotListModel.__palette[PlotListModel.__currentColor]
     
     # Takes a figure, and uses MPL Line2D to store data.
     def __init__(self, figure):
+        global mpl_cm, mpl_colors, mpl_lines
         super().__init__()
+        if PlotListModel.__palette is None:
+            from matplotlib import cm as mpl_cm
+            from matplotlib import colors as mpl_colors
+            from matplotlib import lines as mpl_lines
+            # Hex colors of the palette, looked up once rather than for each new row.
+            palette1 = mpl_cm.get_cmap('Dark2')
+            PlotListModel.__palette = [mpl_colors.to_hex(palette1(k / PlotListModel.__maxColor), \
+                keep_alpha = True) for k in range(PlotListModel.__maxColor)]
         self.__names = []
         self.__annotations = []
         self.__linestyles = []
         figure.clf()
         # Just uses MPL's Line2D as item model.
         self.__axes = figure.add_subplot(111)
+        self.__lines = []
+        self.__grouped = False
+        # Line2D of each style group, by (color, width, line style, marker, marker size).
+        self.__groups = {}
+        self.__groupsDirty = False
+        # Full-resolution data of each line, and whether its x is ascending, so that it can be decimated.
+        self.__xData = []
+        self.__yData = []
+        self.__ascending = []
+        # x arrays of decimated rows on the x scale, by (id of x, scale): (x, x on the scale, indices of its
+        # finite points). y data is not kept across views.
+        self.__scaledX = {}
+        # DerivedTrace of each line made by trace arithmetic, None for others. Derived lines keep their
+        # y data only while shown: it is dropped when they are hidden, and evaluated again from their
+        # parents when needed, so hidden intermediate results of a chain of operations take no memory.
+        self.__derived = []
+        # Bounds of each line (see pyqtsfplotter_core.traceBounds), and of all visible lines
+        # combined; the latter is None when lines are added, removed, shown or hidden.
+        self.__bounds = []
+        self.__extent = None
+        self.__decimationOn = PlotListModel.decimation
+        # (axes width in pixels, x scale) that lines were last decimated for.
+        self.__decimatedView = None
+        self.__axes.callbacks.connect('xlim_changed', self.__xLimitsChanged)
+        # Transient preview of a raw trace. Not one of the axes' lines, so it is neither a row of
+        # the model nor part of saved figures.
+        self.__preview = mpl_lines.Line2D([], [], lw = PlotListModel.lineWidth, c = '0.45', \
+            linestyle = '--', animated = True, visible = False)
+        self.__preview.set_figure(figure)
+        self.__preview.axes = self.__axes
+        self.__preview.set_transform(self.__axes.transData)
+        self.__preview.set_clip_path(self.__axes.patch)
+        self.__previewData = None
+        # Pixels of the figure after a full draw: without lines and legend, and with them.
+        self.__backgrounds = None
+        self.__drawCanvas = None
+        self.__drawCid = None
+        self.__connectCanvas()
         self.__gridOn = False
         # __legendOn is the user setting for legend.
         # __visibleCount is the internal bookkeeping for visible lines.
         # Legend must remove() before __visibleCount becomes zero, or error.
         self.__legendOn = False
         self.__visibleCount = 0
+        self.__styleDirty = False
+        self.__legendDirty = False
+        self.__layoutDirty = False
+        self.__linesDirty = False
+        self.__previewDirty = False
+        self.__renderPending = False
     
     # Custom functions for connecting model to matplotlib figure.
     # MPL doesn't provide OOP controls for axis grid.
@@ -289,56 +557,319 @@ class PlotListModel(QtCore.QAbstractTableModel):
     def getLegend(self):
         return self.__legendOn
     
+    def setDecimation(self, bool1):
+        self.__decimationOn = bool1
+        self.__decimate()
+    
+    def getDecimation(self):
+        return self.__decimationOn
+    
+    # Shows x, y as a dashed preview line on top of the plotted lines, or hides it if x is None.
+    def setPreview(self, x, y):
+        if x is None:
+            self.__previewData = None
+            self.__preview.set_visible(False)
+        else:
+            self.__previewData = (numpy.asarray(x, dtype = numpy.float64), \
+                numpy.asarray(y, dtype = numpy.float64))
+            self.__preview.set_visible(True)
+            self.__decimatePreview()
+        self.__previewDirty = True
+        self.__scheduleRender()
+    
+    def __markEvery(self, nPoints):
+        return 1 if nPoints < PlotListModel.maxMarkers else int(nPoints / PlotListModel.maxMarkers)
+    
+    def __xLimitsChanged(self, axes):
+        self.__decimate()
+    
+    # Sets the data shown by lines, decimated to about two points per pixel of axes width.
+    def __decimate(self, rows = None):
+        nBins = max(int(self.__axes.bbox.width), 1)
+        scale1 = self.__axes.xaxis.get_transform()
+        self.__decimatedView = (nBins, self.__axes.get_xscale())
+        lo, hi = sorted(scale1.transform(numpy.array(self.__axes.get_xlim())))
+        # Rows often share one x array; those are decimated together, as one 2D array.
+        shared = {}
+        for row in range(self.rowCount()) if rows is None else rows:
+            x = self.__xData[row]
+            line1 = self.__lines[row]
+            if self.__yData[row] is None:
+                continue
+            elif self.__decimationOn and self.__ascending[row] and len(x) > 2 * nBins:
+                shared.setdefault((id(x), len(self.__yData[row])), []).append(row)
+                continue
+            elif len(line1.get_xdata()) != len(x):
+                line1.set_data(x, self.__yData[row])
+            else:
+                continue
+            line1.set_markevery(self.__markEvery(len(line1.get_xdata())))
+            self.__groupsDirty = True
+        scaledX = {}
+        for rows1 in shared.values():
+            x = self.__xData[rows1[0]]
+            key = (id(x), self.__decimatedView[1])
+            cached = self.__scaledX.get(key)
+            if cached is None or cached[0] is not x:
+                xScaled = scale1.transform(x)
+                cached = (x, xScaled, numpy.flatnonzero(numpy.isfinite(xScaled)))
+            scaledX[key] = cached
+            x1, valid = cached[1], cached[2]
+            # Only the points in view, and the nearest one outside each end, are stacked, for this view
+            # only; the stack is dropped right after.
+            i0 = max(numpy.searchsorted(x1[valid], lo, 'left') - 1, 0)
+            i1 = min(numpy.searchsorted(x1[valid], hi, 'right') + 1, len(valid))
+            start, stop = (valid[i0], valid[i1 - 1] + 1) if i1 > i0 else (0, 0)
+            ys = numpy.array([self.__yData[row][start : stop] for row in rows1])
+            for row, indices in zip(rows1, pyqtsfplotter_core.minMaxIndices(x1[start : stop], ys, lo, hi, nBins)):
+                indices = indices + start
+                self.__lines[row].set_data(x[indices], self.__yData[row][indices])
+                self.__lines[row].set_markevery(self.__markEvery(len(indices)))
+            self.__groupsDirty = True
+        # x of rows no longer decimated is dropped once all rows are decimated again.
+        if rows is None:
+            self.__scaledX = scaledX
+            self.__decimatePreview()
+        else:
+            self.__scaledX.update(scaledX)
+    
+    def __decimatePreview(self):
+        if self.__previewData is None:
+            return
+        x, y = self.__previewData
+        nBins = max(int(self.__axes.bbox.width), 1)
+        if self.__decimationOn and len(x) > 2 * nBins and numpy.all(x[1:] >= x[:-1]):
+            scale1 = self.__axes.xaxis.get_transform()
+            lo, hi = sorted(scale1.transform(numpy.array(self.__axes.get_xlim())))
+            indices = pyqtsfplotter_core.minMaxIndices(scale1.transform(x), y, lo, hi, nBins)
+            self.__preview.set_data(x[indices], y[indices])
+        else:
+            self.__preview.set_data(x, y)
+    
+    # Rendering is coalesced: refreshLegend(), refreshStyle() and refreshLayout() only mark what needs
+    # redoing, and one render per event-loop turn does it all and asks the canvas for a single draw_idle().
+    # Figures whose canvas is hidden, e.g. on the other tab, are left dirty until shown and refreshed.
+    # Lines and legend are animated artists, drawn over a cached background of the rest of the axes
+    # after each full draw. So changes to lines alone (visibility, color, names) and the preview line
+    # are blitted, without drawing ticks and labels or laying out the figure again.
     def refreshLegend(self):
+        self.__legendDirty = True
+        self.__scheduleRender()
+    
+    def refreshStyle(self):
+        self.__styleDirty = True
+        self.__legendDirty = True
+        self.__scheduleRender()
+    
+    def refreshLayout(self):
+        self.__layoutDirty = True
+        self.__scheduleRender()
+    
+    def __scheduleRender(self):
+        if not self.__renderPending:
+            self.__renderPending = True
+            QtCore.QTimer.singleShot(0, self.__renderIdle)
+    
+    def refreshLines(self):
+        self.__linesDirty = True
+        self.__scheduleRender()
+    
+    def __renderIdle(self):
+        self.__renderPending = False
+        # Models replaced by resetting their figure may still have a render pending.
+        if self.__axes.get_figure() is None:
+            return
+        canvas1 = self.__axes.get_figure().canvas
+        # Figures not shown in a canvas widget yet are laid out when it is built.
+        if isinstance(canvas1, QtWidgets.QWidget) and canvas1.isVisible():
+            self.render()
+    
+    # Does pending style, legend and layout work now, e.g. before saving the figure.
+    def render(self):
+        figure1 = self.__axes.get_figure()
+        if figure1 is None or self.__axes not in figure1.axes:
+            return
+        if self.__styleDirty:
+            self.__styleDirty = False
+            self.__applyStyle()
+        if self.__legendDirty:
+            self.__legendDirty = False
+            self.__linesDirty = True
+            self.__applyLegend()
+        self.__updateGroups()
+        if not isinstance(figure1.canvas, QtWidgets.QWidget):
+            return
+        self.__connectCanvas()
+        if self.__layoutDirty:
+            self.__layoutDirty = False
+            self.__linesDirty = False
+            self.__previewDirty = False
+            figure1.tight_layout()
+            if self.__decimatedView != (max(int(self.__axes.bbox.width), 1), self.__axes.get_xscale()):
+                self.__decimate()
+            figure1.canvas.draw_idle()
+        elif self.__linesDirty or self.__previewDirty:
+            if not self.__blit(self.__linesDirty):
+                figure1.canvas.draw_idle()
+            self.__linesDirty = False
+            self.__previewDirty = False
+    
+    # Listens to full draws of the figure's current canvas, which changes when the Qt canvas is built.
+    def __connectCanvas(self):
+        canvas1 = self.__axes.get_figure().canvas
+        if canvas1 is not self.__drawCanvas:
+            if self.__drawCanvas is not None:
+                self.__drawCanvas.mpl_disconnect(self.__drawCid)
+            self.__drawCid = canvas1.mpl_connect('draw_event', self.__drawn)
+            self.__drawCanvas = canvas1
+            self.__backgrounds = None
+    
+    # After a full draw on screen, caches the background and draws lines, legend and preview over it.
+    # Saved figures draw animated artists along with the rest, apart from the preview line.
+    def __drawn(self, event):
+        figure1 = self.__axes.get_figure()
+        if figure1 is None or self.__axes not in figure1.axes or event.canvas.is_saving() \
+                or not hasattr(event.canvas, 'copy_from_bbox'):
+            return
+        self.__backgrounds = [event.canvas.copy_from_bbox(figure1.bbox), None]
+        self.__drawLines()
+        self.__axes.draw_artist(self.__preview)
+    
+    def __drawLines(self):
+        if self.__grouped:
+            self.__updateGroups()
+        for line1 in self.__groups.values() if self.__grouped else self.__lines:
+            self.__axes.draw_artist(line1)
+        if self.__axes.get_legend() != None:
+            self.__axes.draw_artist(self.__axes.get_legend())
+        figure1 = self.__axes.get_figure()
+        self.__backgrounds[1] = figure1.canvas.copy_from_bbox(figure1.bbox)
+    
+    # Redraws lines (if withLines) and the preview line over the cached backgrounds.
+    # Returns False if there is nothing cached yet, and a full draw is needed instead.
+    def __blit(self, withLines):
+        figure1 = self.__axes.get_figure()
+        canvas1 = figure1.canvas
+        if self.__backgrounds is None or canvas1 is not self.__drawCanvas:
+            return False
+        if withLines:
+            canvas1.restore_region(self.__backgrounds[0])
+            self.__drawLines()
+        else:
+            canvas1.restore_region(self.__backgrounds[1])
+        self.__axes.draw_artist(self.__preview)
+        canvas1.blit(figure1.bbox)
+        return True
+    
+    # Switches between one artist per row and style groups, as rows are added or removed.
+    def __updateGrouped(self, rowCount = None):
+        grouped = (self.rowCount() if rowCount is None else rowCount) >= PlotListModel.groupThreshold
+        if grouped == self.__grouped:
+            return
+        self.__grouped = grouped
+        if grouped:
+            for line1 in self.__lines:
+                line1.remove()
+            self.__groupsDirty = True
+        else:
+            for group1 in self.__groups.values():
+                group1.remove()
+            self.__groups = {}
+            for line1 in self.__lines:
+                self.__axes.add_line(line1)
+        self.refreshLegend()
+    
+    # Copies data of visible rows into the Line2D of their style groups.
+    def __updateGroups(self):
+        if not (self.__grouped and self.__groupsDirty):
+            return
+        self.__groupsDirty = False
+        separator = numpy.array([numpy.nan])
+        parts = {}
+        for line1 in self.__lines:
+            if not line1.get_visible():
+                continue
+            key = (line1.get_color(), line1.get_lw(), line1.get_linestyle(), line1.get_marker(), line1.get_ms())
+            if key not in parts:
+                parts[key] = ([], [])
+            x, y = line1.get_xdata(), line1.get_ydata()
+            if line1.get_marker() != 'None':
+                x, y = x[::line1.get_markevery()], y[::line1.get_markevery()]
+            parts[key][0].extend((x, separator))
+            parts[key][1].extend((y, separator))
+        for key in list(self.__groups):
+            if key not in parts:
+                self.__groups.pop(key).remove()
+        for key, (xs, ys) in parts.items():
+            if key in self.__groups:
+                self.__groups[key].set_data(numpy.concatenate(xs), numpy.concatenate(ys))
+            else:
+                color1, lw1, linestyle1, marker1, ms1 = key
+                self.__groups[key] = mpl_lines.Line2D(numpy.concatenate(xs), numpy.concatenate(ys), \
+                    c = color1, lw = lw1, linestyle = linestyle1, marker = marker1, ms = ms1, \
+                    fillstyle = 'full', label = '_group', animated = True)
+                self.__axes.add_line(self.__groups[key])
+    
+    def __applyLegend(self):
         if self.__visibleCount > 0 and self.__legendOn:
             if self.__axes.get_legend() != None:
                 self.__axes.get_legend().remove()
-            self.__axes.legend(fontsize = PlotListModel.fontSize)           
+            if self.__grouped:
+                # Rows are not artists of the axes then, so are given as handles.
+                legend1 = self.__axes.legend(handles = [line1 for line1 in self.__lines \
+                    if line1.get_visible()], fontsize = PlotListModel.fontSize)
+            else:
+                legend1 = self.__axes.legend(fontsize = PlotListModel.fontSize)
+            legend1.set_animated(True)
         else:
             if self.__axes.get_legend() != None:
                 self.__axes.get_legend().remove()
         # debug: print(self.__axes.get_children())
                 
-    def refreshStyle(self):
-        for line1 in self.__axes.lines:
+    def __applyStyle(self):
+        self.__groupsDirty = True
+        for line1 in self.__lines:
             line1.set_lw(PlotListModel.lineWidth)
             line1.set_ms(PlotListModel.lineWidth * PlotListModel.markerRatio)
-            y = 1 if len(line1.get_xdata()) < PlotListModel.maxMarkers \
-                else int(len(line1.get_xdata()) / PlotListModel.maxMarkers)
-            line1.set_markevery(y)
+            line1.set_markevery(self.__markEvery(len(line1.get_xdata())))
+        self.__preview.set_lw(PlotListModel.lineWidth)
         self.__axes.set_xlabel(self.__axes.get_xlabel(), fontsize = PlotListModel.fontSize)                    
         self.__axes.tick_params(labelsize = PlotListModel.fontSize)
         self.__axes.tick_params(which = 'both', bottom = 'on', top = 'on', left = 'on', right = 'on')
-        self.refreshLegend()
             
     def autoResizeAxes(self):
         if self.__visibleCount > 0:
-            x0 = min([min(l.get_xdata()) for l in self.__axes.lines if l.get_visible()])
-            x1 = max([max(l.get_xdata()) for l in self.__axes.lines if l.get_visible()])            
-            y0 = min([min(l.get_ydata()) for l in self.__axes.lines if l.get_visible()])
-            y1 = max([max(l.get_ydata()) for l in self.__axes.lines if l.get_visible()])
+            # Uses bounds of the full-resolution data, as lines may only hold the visible part.
+            if self.__extent is None:
+                bounds = numpy.array([self.__bounds[row] for row, l in enumerate(self.__lines) if l.get_visible()])
+                lows = numpy.fmin.reduce(bounds, axis = 0)
+                highs = numpy.fmax.reduce(bounds, axis = 0)
+                self.__extent = (lows[0], highs[1], lows[2], lows[3], highs[4], lows[5])
+            x0, x1, x0Positive, y0, y1, y0Positive = self.__extent
             if self.__axes.get_xscale() == 'log':
-                x0f = x0
+                x0f = x0Positive
                 x1f = x1
             else:
                 x0f = x0 - (x1 - x0) * self.__xmargin
                 x1f = x1 + (x1 - x0) * self.__xmargin
             if self.__axes.get_yscale() == 'log':
-                y0f = y0
+                y0f = y0Positive
                 y1f = y1
             else:
                 y0f = y0 - (y1 - y0) * self.__xmargin
                 y1f = y1 + (y1 - y0) * self.__xmargin    
-            self.__axes.set_xlim(x0f, x1f)
-            self.__axes.set_ylim(y0f, y1f)
-            return (x0f, x1f, y0f, y1f)
+            # No finite (or, on log axes, positive) data to fit to.
+            if not numpy.all(numpy.isfinite((x0f, x1f, y0f, y1f))):
+                return (0, 0, 0, 0)
+            # Unchanged limits are not set again, which would decimate all lines again.
+            if tuple(self.__axes.get_xlim()) != (x0f, x1f):
+                self.__axes.set_xlim(x0f, x1f)
+            if tuple(self.__axes.get_ylim()) != (y0f, y1f):
+                self.__axes.set_ylim(y0f, y1f)
+            return (float(x0f), float(x1f), float(y0f), float(y1f))
         else:
             return (0, 0, 0, 0)
             
-    def refreshLayout(self):
-        self.__axes.get_figure().tight_layout()
-        self.__axes.get_figure().canvas.draw()
-        
     def redrawAll(self):
         x0, x1, y0, y1 = self.autoResizeAxes()
         self.refreshStyle()
@@ -347,10 +878,7 @@ class PlotListModel(QtCore.QAbstractTableModel):
                 
     # Mandatary functions for Qt.
     def rowCount(self, parent = QtCore.QModelIndex()):
-        if self.__axes:
-            return len(self.__axes.lines)
-        else:
-            return 0
+        return len(self.__lines)
         
     def columnCount(self, parent = QtCore.QModelIndex()):
         return 3
@@ -385,7 +913,7 @@ class PlotListModel(QtCore.QAbstractTableModel):
         if index.isValid() and index.row() < self.rowCount() and index.column() < self.columnCount():
             row = index.row()
             col = index.column()
-            line1 = self.__axes.lines[row]
+            line1 = self.__lines[row]
             if col == 0 and role == QtCore.Qt.CheckStateRole:
                 if line1.get_visible():
                     if line1.get_marker() == 'None' and line1.get_linestyle() != 'None':
@@ -397,7 +925,12 @@ class PlotListModel(QtCore.QAbstractTableModel):
             elif col == 0 and (role == QtCore.Qt.EditRole or role == QtCore.Qt.DisplayRole):
                 return self.__names[row]
             elif col == 0 and role == QtCore.Qt.UserRole:
-                return (line1.get_xdata(), line1.get_ydata())
+                return (self.__xData[row], self.__y(row))
+            elif col == 0 and role == QtCore.Qt.ToolTipRole and self.__derived[row] is not None:
+                lineage = self.__derived[row].lineage()
+                if len(lineage) > PlotListModel.maxLineage:
+                    lineage = lineage[:PlotListModel.maxLineage] + '...'
+                return self.__names[row] + '\n= ' + lineage
             elif col == 1 and role == QtCore.Qt.DecorationRole:
                 pixmap1 = QtGui.QPixmap(16, 16)
                 # Qt and MPL use different definitions for RGBa hex strings!
@@ -419,22 +952,31 @@ class PlotListModel(QtCore.QAbstractTableModel):
         minRow = indices[0].row()
         maxRow = indices[0].row()
         changed = False
+        shown = []
         for index, value in zip(indices, values):
             if index.isValid() and index.row() < self.rowCount() and index.column() < self.columnCount():
                 row = index.row()
                 col = index.column()
-                line1 = self.__axes.lines[row]
+                line1 = self.__lines[row]
                 if col == 0 and role == QtCore.Qt.CheckStateRole:            
                     if value == QtCore.Qt.Unchecked:
                         if line1.get_visible():
                             self.__visibleCount -= 1
+                            self.__extent = None
                             line1.set_visible(False)
                             line1.set_label('_' + self.__names[row])                    
+                            if self.__derived[row] is not None:
+                                self.__yData[row] = self.__derived[row].cache = None
+                                line1.set_data([], [])
+                                line1.recache(always = True)
                     else:
                         if not line1.get_visible():
                             self.__visibleCount += 1
+                            self.__extent = None
                             line1.set_visible(True)
                             line1.set_label(self.__names[row])                    
+                            if self.__yData[row] is None:
+                                shown.append(row)
                         if value == QtCore.Qt.Checked:
                             line1.set_linestyle(self.__linestyles[row])
                             line1.set_marker('None')
@@ -456,8 +998,8 @@ class PlotListModel(QtCore.QAbstractTableModel):
                             if splitNewName[2] == 'g':
                                 for i in range(self.rowCount()):
                                     self.__names[i] = self.__names[i].replace(splitNewName[0], splitNewName[1])
-                                    if self.__axes.lines[i].get_visible():
-                                        self.__axes.lines[i].set_label(self.__names[i])
+                                    if self.__lines[i].get_visible():
+                                        self.__lines[i].set_label(self.__names[i])
                                 minRow = 0
                                 maxRow = self.rowCount() - 1
                             elif splitNewName[2] == '':
@@ -485,52 +1027,146 @@ class PlotListModel(QtCore.QAbstractTableModel):
                     minRow = row
                 elif row > maxRow:
                     maxRow = row
+        # Derived rows shown again are evaluated in row order, so that parents, which come before the
+        # rows derived from them, are kept and not evaluated again for each of those.
+        for row in sorted(shown):
+            self.__yData[row] = self.__derived[row].cache = self.__derived[row].evaluate()
+        if shown:
+            self.__decimate(shown)
         if changed:
             self.dataChanged.emit(self.index(minRow, 0), self.index(maxRow, self.columnCount() - 1))
+            self.__groupsDirty = True
             self.refreshLegend()
-            self.refreshLayout()
         return changed
+    
+    # y data of a row; hidden derived rows are evaluated, without keeping the result.
+    def __y(self, row):
+        if self.__yData[row] is None:
+            return self.__derived[row].evaluate()
+        return self.__yData[row]
                   
-    def appendRow(self, nameStrings, dataXs, dataYs, parent = QtCore.QModelIndex()):    
+    # Rows as a TraceSet, for the operations in pyqtsfplotter_core.
+    def traces(self, rows):
+        return pyqtsfplotter_core.TraceSet([self.__names[row] for row in rows], \
+            [self.__xData[row] for row in rows], [self.__y(row) for row in rows], \
+            [self.__derived[row] for row in rows])
+    
+    # Rows, styles and axes as a session state (see pyqtsfplotter_session). Arrays and derived traces
+    # are stored by session; hidden derived rows as their expressions only, like they are kept here.
+    def sessionState(self, session):
+        rows = []
+        for row in range(self.rowCount()):
+            line1 = self.__lines[row]
+            checkState = self.data(self.index(row, 0), QtCore.Qt.CheckStateRole)
+            rows.append({'name': self.__names[row], 'x': session.array(self.__xData[row]), \
+                'y': None if self.__yData[row] is None else session.array(self.__yData[row]), \
+                'derived': None if self.__derived[row] is None else session.derived(self.__derived[row]), \
+                'color': mpl_colors.to_hex(line1.get_color(), keep_alpha = True), \
+                'lineStyle': self.__linestyles[row], \
+                'checkState': int(QtCore.Qt.Checked if checkState is None else checkState)})
+        return {'rows': rows, 'xScale': self.__axes.get_xscale(), 'yScale': self.__axes.get_yscale(), \
+            'xLimits': list(self.__axes.get_xlim()), 'yLimits': list(self.__axes.get_ylim())}
+    
+    # Appends the rows of a session state made by sessionState(), and restores the axes.
+    def restoreSession(self, state, session):
+        rows = state['rows']
+        derived = [None if row1['derived'] is None else session.derived(row1['derived']) for row1 in rows]
+        ys = [session.array(row1['y']) if row1['y'] is not None else derived1.evaluate() \
+            for row1, derived1 in zip(rows, derived)]
+        first = self.rowCount()
+        if rows:
+            self.appendRow([row1['name'] for row1 in rows], [session.array(row1['x']) for row1 in rows], ys, \
+                derived = derived)
+            # Derived rows refer to the y data kept by the rows they came from, not to another copy.
+            for row, row1 in enumerate(rows, first):
+                if row1['derived'] is None:
+                    session.shareArray(row1['y'], self.__yData[row])
+            for col, key, role in ((1, 'color', QtCore.Qt.EditRole), (2, 'lineStyle', QtCore.Qt.EditRole), \
+                    (0, 'checkState', QtCore.Qt.CheckStateRole)):
+                self.setData([self.index(row, col) for row in range(first, self.rowCount())], \
+                    [row1[key] for row1 in rows], role)
+        self.__axes.set_xscale(state['xScale'])
+        self.__axes.set_yscale(state['yScale'])
+        self.__axes.set_xlim(*state['xLimits'])
+        self.__axes.set_ylim(*state['yLimits'])
+        self.refreshStyle()
+        self.refreshLayout()
+    
+    # derived: DerivedTrace of each new row (see TraceSet.derived), or None.
+    def appendRow(self, nameStrings, dataXs, dataYs, parent = QtCore.QModelIndex(), derived = None):    
         count = min(len(nameStrings), len(dataXs), len(dataYs))
+        derived = derived or [None] * count
         count1 = 0
         self.beginInsertRows(parent, self.rowCount(), self.rowCount() + count - 1)
         xDataError = QtWidgets.QMessageBox.No
         altX = None
-        for nameString, dataX, dataY in zip(nameStrings, dataXs, dataYs):
+        # Rows given the same x array object, e.g. results of TraceSet operations, share one converted
+        # x array, and their bounds are found at once. dataXs keeps the objects alive, so ids are unique.
+        # x arrays of rows are read-only; read-only float arrays given that own their data, e.g. x of
+        # other rows, are shared. Read-only views, e.g. of editable axes, may still change, so are copied.
+        converted = {}
+        newRows = {}
+        # Rows that will be grouped are never added to the axes one by one.
+        self.__updateGrouped(self.rowCount() + count)
+        for nameString, dataX, dataY, derived1 in zip(nameStrings, dataXs, dataYs, derived):
             newName = str(nameString)
             # If too many points, mark every total /  maxMarkers instead.
             y = 1 if len(dataX) < PlotListModel.maxMarkers else int(len(dataX) / PlotListModel.maxMarkers)
             # Accounts for dataX is a list of str situation: tries to convert to number.
             # If fails, uses negative axis as x axis, and keeps dataX as annotations.            
-            try:
-                altX = [float(x) for x in dataX]
-            except ValueError:                    
+            if id(dataX) not in converted:
+                # Memory-mapped arrays are copied, so that rows don't keep cache files open.
+                if type(dataX) is numpy.ndarray and dataX.dtype == numpy.float64 \
+                        and dataX.ndim == 1 and not dataX.flags.writeable and dataX.flags.owndata:
+                    altX, issue = dataX, None
+                else:
+                    altX, issue = pyqtsfplotter_core.numericAxis(dataX)
+                    if altX is not None:
+                        altX.setflags(write = False)
+                converted[id(dataX)] = (altX, issue, issue is not None or bool(numpy.all(altX[1:] >= altX[:-1])))
+            altX, issue, ascending = converted[id(dataX)]
+            if issue:
                 if xDataError != QtWidgets.QMessageBox.YesToAll and xDataError != QtWidgets.QMessageBox.NoToAll:
                     xDataError = QtWidgets.QMessageBox.question(None, 'Invalid X-Axis Data.', \
-                        'Texts instead of numbers found in x-axis data.\n' \
+                        issue.message + '\n' \
                         + 'This will lead to wacky plot behavior. Still use them?', \
                         QtWidgets.QMessageBox.Yes | QtWidgets.QMessageBox.YesToAll \
                         | QtWidgets.QMessageBox.No | QtWidgets.QMessageBox.NoToAll, \
                         QtWidgets.QMessageBox.No)
                 if xDataError == QtWidgets.QMessageBox.Yes or xDataError == QtWidgets.QMessageBox.YesToAll:
-                    altX = (range(-len(dataX) * 10, 0, 10))
+                    altX = numpy.arange(-len(dataX) * 10, 0, 10, dtype = numpy.float64)
                     self.__annotations.append(dataX)
                 else:
-                    altX = None
                     count1 += 1
             else:
                 self.__annotations.append(None)
-            finally:
-                if altX:
-                    self.__axes.plot(numpy.array(altX), numpy.array(dataY), \
-                        lw = PlotListModel.lineWidth, c = self.__nextColor(), \
-                        ms = PlotListModel.lineWidth * PlotListModel.markerRatio, fillstyle = 'full', \
-                        label = newName, marker = 'None', linestyle = '-', markevery = y) 
-                    self.__names.append(copy.deepcopy(newName))
-                    self.__linestyles.append('-')
-                    self.__visibleCount += 1
+            if altX is not None and len(altX):
+                self.__xData.append(altX)
+                self.__yData.append(numpy.array(dataY, dtype = numpy.float64))
+                self.__derived.append(derived1)
+                if derived1 is not None:
+                    derived1.cache = self.__yData[-1]
+                self.__ascending.append(ascending)
+                self.__bounds.append(None)
+                newRows.setdefault((id(altX), len(self.__yData[-1])), []).append(len(self.__xData) - 1)
+                line1 = mpl_lines.Line2D(self.__xData[-1], self.__yData[-1], \
+                    lw = PlotListModel.lineWidth, c = self.__nextColor(), \
+                    ms = PlotListModel.lineWidth * PlotListModel.markerRatio, fillstyle = 'full', \
+                    label = newName, marker = 'None', linestyle = '-', markevery = y, animated = True)
+                if not self.__grouped:
+                    self.__axes.add_line(line1)
+                self.__lines.append(line1)
+                self.__names.append(copy.deepcopy(newName))
+                self.__linestyles.append('-')
+                self.__visibleCount += 1
+        for rows in newRows.values():
+            bounds = pyqtsfplotter_core.traceBounds(self.__xData[rows[0]], [self.__yData[row] for row in rows])
+            for row, bounds1 in zip(rows, bounds):
+                self.__bounds[row] = bounds1
+        self.__decimate(range(self.rowCount() - count + count1, self.rowCount()))
+        self.__extent = None
         self.endInsertRows()
+        self.__updateGrouped()
         # This is used for fixing cosmetic error.
         if count1:
             self.beginRemoveRows(parent, self.rowCount(), self.rowCount() + count1 - 1)
@@ -541,11 +1177,27 @@ class PlotListModel(QtCore.QAbstractTableModel):
         if count > 0 and row + count <= self.rowCount():
             self.beginRemoveRows(parent, row, row + count - 1)
             rmVisibleCount = len([row for line1 in \
-                self.__axes.lines[row : row + count] if line1.get_visible()])
+                self.__lines[row : row + count] if line1.get_visible()])
+            if not self.__grouped:
+                for line1 in self.__lines[row : row + count]:
+                    line1.remove()
             del self.__names[row : row + count]
-            del self.__axes.lines[row : row + count]
+            del self.__xData[row : row + count]
+            del self.__yData[row : row + count]
+            # Rows derived from removed ones evaluate them from their parents from now on.
+            for derived1 in self.__derived[row : row + count]:
+                if derived1 is not None:
+                    derived1.cache = None
+            del self.__derived[row : row + count]
+            del self.__ascending[row : row + count]
+            self.__scaledX = {}
+            del self.__bounds[row : row + count]
+            self.__extent = None
+            del self.__lines[row : row + count]
             del self.__linestyles[row : row + count]
             self.__visibleCount -= rmVisibleCount
+            self.__groupsDirty = True
             self.endRemoveRows()
+            self.__updateGrouped()
             return True
         return False
@@ -0,0 +1,203 @@
+#!/usr/bin/python3
+# Session files, holding the whole workspace: parsed data files, plotted traces with their styles, and
+# plot settings, so that it can be restored without parsing any file or redoing any trace arithmetic.
+# Doesn't need Qt; the models and the window put their state into a SessionWriter and take it back
+# from a SessionReader.
+#
+# Layout of a session file:
+#   a line naming the format,
+#   a JSON line with the state, padded with spaces so that the data after it starts at a multiple of 64 bytes,
+#   the arrays listed in the state under 'arrays' as [offset after the JSON line, dtype, shape], each
+#     starting at a multiple of 64 bytes.
+# Arrays are referred to in the state by their index in that list. An array shared by several traces,
+# e.g. their x-axis, is stored once. Derived traces (see pyqtsfplotter_core.DerivedTrace) are stored as
+# their expressions, in the list under 'derived', parents before the traces derived from them.
+# Arrays are memory-mapped when read, so a session opens without reading its data, which is paged in
+# when traces are drawn or files are viewed.
+
+import json
+import os
+from os import path
+
+import numpy
+
+import pyqtsfplotter_core
+from pyqtsfplotter_core import DataFileObject, DerivedTrace, LowRankMatrix, Issue
+
+sessionExtension = '.sfs'
+sessionMagic = b'PYQTSFPLOTTER SESSION\n'
+# Version of the layout. Files of other versions are not read.
+version = 1
+
+# Collects arrays and derived traces while the state of a session is put together, then writes them.
+class SessionWriter(object):
+    def __init__(self):
+        super().__init__()
+        self.__arrays = []
+        # Index of each array and DerivedTrace by id; the objects are kept in the lists, so ids stay unique.
+        self.__arrayIndices = {}
+        self.__derived = []
+        self.__derivedIndices = {}
+
+    # Index of an array in the session, adding it if new.
+    def array(self, array1):
+        index = self.__arrayIndices.get(id(array1))
+        if index is None:
+            index = self.__arrayIndices[id(array1)] = len(self.__arrays)
+            self.__arrays.append(array1)
+        return index
+
+    # Index of a DerivedTrace in the session, adding it and its parents if new. Its cache is not stored.
+    def derived(self, trace):
+        index = self.__derivedIndices.get(id(trace))
+        if index is None:
+            parents = [['derived', self.derived(parent)] if isinstance(parent, DerivedTrace) \
+                else ['array', self.array(parent)] for parent in trace.parents]
+            index = self.__derivedIndices[id(trace)] = len(self.__derived)
+            self.__derived.append({'op': trace.op, 'parents': parents, 'names': trace.names, \
+                'value': self.__value(trace.value)})
+        return index
+    
+    # Value of a DerivedTrace, with arrays in it, e.g. the x-axes of a resampled trace, as arrays of the session.
+    def __value(self, value):
+        if isinstance(value, numpy.ndarray):
+            return {'array': self.array(value)}
+        elif isinstance(value, (tuple, list)):
+            return [self.__value(x) for x in value]
+        return value
+
+    # State of a DataFileObject: its blocks parsed so far, denoised ones, and standard deviations of rebinned
+    # ones, as arrays of the session.
+    def dataFile(self, file1):
+        blockData, lowRank = file1.parsedBlocks()
+        return {'fileName': file1.fName, 'blocks': file1.blocks, 'currentBlock': file1.currentBlock(), \
+            'parsed': [[block, self.array(z), self.array(w), self.array(t)] \
+                for block, (z, w, t) in sorted(blockData.items())], \
+            'lowRank': [[block, self.array(matrix1.US), self.array(matrix1.Vt)] \
+                for block, matrix1 in sorted(lowRank.items())], \
+            'stdDevs': [[block, self.array(stdDev)] for block, stdDev in sorted(file1.stdDevs.items())]}
+
+    # Writes state and the arrays referred to in it. The file is replaced only once completely written,
+    # so a failed save leaves it as it was. On Windows, a file whose arrays are still memory-mapped, e.g.
+    # the session the arrays were read from, can't be replaced; see mappedFile(). Returns None, or an Issue.
+    def write(self, fileName, state):
+        state = dict(state, version = version, derived = self.__derived)
+        # Labels, e.g. KinTek column names, are stored as strings.
+        arrays = [numpy.array([str(x) for x in array1]) if array1.dtype == object else array1 \
+            for array1 in self.__arrays]
+        offset = 0
+        state['arrays'] = []
+        for array1 in arrays:
+            state['arrays'].append([offset, array1.dtype.str, list(array1.shape)])
+            offset += -(-array1.size * array1.dtype.itemsize // 64) * 64
+        tempFile = fileName + '.' + str(os.getpid()) + '.tmp'
+        try:
+            header = json.dumps(state, default = jsonNumber).encode()
+            with open(tempFile, 'wb') as f1:
+                f1.write(sessionMagic + pyqtsfplotter_core.padHeader(header, len(sessionMagic)))
+                start = f1.tell()
+                for array1, (offset, dtype, shape) in zip(arrays, state['arrays']):
+                    f1.seek(start + offset)
+                    self.__writeArray(f1, array1)
+            os.replace(tempFile, fileName)
+        except (OSError, TypeError, ValueError) as error:
+            if path.exists(tempFile):
+                os.remove(tempFile)
+            return Issue(pyqtsfplotter_core.WRITE_ERROR, str(error), fileName)
+        return None
+
+    # Writes large arrays, e.g. memory-mapped ones, a chunk of rows at a time.
+    def __writeArray(self, f1, array1):
+        if array1.ndim < 2:
+            numpy.ascontiguousarray(array1).tofile(f1)
+            return
+        chunkRows = max(pyqtsfplotter_core.exportChunkValues // max(array1[0].size, 1), 1)
+        for i in range(0, len(array1), chunkRows):
+            numpy.ascontiguousarray(array1[i : i + chunkRows]).tofile(f1)
+
+# NumPy scalars in the state, e.g. values of trace arithmetic, are written as numbers.
+def jsonNumber(x):
+    if isinstance(x, numpy.generic):
+        return x.item()
+    raise TypeError(repr(x) + ' is not JSON serializable')
+
+# Reads a session file: its state, and its arrays and derived traces on demand.
+class SessionReader(object):
+    def __init__(self, fileName, state, start):
+        super().__init__()
+        self.fileName = fileName
+        self.state = state
+        self.__start = start
+        self.__arrays = {}
+        self.__derived = {}
+
+    # Array of index, memory-mapped and read-only. Labels are returned as an object array.
+    # The same object is returned for the same index, so traces sharing an array still share it.
+    def array(self, index):
+        if index not in self.__arrays:
+            offset, dtype, shape = self.state['arrays'][index]
+            if numpy.prod(shape):
+                array1 = numpy.memmap(self.fileName, dtype = dtype, mode = 'r', \
+                    offset = self.__start + offset, shape = tuple(shape))
+            else:
+                array1 = numpy.empty(shape, dtype = dtype)
+            if array1.dtype.kind == 'U':
+                array1 = numpy.array(array1, dtype = object)
+            self.__arrays[index] = array1
+        return self.__arrays[index]
+
+    # DerivedTrace of index, built with its parents on first use, without cache.
+    def derived(self, index):
+        if index not in self.__derived:
+            entry = self.state['derived'][index]
+            parents = [self.derived(ref) if kind == 'derived' else self.array(ref) \
+                for kind, ref in entry['parents']]
+            self.__derived[index] = DerivedTrace(entry['op'], parents, entry['names'], self.__value(entry['value']))
+        return self.__derived[index]
+    
+    # Value of a DerivedTrace as stored by SessionWriter.
+    def __value(self, value):
+        if isinstance(value, dict):
+            return self.array(value['array'])
+        elif isinstance(value, list):
+            return [self.__value(x) for x in value]
+        return value
+
+    # Replaces array index by array1, e.g. a copy of it kept by a plot, in the derived traces built so far
+    # and those built from now on, so that they share it.
+    def shareArray(self, index, array1):
+        old = self.array(index)
+        self.__arrays[index] = array1
+        for trace in self.__derived.values():
+            trace.parents = [array1 if parent is old else parent for parent in trace.parents]
+
+    # DataFileObject from its state as made by SessionWriter.dataFile(), without reading the file.
+    def dataFile(self, entry):
+        blockData = {block: (self.array(z), self.array(w), self.array(t)) for block, z, w, t in entry['parsed']}
+        lowRank = {block: LowRankMatrix(self.array(US), self.array(Vt)) for block, US, Vt in entry['lowRank']}
+        file1 = DataFileObject(entry['fileName'], entry['blocks'], (blockData, lowRank))
+        file1.stdDevs = {block: self.array(stdDev) for block, stdDev in entry.get('stdDevs', [])}
+        file1.setCurrentBlock(entry['currentBlock'])
+        return file1
+
+# True if fileName can't be written while the arrays of session file mappedName are memory-mapped:
+# on Windows, a mapped file can't be replaced, so a session can't be saved over the one it was opened from.
+def mappedFile(fileName, mappedName):
+    if os.name != 'nt' or not mappedName or not path.exists(fileName) or not path.exists(mappedName):
+        return False
+    return path.samefile(fileName, mappedName)
+
+# Returns (SessionReader, None), or (None, Issue) if fileName isn't a session file that can be read.
+def readSession(fileName):
+    try:
+        with open(fileName, 'rb') as f1:
+            if f1.readline() != sessionMagic:
+                return None, Issue(pyqtsfplotter_core.INVALID_DATA, fileName + ' is not a session file.', fileName)
+            state = json.loads(f1.readline().decode())
+            start = f1.tell()
+    except (OSError, ValueError) as error:
+        return None, Issue(pyqtsfplotter_core.READ_ERROR, str(error), fileName)
+    if state.get('version') != version:
+        return None, Issue(pyqtsfplotter_core.INVALID_DATA, fileName \
+            + ' was saved by another version of this program.', fileName)
+    return SessionReader(fileName, state, start), None